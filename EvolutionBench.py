@@ -0,0 +1,294 @@
+# Evolution Simulator benchmarks
+# Times the generation phases of EvolutionSim.py, and of EvolutionSim_old.py for comparison,
+# over a range of population sizes and saves the results as JSON.
+
+import argparse
+import json
+import multiprocessing
+import platform
+import random
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import EvolutionSim
+import EvolutionSim_old
+
+
+class Case(object):
+
+    def __init__(self, target, phase, size, seed):
+        """
+        One benchmark: a phase run on a population of a given size.
+        :param target: string, one of TARGETS
+        :param phase: string, one of PHASES
+        :param size: int, number of organisms in the population
+        :param seed: int, seed for building the population and for the run itself
+        :return: Case object
+        """
+        self.target = target
+        self.phase = phase
+        self.size = size
+        self.seed = seed
+
+    def module(self):
+        return EvolutionSim_old if self.target == 'old' else EvolutionSim
+
+    def build(self):
+        """
+        Builds a fresh world: size organisms living in the Forest, with random genomes of
+        2 to 6 bases, random birth rates and random ages, all from self.seed.
+        :return: tuple of (Ecosystem object, the Forest's list of Organism objects)
+        """
+        module = self.module()
+        rand = random.Random(self.seed)
+        habitats = [module.Habitat(habitat.name, habitat.temp, habitat.water_avail, list(habitat.food_avail), [], [])
+                    for habitat in module.HABITATS]
+        forest = habitats[0]
+        organisms = []
+        for i in xrange(self.size):
+            genome = ''.join([rand.choice('abcd') for j in xrange(rand.randint(2, 6))])
+            birth_rate = rand.randint(1, 2)
+            life_span = rand.randint(1, 4)
+            if self.target == 'old':
+                organisms.append(module.Organism(genome, module.Traits(forest.temp, forest.water_avail, ['leaves'],
+                                                                       1, birth_rate, life_span)))
+            else:
+                organisms.append(module.Organism(genome, module.Traits(forest.temp, forest.water_avail, ['leaves'],
+                                                                       1, birth_rate), life_span))
+        forest.wildlife = organisms
+        random.seed(self.seed)
+        if self.target == 'old':
+            world = module.Ecosystem(habitats)
+        else:
+            world = module.Ecosystem(habitats, engine=self.target, seed=self.seed)
+        return world, organisms
+
+    def run_once(self):
+        """
+        Builds the world, then runs and times the phase once.
+        :return: tuple of (seconds, number of organisms the phase processed)
+        """
+        world, organisms = self.build()
+        forest = world.habitats[0]
+        if self.phase == 'migrate':
+            world.breed_all()
+            # The array engines hold newborns themselves; the others breed into Habitat.new_gen.
+            if getattr(getattr(world, 'engine', None), 'new_gen', None) is not None:
+                count = sum([len(population) for population in world.engine.new_gen])
+            else:
+                count = sum([len(habitat.new_gen) for habitat in world.habitats])
+            start = time.time()
+            world.migrate()
+        elif self.phase == 'breed_wildlife':
+            count = len(organisms)
+            start = time.time()
+            forest.breed_wildlife()
+        elif self.phase == 'organism_breed':
+            count = len(organisms)
+            start = time.time()
+            for mom, dad in zip(organisms, organisms[1:] + organisms[:1]):
+                mom.breed(dad)
+        elif self.phase == 'express_genes':
+            count = len(organisms)
+            start = time.time()
+            for organism in organisms:
+                organism.express_genes()
+        elif self.phase == 'age_all':
+            count = len(organisms)
+            start = time.time()
+            world.age_all()
+        elif self.phase == 'remove_all_dead':
+            count = len(organisms)
+            start = time.time()
+            world.remove_all_dead()
+        else:
+            count = len(organisms)
+            start = time.time()
+            world.breed_all()
+            world.migrate()
+            world.age_all()
+            world.remove_all_dead()
+        return time.time() - start, count
+
+    def peak_memory(self):
+        """
+        Runs the phase once more under tracemalloc, where it exists, for the peak bytes
+        allocated by Python including the population itself.
+        :return: int bytes, None without tracemalloc
+        """
+        if tracemalloc is None:
+            return None
+        tracemalloc.start()
+        try:
+            self.run_once()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def run(self, repeat):
+        """
+        :param repeat: int, number of timed runs, the fastest is reported
+        :return: dict of results, suitable for json.dumps
+        """
+        timings = [self.run_once() for i in range(repeat)]
+        seconds, count = min(timings)
+        result = {'target': self.target, 'phase': self.phase, 'size': self.size, 'seed': self.seed,
+                  'seconds': seconds, 'organisms': count,
+                  'organisms_per_second': count / seconds if seconds else None,
+                  'peak_bytes': self.peak_memory(), 'memory_source': 'tracemalloc'}
+        if result['peak_bytes'] is None and resource is not None:
+            # Without tracemalloc the best measure is the peak resident size of the
+            # process, which runs this case alone.
+            result['peak_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+            result['memory_source'] = 'ru_maxrss'
+        return result
+
+
+def _run_case(connection, case, repeat):
+    try:
+        connection.send(('ok', case.run(repeat)))
+    except Exception as error:
+        connection.send(('error', repr(error)))
+
+
+def run_case(case, repeat, timeout):
+    """
+    Runs a case in its own process, so its memory peak is its own and a case that runs
+    too long can be stopped.
+    :param case: Case object
+    :param repeat: int, timed runs
+    :param timeout: number, seconds before the case is given up, None to wait forever
+    :return: dict of results; 'status' is 'ok', 'timeout' or 'error'
+    """
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_run_case, args=(sender, case, repeat))
+    process.start()
+    result = None
+    if receiver.poll(timeout):
+        status, result = receiver.recv()
+    else:
+        status = 'timeout'
+    process.join(1)
+    if process.is_alive():
+        process.terminate()
+        process.join()
+    if status != 'ok':
+        result = {'target': case.target, 'phase': case.phase, 'size': case.size, 'seed': case.seed,
+                  'error': result}
+    result['status'] = status
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """
+    Matches results with a baseline run by target, phase and size.
+    :param results: list of result dicts
+    :param baseline: list of result dicts from an earlier run
+    :param tolerance: float, the fraction of throughput a case may lose before it counts as a regression
+    :return: list of (result, baseline result, throughput ratio, True if a regression) tuples
+    """
+    earlier = dict([((result['target'], result['phase'], result['size']), result)
+                    for result in baseline if result.get('status') == 'ok'])
+    rows = []
+    for result in results:
+        before = earlier.get((result['target'], result['phase'], result['size']))
+        if before is None or result.get('status') != 'ok':
+            continue
+        if not result['organisms_per_second'] or not before['organisms_per_second']:
+            continue
+        ratio = result['organisms_per_second'] / before['organisms_per_second']
+        rows.append((result, before, ratio, ratio < 1 - tolerance))
+    return rows
+
+
+def print_result(result, out=sys.stdout):
+    if result['status'] != 'ok':
+        print >> out, "{:8} {:16} {:>8}  {}".format(result['target'], result['phase'], result['size'], result['status'])
+        return
+    peak = result['peak_bytes']
+    print >> out, "{:8} {:16} {:>8}  {:>14,.0f} organisms/s  {:>10} peak".format(
+        result['target'], result['phase'], result['size'], result['organisms_per_second'] or 0,
+        '{:.1f} MB'.format(peak / 1e6) if peak is not None else '-')
+
+
+# CONSTANT DECLARATIONS
+TARGETS = ('old', 'object', 'numpy', 'cohort', 'calendar')
+PHASES = ('breed_wildlife', 'organism_breed', 'express_genes', 'migrate', 'age_all', 'remove_all_dead',
+          'generation')
+# Phases that run Organism objects directly, so the array engines have nothing to time
+OBJECT_PHASES = ('breed_wildlife', 'organism_breed', 'express_genes')
+SIZES = (100, 1000, 10000, 100000, 1000000)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the Evolution Simulator's generation phases at a range of population sizes.")
+    parser.add_argument('-t', '--targets', nargs='+', choices=TARGETS, default=['old', 'object'],
+                        help="what to time: EvolutionSim_old.py or an EvolutionSim.py engine (default: %(default)s)")
+    parser.add_argument('--phases', nargs='+', choices=PHASES, default=list(PHASES),
+                        help="phases to time (default: all)")
+    parser.add_argument('--sizes', nargs='+', type=int, default=list(SIZES),
+                        help="population sizes (default: %(default)s)")
+    parser.add_argument('-s', '--seed', type=int, default=1, help="random seed (default: %(default)s)")
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help="timed runs per case, the fastest counts (default: %(default)s)")
+    parser.add_argument('--timeout', type=float, default=300,
+                        help="seconds before a case is given up (default: %(default)s)")
+    parser.add_argument('-o', '--output', help="write the JSON results here")
+    parser.add_argument('-c', '--compare', metavar='PATH',
+                        help="compare with the JSON results of an earlier run and exit with status 1 "
+                             "if any case lost more than --tolerance of its throughput")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="allowed loss of throughput against --compare (default: %(default)s)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    results = []
+    for size in args.sizes:
+        for target in args.targets:
+            for phase in args.phases:
+                if target not in ('old', 'object') and phase in OBJECT_PHASES:
+                    continue
+                result = run_case(Case(target, phase, size, args.seed), args.repeat, args.timeout)
+                print_result(result)
+                results.append(result)
+
+    document = {'version': 1,
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': sys.version.split()[0],
+                'platform': platform.platform(),
+                'seed': args.seed,
+                'repeat': args.repeat,
+                'results': results}
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(document, output, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        regressions = 0
+        print
+        for result, before, ratio, regression in compare(results, baseline, args.tolerance):
+            print "{:8} {:16} {:>8}  {:6.2f}x{}".format(result['target'], result['phase'], result['size'], ratio,
+                                                        '  REGRESSION' if regression else '')
+            regressions += regression
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
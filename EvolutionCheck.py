@@ -0,0 +1,296 @@
+# Evolution Simulator consistency checks
+# The engines of EvolutionSim.py keep the same model in different forms.  These checks compare
+# them with each other and with brute-force recomputation, and exit with status 1 on a mismatch.
+
+import argparse
+import collections
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import EvolutionSim
+
+
+def build_habitats(seed, size, spread=False):
+    """
+    Fresh copies of HABITATS with size random organisms in each.
+    :param seed: int
+    :param size: int, organisms per habitat
+    :param spread: bool, True to give the organisms random temp_tol, water_needed and diet
+                   so many of their children migrate or are lost, False to fit their habitat
+    :return: list of Habitat objects
+    """
+    rand = random.Random(seed)
+    habitats = EvolutionSim.copy_habitats(EvolutionSim.HABITATS)
+    for habitat in habitats:
+        habitat.wildlife = []
+        for i in xrange(size):
+            genome = ''.join([rand.choice(EvolutionSim.BASES) for j in xrange(rand.randint(2, 8))])
+            if spread:
+                traits = EvolutionSim.Traits(rand.randint(3, 5), rand.randint(1, 4), [rand.choice(EvolutionSim.ALL_FOODS)],
+                                             rand.randint(1, 2), rand.randint(1, 3))
+            else:
+                traits = EvolutionSim.Traits(habitat.temp, habitat.water_avail, [rand.choice(habitat.food_avail)],
+                                             1, rand.randint(1, 2))
+            habitat.wildlife.append(EvolutionSim.Organism(genome, traits, rand.randint(1, 4)))
+    return habitats
+
+
+def living_genomes(world, index):
+    """
+    :param world: Ecosystem object
+    :param index: int, a habitat index
+    :return: list of (Genome, count) pairs for the habitat's wildlife, read from the engine
+    """
+    engine = world.engine
+    if isinstance(engine, EvolutionSim.CohortEngine):
+        return [(key[0], count) for key, count in engine.cohorts[index].cohorts.items()]
+    if isinstance(engine, (EvolutionSim.ArrayEngine, EvolutionSim.ParallelEngine)):
+        return [(organism.genome, 1) for organism in engine.populations[index].to_organisms()]
+    if engine is not None:
+        return [(organism.genome, 1) for organism in engine.living(index)]
+    return [(organism.genome, 1) for organism in world.habitats[index].wildlife]
+
+
+def check_philox(directory):
+    """
+    CounterRandom.philox against the Random123 known-answer vectors for Philox4x32-10.
+    """
+    failures = []
+    for counter, key, expected in PHILOX_VECTORS:
+        words = EvolutionSim.CounterRandom.philox(*[np.uint64(word) for word in counter + key])
+        if tuple([int(word) for word in words]) != expected:
+            failures.append("philox{} gave {}".format(counter + key, ['{:08x}'.format(int(word)) for word in words]))
+    return failures
+
+
+def check_tallies(directory):
+    """
+    The HabitatTally counts kept as organisms are born, migrate and die, against a rescan
+    of every habitat after every generation, on each engine that keeps tallies.
+    """
+    failures = []
+    digrams = sorted(EvolutionSim.GENE_EXPRESSION_DICT)
+    for engine in ('object', 'numpy', 'cohort', 'calendar'):
+        for food_supply in (None, 1.0):
+            if engine == 'cohort' and food_supply is not None:
+                continue
+            world = EvolutionSim.Ecosystem(build_habitats(3, 300), engine=engine, seed=3, food_supply=food_supply)
+            world.track_stats()
+            for generation in range(6):
+                world.next_generation()
+                for index, tally in enumerate(world.tallies):
+                    genomes = living_genomes(world, index)
+                    texts = [(str(genome), count) for genome, count in genomes]
+                    bases = [sum([text.count(base) * count for text, count in texts]) for base in EvolutionSim.BASES]
+                    carriers = [sum([count for text, count in texts if digram in text]) for digram in digrams]
+                    lengths = collections.Counter()
+                    for genome, count in genomes:
+                        lengths[genome.length] += count
+                    if (tally.count != sum([count for text, count in texts])
+                            or tally.base_counts().values() != bases
+                            or tally.digram_carriers().values() != carriers
+                            or tally.histogram('genome_len') != sorted(lengths.items())):
+                        failures.append("{} engine, food {}, generation {}, habitat {}: tally does not match "
+                                        "the wildlife".format(engine, food_supply, generation + 1, index))
+            world.close()
+    return failures
+
+
+def check_routing(directory):
+    """
+    SurvivalTable routing, for single newborns and for whole arrays, against a search of
+    every habitat or every neighbor, with and without a graph.
+    """
+    failures = []
+    rand = random.Random(2)
+    count = 200
+    habitats = [EvolutionSim.Habitat('h{}'.format(i), rand.randint(3, 5), rand.randint(1, 4),
+                                     rand.sample(EvolutionSim.ALL_FOODS, rand.randint(1, 2)), [], [])
+                for i in range(count)]
+    edges = [(rand.randrange(count), rand.randrange(count)) for i in range(500)]
+    graphs = [None,
+              EvolutionSim.HabitatGraph.from_edges(count, [(a, b) for a, b in edges if a != b]),
+              EvolutionSim.HabitatGraph.from_edges(count, [(a, b) for a, b in edges if a != b], directed=True)]
+    rows = 5000
+    temp = np.array([rand.randint(3, 5) for i in range(rows)], dtype=np.int8)
+    temp[:3] = 7
+    water = np.array([rand.randint(1, 4) for i in range(rows)], dtype=np.int8)
+    diet = np.array([rand.randint(0, EvolutionSim.FULL_DIET) for i in range(rows)], dtype=np.uint8)
+    birthplace = np.array([rand.randrange(count) for i in range(rows)], dtype=np.int64)
+    newborns = EvolutionSim.ArrayPopulation(temp, water, water, water, water, diet, np.zeros(rows, dtype=np.int64),
+                                            np.zeros(rows, dtype=np.int64), np.zeros(0, dtype=np.uint8))
+    newborns_in_range = newborns.take(np.arange(3, rows))
+
+    def fits(habitat, temp, water, diet):
+        return temp == habitat.temp and water <= habitat.water_avail and diet & habitat.food_mask
+
+    for graph in graphs:
+        table = EvolutionSim.SurvivalTable(habitats, None, graph)
+        expected = []
+        for row in zip(temp.tolist(), water.tolist(), diet.tolist(), birthplace.tolist()):
+            candidates = [row[3]] + (graph.neighbors(row[3]) if graph is not None else range(count))
+            expected.append(next((index for index in candidates if fits(habitats[index], *row[:3])), -1))
+        single = [table.destination_for(*row) for row in zip(temp.tolist(), water.tolist(), diet.tolist(),
+                                                              birthplace.tolist())]
+        if single != expected:
+            failures.append("{}: destination_for differs from the search".format(graph))
+        if table.destinations(newborns, birthplace).tolist() != expected:
+            failures.append("{}: destinations differs from the search".format(graph))
+        if table.destinations(newborns_in_range, birthplace[3:]).tolist() != expected[3:]:
+            failures.append("{}: destinations differs from the search within the table".format(graph))
+    return failures
+
+
+def check_counter_random(directory):
+    """
+    The numpy and parallel engines with counter random numbers, for any number of workers
+    and across a checkpoint, on the built-in habitats and on a grid.
+    """
+    failures = []
+    checkpoint = os.path.join(directory, 'evolution-check.ckpt')
+    worlds = [('habitats', lambda: (build_habitats(5, 200, spread=True), None)),
+              ('grid', lambda: grid_world(6, 6, 15))]
+    for name, make in worlds:
+        results = []
+        for engine, workers, resume in (('numpy', None, None), ('parallel', 1, None), ('parallel', 3, 3),
+                                        ('numpy', None, 3)):
+            habitats, graph = make()
+            world = EvolutionSim.Ecosystem(habitats, engine=engine, seed=21, workers=workers, counter_random=True,
+                                           food_supply=2.0, graph=graph)
+            curve = []
+            for generation in range(6):
+                if generation == resume:
+                    world.save_checkpoint(checkpoint)
+                    world.close()
+                    world = EvolutionSim.Ecosystem.load_checkpoint(checkpoint)
+                world.next_generation()
+                curve.append(world.wildlife_counts())
+            genomes = [sorted([str(genome) for genome, count in living_genomes(world, index)])
+                       for index in range(len(world.habitats))]
+            world.close()
+            results.append(((engine, workers, resume), (curve, genomes)))
+        for run, result in results[1:]:
+            if result != results[0][1]:
+                failures.append("{}: {} differs from {}".format(name, run, results[0][0]))
+    return failures
+
+
+def grid_world(rows, columns, size):
+    """
+    :return: tuple of (list of rows * columns Habitat objects with random conditions and
+             size organisms each, their HabitatGraph)
+    """
+    rand = random.Random(1)
+    habitats = []
+    for i in range(rows * columns):
+        temp, water, foods = rand.randint(3, 5), rand.randint(1, 4), rand.sample(EvolutionSim.ALL_FOODS, 2)
+        wildlife = [EvolutionSim.Organism(''.join([rand.choice(EvolutionSim.BASES) for j in range(rand.randint(2, 6))]),
+                                          EvolutionSim.Traits(temp, rand.randint(1, water), [rand.choice(foods)], 1,
+                                                              rand.randint(1, 2)), rand.randint(1, 4))
+                    for k in range(size)]
+        habitats.append(EvolutionSim.Habitat('p{}'.format(i), temp, water, foods, wildlife, []))
+    return habitats, EvolutionSim.HabitatGraph.grid(rows, columns, diagonal=True)
+
+
+def check_pedigree(directory):
+    """
+    Pedigree ancestor, descendant and origin queries against walks of the recorded parents,
+    kept in memory and spilled to a file.
+    """
+    failures = []
+    for path in (None, os.path.join(directory, 'evolution-check.pedigree')):
+        world = EvolutionSim.Ecosystem(build_habitats(7, 40), seed=7)
+        pedigree = world.track_lineage(path, memory_records=500)
+        for generation in range(5):
+            world.next_generation()
+        records = pedigree.records(np.arange(len(pedigree)))
+        parents = [[int(parent) for parent in (record['mom'], record['dad']) if parent != pedigree.NONE]
+                   for record in records]
+        children = [[] for record in records]
+        for child, pair in enumerate(parents):
+            for parent in pair:
+                children[parent].append(child)
+
+        def walk(start, links):
+            found = set()
+            queue = list(links[start])
+            while queue:
+                ident = queue.pop()
+                if ident not in found:
+                    found.add(ident)
+                    queue.extend(links[ident])
+            return found
+
+        rand = random.Random(len(pedigree))
+        for ident in rand.sample(xrange(len(pedigree)), 30):
+            if pedigree.ancestors([ident]).tolist() != sorted(walk(ident, parents)):
+                failures.append("{}: ancestors of {}".format(path, ident))
+            if pedigree.descendants([ident]).tolist() != sorted(walk(ident, children)):
+                failures.append("{}: descendants of {}".format(path, ident))
+            bit = EvolutionSim.digram_bit('cc')
+            lineage = walk(ident, parents) | set([ident])
+            origins = [other for other in lineage if records[other]['digrams'] & bit
+                       and not any([records[parent]['digrams'] & bit for parent in parents[other]])]
+            if pedigree.origins([ident], 'cc').tolist() != sorted(origins):
+                failures.append("{}: origins of 'cc' in {}".format(path, ident))
+    return failures
+
+
+def check_ensemble(directory):
+    """
+    run_ensemble gives the same curves whatever the number of processes.
+    """
+    one = EvolutionSim.run_ensemble(8, 6, processes=1).curves()
+    several = EvolutionSim.run_ensemble(8, 6, processes=3).curves()
+    return [] if one == several else ["curves differ between 1 and 3 processes"]
+
+
+# CONSTANT DECLARATIONS
+# Random123 known-answer vectors for Philox4x32-10: (counter, key, output)
+PHILOX_VECTORS = (((0, 0, 0, 0), (0, 0), (0x6627e8d5, 0xe169c58d, 0xbc57ac4c, 0x9b00dbd8)),
+                  ((0xffffffff,) * 4, (0xffffffff,) * 2, (0x408f276d, 0x41c83b0e, 0xa20bc7c6, 0x6d5451fd)),
+                  ((0x243f6a88, 0x85a308d3, 0x13198a2e, 0x03707344), (0xa4093822, 0x299f31d0),
+                   (0xd16cfe09, 0x94fdcceb, 0x5001e420, 0x24126ea1)))
+# Each check takes a temporary directory it may write to and returns a list of mismatches
+CHECKS = collections.OrderedDict([('philox', check_philox),
+                                  ('tallies', check_tallies),
+                                  ('routing', check_routing),
+                                  ('counter_random', check_counter_random),
+                                  ('pedigree', check_pedigree),
+                                  ('ensemble', check_ensemble)])
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Checks that the Evolution Simulator's engines agree with each other and with brute force.")
+    parser.add_argument('--checks', nargs='+', choices=CHECKS.keys(), default=list(CHECKS),
+                        help="checks to run (default: all)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    failed = 0
+    # Any files the checks write go here rather than in the working directory
+    directory = tempfile.mkdtemp(prefix='evolution-check-')
+    try:
+        for name in args.checks:
+            start = time.time()
+            failures = CHECKS[name](directory)
+            print "{:16} {:4}  {:6.1f}s".format(name, 'FAIL' if failures else 'ok', time.time() - start)
+            for failure in failures:
+                print "    " + failure
+            failed += bool(failures)
+    finally:
+        shutil.rmtree(directory)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
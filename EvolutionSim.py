@@ -1,58 +1,674 @@
 # Evolution Simulator version 0.2.1
 # Author: Joshua McCready
 
+import BaseHTTPServer
+import SocketServer
+import argparse
+import collections
+import csv
+import gzip
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
 import random
+import struct
 import sys
+import threading
+import time
+import traceback
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Only importable on a Python 2.7 built with the pytracemalloc patch; memory_report falls
+# back to sys.getsizeof alone without it.
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
 
 
 class Ecosystem(object):
 
-    def __init__(self, habitat_list):
+    def __init__(self, habitat_list, engine='object', seed=None, gene_expression=None,
+                 phenotype_cache_size=None, workers=None, food_supply=None, random_block_size=None,
+                 pairing='uniform', config=None, counter_random=False, graph=None):
         """
         The Ecosystem class object acts as the world for the Evolution Simulator
         :param habitat_list: a list of Habitat objects
+        :param engine: string, one of ENGINES.  'object' runs the Organism/Traits objects
+                       directly, 'numpy' runs the population as parallel arrays (ArrayEngine),
+                       'parallel' runs the arrays in worker processes (ParallelEngine),
+                       'cohort' runs counted groups of identical organisms (CohortEngine),
+                       'calendar' runs Organisms bucketed by death generation (CalendarEngine)
+        :param seed: int, seed for the random number generator, can be None
+        :param gene_expression: GeneExpressionTable, or a dict mapping digrams to Traits methods
+                                like GENE_EXPRESSION_DICT, None for the config's own table.  A
+                                GeneExpressionTable brings its own Config.
+        :param phenotype_cache_size: int, size of the PhenotypeCache put in front of the gene
+                                     expression table by the object engine, None for no cache
+        :param workers: int, worker processes for the parallel engine, None for one per CPU
+        :param food_supply: number, turns on finite food: each generation every habitat regrows
+                            this many times each Food.replenish_rate and organisms that cannot
+                            eat their food_needed starve.  None for unlimited food.
+        :param random_block_size: int, makes the object and calendar engines breed with a BlockRandom drawing
+                                  this many numbers at a time, None for the random module
+        :param pairing: string, a key of PAIRINGS, the mate pairing policy of the object and
+                        calendar engines.  The array engines always pair uniformly.
+        :param config: Config, the model parameters, None for DEFAULT_CONFIG
+        :param counter_random: bool, makes the numpy and parallel engines draw from a CounterRandom,
+                               keyed by (seed, generation, habitat, pair, draw), so they give the
+                               same results as each other for any number of workers.  Without a
+                               seed one is picked and kept in self.seed.
+        :param graph: HabitatGraph, or a list of each habitat's neighbor indexes, that
+                      migrants move along, None to let them move to any habitat
         :return: no return value
         """
         self.habitats = habitat_list
+        if graph is not None and not isinstance(graph, HabitatGraph):
+            graph = HabitatGraph(graph)
+        if graph is not None and len(graph) != len(habitat_list):
+            raise ValueError("the graph has {} habitats, the world {}".format(len(graph), len(habitat_list)))
+        self.graph = graph
+        self.engine_name = engine
+        self.seed = seed
+        self.phenotype_cache_size = phenotype_cache_size
+        self.food_supply = food_supply
+        self.random_block_size = random_block_size
+        if pairing not in PAIRINGS:
+            raise ValueError("unknown pairing: {}".format(pairing))
+        self.pairing = pairing
+        if food_supply is not None and np is None:
+            raise ImportError("finite food requires numpy")
+        self.generation = 0
+        self.tallies = None
+        self.instrumentation = None
+        self.pedigree = None
+        if isinstance(gene_expression, GeneExpressionTable):
+            if config is not None and config != gene_expression.config:
+                raise ValueError("gene_expression was built for a different Config")
+        elif gene_expression is None:
+            gene_expression = (config or DEFAULT_CONFIG).gene_expression_table()
+        else:
+            gene_expression = GeneExpressionTable(gene_expression, config)
+        self.gene_expression = gene_expression
+        self.config = gene_expression.config
+        self._survival_table = None
+        self.phenotype_cache = None
+        if phenotype_cache_size is not None:
+            self.phenotype_cache = PhenotypeCache(gene_expression, phenotype_cache_size)
+        self.counter_random = None
+        if counter_random:
+            if engine not in ('numpy', 'parallel'):
+                raise ValueError("counter random numbers need the numpy or parallel engine")
+            if seed is None:
+                seed = self.seed = random.SystemRandom().getrandbits(63)
+            self.counter_random = CounterRandom(seed)
+        self.engine = None
+        if engine == 'numpy':
+            self.engine = ArrayEngine(habitat_list, seed, gene_expression, self.counter_random)
+        elif engine == 'parallel':
+            self.engine = ParallelEngine(habitat_list, seed, gene_expression, workers, self.counter_random)
+        elif engine == 'cohort':
+            self.engine = CohortEngine(habitat_list, seed, gene_expression)
+        elif engine in ('object', 'calendar'):
+            if seed is not None:
+                random.seed(seed)
+        else:
+            raise ValueError("unknown engine: {}".format(engine))
+        self.block_random = None
+        if random_block_size is not None and self.engine is None:
+            self.block_random = BlockRandom(seed, random_block_size)
+        if engine == 'calendar':
+            self.engine = CalendarEngine(habitat_list, self.phenotype_cache or gene_expression, self.block_random,
+                                         PAIRINGS[pairing])
 
     def breed_all(self):
         """
         Calls the Habitat.breed_wildlife method on all habitats to simulate breeding.
         :return: no return value
         """
-        for habitat in self.habitats:
-            habitat.breed_wildlife()
+        if self.tallies is not None:
+            for tally in self.tallies:
+                tally.start_generation()
+        if self.pedigree is not None:
+            self.pedigree.generation = self.generation + 1
+        if self.engine is not None:
+            self.engine.breed_all()
+            return
+        gene_expression = self.gene_expression
+        if self.phenotype_cache is not None:
+            gene_expression = self.phenotype_cache
+        pairing = PAIRINGS[self.pairing]
+        for index, habitat in enumerate(self.habitats):
+            parents = [] if self.pedigree is not None else None
+            habitat.breed_wildlife(gene_expression, self.block_random, pairing, parents)
+            if parents is not None:
+                self.pedigree.record(habitat.new_gen, parents, index)
 
     def migrate(self):
         """
         Checks to see if the new_gen organisms in each habitat can survive where they were born,
-        if not they migrate to a habitat in which they can survive.
+        if not they migrate to the first habitat in which they can survive, or with a graph
+        the first such neighbor of their birthplace.  Both checks are one lookup in the
+        SurvivalTable.
         :return: no return value
         """
+        table = self.survival_table()
+        if self.engine is not None:
+            self.engine.migrate(table, self.tallies)
+            return
+        tallies = self.tallies
         migrants = []
-        for habitat in self.habitats:
+        for index, habitat in enumerate(self.habitats):
+            stayers = []
+            emigrants = len(migrants)
             for organism in habitat.new_gen:
-                if organism.can_survive(habitat):
-                    habitat.wildlife.append(organism)
-                else:
-                    migrants.append(organism)
-        for migrant in migrants:
-            for habitat in self.habitats:
-                if migrant.can_survive(habitat):
-                    habitat.wildlife.append(migrant)
-                    break
+                destination = table.destination(organism.traits, index)
+                if destination == index:
+                    stayers.append(organism)
+                elif destination >= 0:
+                    migrants.append((organism, destination))
+            habitat.wildlife.extend(stayers)
+            if tallies is not None:
+                tally = tallies[index]
+                tally.births += len(habitat.new_gen)
+                tally.migrants_out += len(migrants) - emigrants
+                tally.lost += len(habitat.new_gen) - len(stayers) - (len(migrants) - emigrants)
+                tally.add_organisms(stayers)
+        for migrant, index in migrants:
+            self.habitats[index].wildlife.append(migrant)
+            if tallies is not None:
+                tallies[index].migrants_in += 1
+                tallies[index].add_organisms((migrant,))
+
+    def survival_table(self):
+        """
+        Returns the SurvivalTable for the current habitats, rebuilding it only if a habitat's
+        temp, water or food, or the graph, has changed since it was last built.
+        :return: SurvivalTable object
+        """
+        signature = SurvivalTable.habitat_signature(self.habitats)
+        table = self._survival_table
+        if table is None or table.signature != signature or table.graph is not self.graph:
+            self._survival_table = SurvivalTable(self.habitats, self.config, self.graph)
+        return self._survival_table
+
+    def feed_all(self):
+        """
+        With finite food, replenishes each habitat's food stock and shares it out among the
+        wildlife with allocate_food.  Organisms that go hungry starve: their life_span drops
+        to 0 and remove_all_dead takes them away.  Does nothing with unlimited food.
+        :return: no return value
+        """
+        if self.food_supply is None:
+            return
+        stocks = [habitat.replenish_food(self.food_supply) for habitat in self.habitats]
+        if self.engine is not None:
+            starved = self.engine.feed(stocks)
+        else:
+            rng = np.random.RandomState(random.getrandbits(32))
+            starved = []
+            for habitat, stock in zip(self.habitats, stocks):
+                wildlife = habitat.wildlife
+                needs = np.array([organism.traits.food_needed for organism in wildlife], dtype=np.int64)
+                diets = np.array([organism.traits.diet for organism in wildlife], dtype=np.uint8)
+                hungry = np.flatnonzero(~allocate_food(needs, diets, stock, rng))
+                for i in hungry.tolist():
+                    wildlife[i].life_span = 0
+                starved.append(len(hungry))
+        for habitat, stock in zip(self.habitats, stocks):
+            habitat.store_food(stock)
+        if self.tallies is not None:
+            for tally, count in zip(self.tallies, starved):
+                tally.starved += count
 
     def age_all(self):
+        if self.engine is not None:
+            self.engine.age_all()
+            return
         for habitat in self.habitats:
             [organism.get_older() for organism in habitat.wildlife]
 
     def remove_all_dead(self):
-        for habitat in self.habitats:
-            habitat.wildlife = [organism for organism in habitat.wildlife if organism.traits.life_span > 0]
+        if self.engine is not None:
+            self.engine.remove_all_dead(self.tallies)
+            return
+        if self.tallies is None:
+            for habitat in self.habitats:
+                habitat.wildlife = [organism for organism in habitat.wildlife if organism.life_span > 0]
+            return
+        for habitat, tally in zip(self.habitats, self.tallies):
+            survivors = []
+            dead = []
+            for organism in habitat.wildlife:
+                if organism.life_span > 0:
+                    survivors.append(organism)
+                else:
+                    dead.append(organism)
+            habitat.wildlife = survivors
+            tally.deaths += len(dead)
+            tally.remove_organisms(dead)
+
+    def track_stats(self):
+        """
+        Starts keeping a HabitatTally for each habitat, updated as organisms are born,
+        migrate and die, so per-generation statistics never need a pass over the wildlife.
+        Counting the current wildlife to start the tallies is the only full pass.
+        :return: list of HabitatTally objects, also kept as self.tallies
+        """
+        if self.tallies is None:
+            if isinstance(self.engine, ParallelEngine):
+                raise ValueError("the parallel engine does not support statistics tracking")
+            self.tallies = [HabitatTally() for habitat in self.habitats]
+            if self.engine is not None:
+                for tally, population in zip(self.tallies, self.engine.populations):
+                    tally.add_population(population)
+            else:
+                for tally, habitat in zip(self.tallies, self.habitats):
+                    tally.add_organisms(habitat.wildlife)
+        return self.tallies
+
+    def track_lineage(self, path=None, memory_records=1 << 20):
+        """
+        Starts recording every birth in a Pedigree, the current wildlife being its founders.
+        Only the object and calendar engines, which breed Organisms, can track lineage, and
+        idents are not kept in checkpoints.
+        :param path: string, file the Pedigree spills to, None to keep it in memory
+        :param memory_records: int, births held in memory before spilling
+        :return: Pedigree object, also kept as self.pedigree
+        """
+        if self.pedigree is None:
+            if self.engine is not None and not isinstance(self.engine, CalendarEngine):
+                raise ValueError("lineage tracking needs the object or calendar engine")
+            self.pedigree = Pedigree(path, memory_records)
+            self.pedigree.generation = self.generation
+            for index, organisms in enumerate(self._living()):
+                self.pedigree.record(organisms, None, index)
+            if self.engine is not None:
+                self.engine.pedigree = self.pedigree
+        return self.pedigree
+
+    def _living(self):
+        """
+        :return: list with each habitat's list of living Organisms, for the engines that keep Organisms
+        """
+        if self.engine is not None:
+            return [self.engine.living(index) for index in range(len(self.habitats))]
+        return [habitat.wildlife for habitat in self.habitats]
+
+    def living_idents(self):
+        """
+        :return: int64 array of the Pedigree idents of the living, in habitat order
+        """
+        return np.array([organism.ident for organisms in self._living() for organism in organisms], dtype=np.int64)
+
+    def prune_lineage(self):
+        """
+        Drops extinct lines from the Pedigree and relabels the living with their new idents.
+        :return: int, the number of records dropped
+        """
+        before = len(self.pedigree)
+        living = [organism for organisms in self._living() for organism in organisms]
+        kept = self.pedigree.prune([organism.ident for organism in living])
+        for organism, ident in zip(living, np.searchsorted(kept, [organism.ident for organism in living]).tolist()):
+            organism.ident = ident
+        return before - len(self.pedigree)
+
+    def instrument(self, history=1000, observer=None):
+        """
+        Starts timing each phase of next_generation and keeping an Instrumentation record
+        of every generation.  Per-habitat births, migrations, failed migrations and deaths
+        come from the HabitatTally objects, so this also calls track_stats, except on the
+        parallel engine, whose records only have the habitat counts.
+        :param history: int, the number of generations kept in the ring buffer
+        :param observer: function called with each record, can be None
+        :return: Instrumentation object, also kept as self.instrumentation
+        """
+        if self.instrumentation is None:
+            if not isinstance(self.engine, ParallelEngine):
+                self.track_stats()
+            self.instrumentation = Instrumentation(history)
+        if observer is not None:
+            self.instrumentation.add_observer(observer)
+        return self.instrumentation
+
+    def next_generation(self):
+        """
+        Runs one generation: breeding, migration, feeding (with finite food), aging and
+        removal of the dead.
+        :return: no return value
+        """
+        if self.instrumentation is not None:
+            self._timed_generation()
+            return
+        self.breed_all()
+        self.migrate()
+        self.feed_all()
+        self.age_all()
+        self.remove_all_dead()
+        self.generation += 1
+
+    def _timed_generation(self):
+        clock = time.time
+        seconds = collections.OrderedDict()
+        for phase in Instrumentation.PHASES:
+            start = clock()
+            getattr(self, phase)()
+            seconds[phase] = clock() - start
+        self.generation += 1
+        self.instrumentation.record(self, seconds)
+
+    def summary(self):
+        """
+        :return: dict describing the current state, suitable for json.dumps
+        """
+        counts = self.wildlife_counts()
+        return collections.OrderedDict([
+            ('generation', self.generation),
+            ('engine', self.engine_name),
+            ('seed', self.seed),
+            ('total', sum(counts)),
+            ('habitats', collections.OrderedDict([(habitat.name, count)
+                                                  for habitat, count in zip(self.habitats, counts)]))])
+
+    def memory_report(self):
+        """
+        Bytes held by each habitat's wildlife.  Organisms are measured with sys.getsizeof over
+        each Organism, its Genome and packed bytes and its Traits, counting objects shared
+        between organisms once; the array engines report their column bytes and the cohort
+        engine its cohort keys.  A Pedigree's records are reported apart.  On a Python 2.7
+        patched with pytracemalloc, while tracemalloc is tracing, the current and peak bytes
+        traced for the whole process are added; on a stock interpreter the report comes from
+        sys.getsizeof alone.
+        :return: dict suitable for json.dumps
+        """
+        counts = self.wildlife_counts()
+        if isinstance(self.engine, CohortEngine):
+            sizes = []
+            for population in self.engine.cohorts:
+                size = sys.getsizeof(population.cohorts)
+                for key in population.cohorts:
+                    size += sys.getsizeof(key) + sys.getsizeof(key[0]) + sys.getsizeof(key[0].packed)
+                sizes.append(size)
+        elif self.engine is not None and not isinstance(self.engine, CalendarEngine):
+            sizes = [population.nbytes() for population in self.engine.populations]
+        else:
+            sizes = []
+            seen = set()
+            for index, habitat in enumerate(self.habitats):
+                if self.engine is None:
+                    wildlife = habitat.wildlife
+                else:
+                    wildlife = self.engine.to_organisms(index)
+                size = sys.getsizeof(wildlife)
+                for organism in wildlife:
+                    for part in (organism, organism.genome, organism.genome.packed, organism.traits):
+                        if id(part) not in seen:
+                            seen.add(id(part))
+                            size += sys.getsizeof(part)
+                sizes.append(size)
+
+        habitats = collections.OrderedDict()
+        for habitat, count, size in zip(self.habitats, counts, sizes):
+            habitats[habitat.name] = collections.OrderedDict([
+                ('count', count), ('bytes', size),
+                ('bytes_per_organism', round(float(size) / count, 1) if count else None)])
+        report = collections.OrderedDict([
+            ('generation', self.generation),
+            ('bytes', sum(sizes)),
+            ('bytes_per_organism', round(float(sum(sizes)) / sum(counts), 1) if sum(counts) else None),
+            ('habitats', habitats)])
+        if self.pedigree is not None:
+            report['pedigree_records'] = len(self.pedigree)
+            report['pedigree_bytes'] = self.pedigree.nbytes()
+        if tracemalloc is not None and tracemalloc.is_tracing():
+            report['traced_current'], report['traced_peak'] = tracemalloc.get_traced_memory()
+        return report
+
+    def snapshot(self, samples=5, rand=None):
+        """
+        A summary of the current state for SnapshotServer: per habitat its conditions, count,
+        this generation's HabitatTally counters, means, base counts and digram carriers if
+        statistics are tracked, and a few organisms picked at random.  Costs time in the
+        number of habitats and samples, not in the population.
+        :param samples: int, the most organisms sampled from each habitat
+        :param rand: random.Random to sample with, None for a new one.  Never the simulation's
+                     own generator, so watching a run does not change it.
+        :return: dict suitable for json.dumps
+        """
+        if rand is None:
+            rand = random.Random()
+        counts = self.wildlife_counts()
+        if isinstance(self.engine, ParallelEngine):
+            picked = self.engine.samples(samples)
+        elif self.engine is not None:
+            picked = [self.engine.sample(index, samples, rand) for index in range(len(self.habitats))]
+        else:
+            picked = [rand.sample(habitat.wildlife, min(samples, len(habitat.wildlife))) for habitat in self.habitats]
+
+        habitats = collections.OrderedDict()
+        for index, habitat in enumerate(self.habitats):
+            entry = collections.OrderedDict([
+                ('temp', habitat.temp), ('water_avail', habitat.water_avail), ('food_avail', list(habitat.food_avail)),
+                ('count', counts[index])])
+            if self.tallies is not None:
+                tally = self.tallies[index]
+                for counter in Instrumentation.COUNTERS:
+                    entry[counter] = getattr(tally, counter)
+                for field in HabitatTally.FIELDS:
+                    if field != 'diet':
+                        entry['mean_' + field] = tally.mean(field)
+                entry['base_counts'] = tally.base_counts()
+                entry['digram_carriers'] = tally.digram_carriers()
+            entry['samples'] = [collections.OrderedDict([
+                ('genome', str(organism.genome)), ('temp_tol', organism.traits.temp_tol),
+                ('water_needed', organism.traits.water_needed), ('food_needed', organism.traits.food_needed),
+                ('birth_rate', organism.traits.birth_rate), ('life_span', organism.life_span),
+                ('diet', mask_to_diet(organism.traits.diet))]) for organism in picked[index]]
+            habitats[habitat.name] = entry
+        return collections.OrderedDict([
+            ('generation', self.generation),
+            ('engine', self.engine_name),
+            ('seed', self.seed),
+            ('total', sum(counts)),
+            ('habitats', habitats)])
+
+    def wildlife_counts(self):
+        """
+        Counts the organisms living in each habitat without materializing them.
+        :return: list of ints, one per habitat in self.habitats
+        """
+        if self.engine is not None:
+            return self.engine.counts()
+        return [len(habitat.wildlife) for habitat in self.habitats]
+
+    def sync_wildlife(self):
+        """
+        Rebuilds each habitat's wildlife list of Organisms from the engine's arrays so the
+        Habitat print methods work.  Does nothing for the object engine.
+        :return: no return value
+        """
+        if self.engine is None:
+            return
+        for index, habitat in enumerate(self.habitats):
+            habitat.wildlife = self.engine.to_organisms(index)
+
+    def save_checkpoint(self, path):
+        """
+        Writes the whole state of the world to a binary checkpoint: the habitats and their
+        graph, each habitat's trait columns and 2-bit packed genomes, the generation number and the
+        random number generator state.  Call it between generations.  The file is a short
+        JSON header followed by raw little-endian columns aligned for np.memmap; see
+        load_checkpoint.  Requires numpy.
+        :param path: string, the file to write
+        :return: no return value
+        """
+        if np is None:
+            raise ImportError("checkpoints require numpy")
+        if self.engine_name in ('numpy', 'cohort'):
+            populations = self.engine.populations
+            rng_state = list(self.engine.rng.get_state())
+            rng_state[1] = rng_state[1].tolist()
+        elif self.engine_name == 'parallel':
+            # Each worker has its own generator; a restored world starts them afresh.
+            populations = self.engine.populations
+            rng_state = None
+        elif self.engine_name == 'calendar':
+            populations = self.engine.populations
+            rng_state = random.getstate()
+        else:
+            populations = [ArrayPopulation.from_organisms(habitat.wildlife) for habitat in self.habitats]
+            rng_state = random.getstate()
+
+        columns = []
+        for index, population in enumerate(populations):
+            population = population.take(np.arange(len(population)))
+            for field in ArrayPopulation.TRAIT_FIELDS + ('genome_len',):
+                columns.append(('{}/{}'.format(index, field), getattr(population, field)))
+            columns.append(('{}/genome'.format(index), pack_genomes(population.genome_buf)))
+
+        layout = []
+        offset = 0
+        for name, column in columns:
+            layout.append([name, column.dtype.str, len(column), offset])
+            offset += -(-column.nbytes // CHECKPOINT_ALIGN) * CHECKPOINT_ALIGN
+        header = json.dumps({
+            'version': 1,
+            'generation': self.generation,
+            'engine': self.engine_name,
+            'seed': self.seed,
+            'phenotype_cache_size': self.phenotype_cache_size,
+            'track_stats': self.tallies is not None,
+            'food_supply': self.food_supply,
+            'food_stock': [habitat.food_stock for habitat in self.habitats],
+            'rng_state': rng_state,
+            'random_block_size': self.random_block_size,
+            'pairing': self.pairing,
+            'counter_random': self.counter_random is not None,
+            'block_random': self.block_random.get_state() if self.block_random is not None else None,
+            'gene_expression': [[key, rule.__name__] for key, rule in self.gene_expression.items()],
+            'config': self.config.to_dict(),
+            'habitats': [[habitat.name, habitat.temp, habitat.water_avail, list(habitat.food_avail)]
+                         for habitat in self.habitats],
+            'graph': self.graph.to_lists() if self.graph is not None else None,
+            'columns': layout})
+
+        data_start = len(CHECKPOINT_MAGIC) + 8 + len(header)
+        data_start = -(-data_start // CHECKPOINT_ALIGN) * CHECKPOINT_ALIGN
+        with open(path, 'wb') as checkpoint:
+            checkpoint.write(CHECKPOINT_MAGIC)
+            checkpoint.write(struct.pack('<Q', len(header)))
+            checkpoint.write(header)
+            for (name, column), (name, dtype, count, offset) in zip(columns, layout):
+                checkpoint.write('\0' * (data_start + offset - checkpoint.tell()))
+                checkpoint.write(column.tostring())
+
+    @classmethod
+    def load_checkpoint(cls, path, engine=None, gene_expression=None):
+        """
+        Rebuilds an Ecosystem from a file written by save_checkpoint.  The trait columns are
+        memory-mapped copy-on-write rather than read, so a large checkpoint opens almost at
+        once and many worlds can be forked from one file; pages are only copied when a
+        world changes them.  The habitats are new Habitat objects, not HABITATS.
+        :param path: string, the checkpoint file
+        :param engine: string, one of ENGINES, None for the engine that wrote the checkpoint.
+                       The random number generator state only carries over to the same engine.
+        :param gene_expression: GeneExpressionTable or dict, None to rebuild the saved table
+                                from Traits methods of the same names.  Unless it is a
+                                GeneExpressionTable the saved Config is restored with it.
+        :return: Ecosystem object
+        """
+        if np is None:
+            raise ImportError("checkpoints require numpy")
+        with open(path, 'rb') as checkpoint:
+            if checkpoint.read(len(CHECKPOINT_MAGIC)) != CHECKPOINT_MAGIC:
+                raise ValueError("not an Evolution Simulator checkpoint: {}".format(path))
+            header_len, = struct.unpack('<Q', checkpoint.read(8))
+            header = json.loads(checkpoint.read(header_len))
+        data_start = len(CHECKPOINT_MAGIC) + 8 + header_len
+        data_start = -(-data_start // CHECKPOINT_ALIGN) * CHECKPOINT_ALIGN
+
+        columns = {}
+        for name, dtype, count, offset in header['columns']:
+            if count:
+                columns[name] = np.memmap(path, dtype=np.dtype(str(dtype)), mode='c',
+                                          offset=data_start + offset, shape=(count,))
+            else:
+                columns[name] = np.zeros(0, dtype=np.dtype(str(dtype)))
+
+        populations = []
+        for index in range(len(header['habitats'])):
+            fields = [columns['{}/{}'.format(index, field)] for field in ArrayPopulation.TRAIT_FIELDS]
+            genome_len = columns['{}/genome_len'.format(index)]
+            genome_buf = unpack_genomes(columns['{}/genome'.format(index)])
+            populations.append(ArrayPopulation(*(fields + [np.cumsum(genome_len) - genome_len,
+                                                           genome_len, genome_buf])))
+
+        if gene_expression is None:
+            gene_expression = collections.OrderedDict([(key, getattr(Traits, name))
+                                                       for key, name in header['gene_expression']])
+        config = None
+        if header.get('config') is not None and not isinstance(gene_expression, GeneExpressionTable):
+            config = Config.from_dict(header['config'])
+        saved_engine = header['engine']
+        if engine is None:
+            engine = saved_engine
+        habitats = [Habitat(str(name), temp, water_avail, [str(food) for food in food_avail], [], [])
+                    for name, temp, water_avail, food_avail in header['habitats']]
+        for habitat, food_stock in zip(habitats, header.get('food_stock', [])):
+            habitat.food_stock = dict([(str(food), amount) for food, amount in food_stock.items()])
+        world = cls(habitats, engine=engine, seed=header['seed'], gene_expression=gene_expression,
+                    phenotype_cache_size=header['phenotype_cache_size'], food_supply=header.get('food_supply'),
+                    random_block_size=header.get('random_block_size'), pairing=str(header.get('pairing', 'legacy')),
+                    config=config, counter_random=header.get('counter_random', False) and engine in ('numpy', 'parallel'),
+                    graph=header.get('graph'))
+        world.generation = header['generation']
+        if world.counter_random is not None:
+            # Counter streams are keyed by generation, so they carry over to either engine.
+            world.engine.generation = world.generation
+        if world.engine is not None:
+            world.engine.populations = populations
+        else:
+            for habitat, population in zip(habitats, populations):
+                habitat.wildlife = population.to_organisms()
+
+        rng_state = header['rng_state']
+        if engine == saved_engine and engine in ('numpy', 'cohort'):
+            world.engine.rng.set_state((str(rng_state[0]), np.array(rng_state[1], dtype=np.uint32))
+                                       + tuple(rng_state[2:]))
+        elif engine == saved_engine and engine in ('object', 'calendar'):
+            random.setstate((rng_state[0], tuple(rng_state[1]), rng_state[2]))
+            if world.block_random is not None and header.get('block_random') is not None:
+                world.block_random.set_state(header['block_random'])
+        if header['track_stats']:
+            world.track_stats()
+        return world
+
+    def close(self):
+        """
+        Releases anything the engine holds outside this process, such as the parallel
+        engine's workers.  The Ecosystem cannot be used afterwards.
+        :return: no return value
+        """
+        if isinstance(self.engine, ParallelEngine):
+            self.engine.close()
 
     def print_wildlife_totals(self):
-        for habitat in self.habitats:
-            print habitat.name + ":  " + str(len(habitat.wildlife))
+        for habitat, count in zip(self.habitats, self.wildlife_counts()):
+            print habitat.name + ":  " + str(count)
 
     def __repr__(self):
         return "Number of habitats in Ecosystem: {}".format(len(self.habitats))
@@ -66,7 +682,7 @@ class Habitat(object):
         :param name: string, name of the habitat
         :param temp: int, the temperature of the habitat
         :param water_avail: int, the amount of water available
-        :param food_avail: list of strings, the types of food available
+        :param food_avail: list of strings, the types of food available, kept as a tuple
         :param wildlife_list: list of organisms, can be None
         :param new_gen: list of new organisms, can be None
         :return: Habitat object
@@ -77,29 +693,73 @@ class Habitat(object):
         self.food_avail = food_avail
         self.wildlife = wildlife_list
         self.new_gen = new_gen
+        self.food_stock = {}
 
-    # Takes the list of Organisms in the self.wildlife attribute, pairs
-    # them up and breeds them.  There must be two parents for breeding, so
-    # one Organism in an odd-length list will not get to breed.
-    def breed_wildlife(self):
-        parent_list = self.wildlife[:]
-        self.new_gen = []
+    @property
+    def food_avail(self):
+        return self._food_avail
 
-        while True:
-            if len(parent_list) <= 1:
-                break
+    # Keeps food_mask, the foods as a diet bitmask, and foods, the Food objects
+    # that replenish them, in step with food_avail.  food_avail is stored as a tuple
+    # so that changing it in place fails instead of leaving the two stale; assign a
+    # new list to change the foods.
+    @food_avail.setter
+    def food_avail(self, food_avail):
+        self._food_avail = tuple(food_avail)
+        self.food_mask = diet_to_mask(food_avail)
+        self.foods = [Food(food, FOOD_DICT[food]) for food in food_avail]
+
+    def replenish_food(self, supply):
+        """
+        Adds one generation's worth of each food to self.food_stock.  A food can build up
+        to MAX_FOOD_STORE generations' worth when it is not eaten.
+        :param supply: number, multiplies each Food.replenish_rate
+        :return: float array over ALL_FOODS, the stock after replenishing
+        """
+        stock = np.zeros(len(ALL_FOODS))
+        for food in self.foods:
+            amount = food.replenish_rate * supply
+            self.food_stock[food.name] = min(self.food_stock.get(food.name, 0) + amount, amount * MAX_FOOD_STORE)
+            stock[ALL_FOODS.index(food.name)] = self.food_stock[food.name]
+        return stock
 
-            mom_index = random.randint(0, len(parent_list) - 1)
-            mom = parent_list.pop(mom_index)
+    def store_food(self, stock):
+        """
+        :param stock: float array over ALL_FOODS, the food left after feeding
+        :return: no return value
+        """
+        for food in self.foods:
+            self.food_stock[food.name] = float(stock[ALL_FOODS.index(food.name)])
 
-            dad_index = random.randint(0, len(parent_list) - 1)
-            dad = parent_list.pop(dad_index)
+    # Takes the list of Organisms in the self.wildlife attribute, pairs
+    # them up and breeds them.  There must be two parents for breeding, so
+    # one Organism in an odd-length list will not get to breed.  gene_expression
+    # is the GeneExpressionTable (or PhenotypeCache) applied to the children,
+    # None for the default.
+    def breed_wildlife(self, gene_expression=None, rng=None, pairing=None, parents=None):
+        """
+        :param gene_expression: GeneExpressionTable or PhenotypeCache, None for GENE_EXPRESSION_TABLE
+        :param rng: BlockRandom, None for the random module
+        :param pairing: function taking (list of parents, rng) and returning an iterable of
+                        (mom, dad) pairs, such as a value of PAIRINGS, None for pair_uniform
+        :param parents: list to which the (mom, dad) of each child in new_gen is appended,
+                        None to not record them
+        :return: no return value
+        """
+        if rng is None:
+            rng = random
+        if pairing is None:
+            pairing = pair_uniform
+        self.new_gen = []
 
+        for mom, dad in pairing(self.wildlife[:], rng):
             i = 1
             while i <= mom.traits.birth_rate:
-                child = mom.breed(dad)
+                child = mom.breed(dad, gene_expression, rng)
                 self.new_gen.append(child)
                 i += 1
+            if parents is not None:
+                parents.extend([(mom, dad)] * (i - 1))
 
     def print_wildlife(self):
         print self.name + ":"
@@ -116,189 +776,3730 @@ class Habitat(object):
 
 class Organism(object):
 
-    def __init__(self, genome, traits):
+    __slots__ = ('genome', 'traits', 'life_span', 'ident')
+
+    def __init__(self, genome, traits, life_span=None):
+        """
+        An Organism's Traits may be shared with its siblings and are never changed once it
+        holds them, so the countdown to its death is kept on the Organism itself.  ident is
+        its number in the Ecosystem's Pedigree, None when lineage is not tracked.
+        :param genome: Genome object, or a string over BASES which is packed into one
+        :param traits: Traits object
+        :param life_span: int, generations left to live, None for traits.life_span
+        """
+        if not isinstance(genome, Genome):
+            genome = Genome.from_string(genome)
         self.genome = genome
         self.traits = traits
+        if life_span is None:
+            life_span = traits.life_span
+        self.life_span = life_span
+        self.ident = None
 
-    def breed(self, mate):
-        mom = self.genome
-        dad = mate.genome
-        child_genome = ''
-        gene_pool = mom + dad
-        number_of_genes = len(gene_pool) / 2
-        
-        mutate = random.randint(1, 100)
-        if mutate <= MUTATION_RATE:
-            mutated_gene_list = ['a', 'b', 'c', 'd']
-            mutated_gene = mutated_gene_list[random.randint(0, len(mutated_gene_list) - 1)]
-            gene_pool += mutated_gene
-            number_of_genes += 1
-      
-        i = 0
-        while i < number_of_genes:
-            child_genome = child_genome + gene_pool[random.randint(0, len(gene_pool) - 1)]
-            i += 1
+    def breed(self, mate, gene_expression=None, rng=None):
+        if rng is None:
+            rng = random
+        if gene_expression is None:
+            gene_expression = GENE_EXPRESSION_TABLE
+        mutated_gene = None
+        mutate = rng.randint(1, 100)
+        if mutate <= gene_expression.config.mutation_rate:
+            mutated_gene = rng.randint(0, len(BASES) - 1)
+        child_genome = self.genome.crossover(mate.genome, mutated_gene, rng)
 
-        temp = self.traits.temp_tol
-        water = self.traits.water_needed
-        birth_rate = self.traits.birth_rate
-        diet = self.traits.diet
-        child_traits = Traits(temp, water, diet, birth_rate)
-        child = Organism(child_genome, child_traits)
-        child.express_genes()
+        child = Organism(child_genome, self.traits.offspring())
+        child.express_genes(gene_expression, rng)
         return child
 
-    def express_genes(self):
-        for key in GENE_EXPRESSION_DICT:
-            if key in self.genome:
-                GENE_EXPRESSION_DICT[key](self.traits)
+    def express_genes(self, gene_expression=None, rng=None):
+        """
+        Applies every rule whose digram occurs in the genome.  self.traits is only replaced
+        by a copy if a rule fires, otherwise it stays shared.
+        :param gene_expression: GeneExpressionTable or PhenotypeCache, None for GENE_EXPRESSION_TABLE
+        :param rng: random number generator the diet rules draw from, None for the random module
+        :return: no return value
+        """
+        if gene_expression is None:
+            gene_expression = GENE_EXPRESSION_TABLE
+        self.traits = gene_expression.express(self.traits, self.genome.digrams, rng)
+        self.life_span = self.traits.life_span
 
     def can_survive(self, habitat):
-        for food in self.traits.diet:
-            if food in habitat.food_avail:
-                if self.traits.temp_tol == habitat.temp and self.traits.water_needed <= habitat.water_avail:
-                    return True
-        return False
+        traits = self.traits
+        return bool(traits.diet & habitat.food_mask) and traits.temp_tol == habitat.temp \
+            and traits.water_needed <= habitat.water_avail
 
     def get_older(self):
-        self.traits.life_span -= 1
+        self.life_span -= 1
+
+    def __repr__(self):
+        return "  " + str(self.genome) + "-----\n" + str(self.traits)
+
+
+class Genome(object):
+
+    __slots__ = ('packed', 'length', 'digrams')
+
+    def __init__(self, packed='', length=0, digrams=None):
+        """
+        An immutable genome with its bases packed 2 bits each, four to a byte.  Base i is
+        stored in byte i // 4 at bit offset 2 * (i % 4), coded by its position in BASES.
+        :param packed: str of packed bytes
+        :param length: int, the number of bases
+        :param digrams: int, 16-bit mask of the adjacent base pairs present (see digram_bit),
+                        computed from packed if None
+        :return: Genome object
+        """
+        self.packed = packed
+        self.length = length
+        if digrams is None:
+            digrams = 0
+            for i in xrange(1, length):
+                digrams |= 1 << ((self.base(i - 1) << 2) | self.base(i))
+        self.digrams = digrams
+
+    @classmethod
+    def from_string(cls, text):
+        packed = bytearray((len(text) + 3) >> 2)
+        for i, base in enumerate(text):
+            packed[i >> 2] |= BASES.index(base) << ((i & 3) << 1)
+        return cls(bytes(packed), len(text))
+
+    def base(self, index):
+        """
+        :param index: int, position in the genome
+        :return: int, the code of the base at index
+        """
+        return (ord(self.packed[index >> 2]) >> ((index & 3) << 1)) & 3
+
+    def packed_base_counts(self):
+        """
+        Counts the bases a byte at a time with BYTE_BASE_COUNTS.  The counts stay packed so
+        that a HabitatTally can add and subtract whole genomes as a single int.
+        :return: int, the number of bases with code c in bits BASE_COUNT_BITS * c and up;
+                 the unused bits of the last byte count as code 0
+        """
+        return sum(map(BYTE_BASE_COUNTS.__getitem__, bytearray(self.packed)))
+
+    def base_counts(self):
+        """
+        :return: list of ints, the number of each base in BASES order
+        """
+        counts = unpack_base_counts(self.packed_base_counts())
+        counts[0] -= 4 * len(self.packed) - self.length
+        return counts
+
+    def crossover(self, mate, mutated_gene=None, rng=None):
+        """
+        Builds a child genome the way Organism.breed always has: the child is half as long
+        as both parents together and each of its bases is drawn at random, with replacement,
+        from the pooled bases of the two parents.  A mutation adds one extra base to the pool
+        and one extra base to the child.  Works on the packed bytes without decoding them,
+        and records the child's digrams as its bases are chosen.
+        :param mate: Genome object
+        :param mutated_gene: int, code of the mutated base, None if there is no mutation
+        :param rng: BlockRandom, whose floats() hands over a whole slice of draws at once, or
+                    any object with the random module's random(), None for the random module
+        :return: Genome object
+        """
+        mom, dad = self.packed, mate.packed
+        mom_len = self.length
+        parents_len = pool_len = mom_len + mate.length
+        number_of_genes = pool_len // 2
+        if mutated_gene is not None:
+            pool_len += 1
+            number_of_genes += 1
+
+        if rng is None:
+            rng = random
+        if isinstance(rng, BlockRandom):
+            draws = rng.floats(number_of_genes)
+        else:
+            rand = rng.random
+            draws = [rand() for i in xrange(number_of_genes)]
+        child = bytearray((number_of_genes + 3) >> 2)
+        digrams = 0
+        previous = None
+        for i, draw in enumerate(draws):
+            j = int(draw * pool_len)
+            if j < mom_len:
+                code = (ord(mom[j >> 2]) >> ((j & 3) << 1)) & 3
+            elif j < parents_len:
+                j -= mom_len
+                code = (ord(dad[j >> 2]) >> ((j & 3) << 1)) & 3
+            else:
+                code = mutated_gene
+            child[i >> 2] |= code << ((i & 3) << 1)
+            if previous is not None:
+                digrams |= 1 << ((previous << 2) | code)
+            previous = code
+        return Genome(bytes(child), number_of_genes, digrams)
+
+    def __len__(self):
+        return self.length
+
+    def __eq__(self, other):
+        return isinstance(other, Genome) and self.length == other.length and self.packed == other.packed
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.packed, self.length))
+
+    def __str__(self):
+        return ''.join([GENOME_BYTE_BASES[ord(byte)] for byte in self.packed])[:self.length]
 
     def __repr__(self):
-        return "  " + self.genome + "-----\n" + str(self.traits)
+        return "Genome('{}')".format(self)
+
+
+class BlockRandom(object):
+
+    def __init__(self, seed=None, block_size=1 << 16):
+        """
+        Uniform random numbers drawn from a numpy RandomState a block at a time and handed out
+        from a list, so breeding pays for one numpy call per block instead of a Python-level
+        random module call per draw.  Has the random() and randint() methods the breeding
+        code uses from the random module, and floats() for a whole slice at once.
+        :param seed: int, seed for the RandomState, can be None
+        :param block_size: int, draws per block
+        :return: BlockRandom object
+        """
+        if np is None:
+            raise ImportError("block random numbers require numpy")
+        self.block_size = block_size
+        self._rng = np.random.RandomState(seed)
+        self._refill(block_size)
+
+    def _refill(self, size):
+        self._state = self._rng.get_state()
+        self._block = self._rng.random_sample(size).tolist()
+        self._index = 0
+
+    def random(self):
+        if self._index >= len(self._block):
+            self._refill(self.block_size)
+        value = self._block[self._index]
+        self._index += 1
+        return value
+
+    def randint(self, a, b):
+        """
+        :return: int from a to b inclusive, as random.randint
+        """
+        return a + int(self.random() * (b - a + 1))
+
+    def floats(self, count):
+        """
+        :param count: int
+        :return: list of count floats in [0, 1)
+        """
+        if self._index + count > len(self._block):
+            self._refill(max(self.block_size, count))
+        start = self._index
+        self._index += count
+        return self._block[start:self._index]
+
+    def get_state(self):
+        """
+        :return: JSON-friendly state for set_state: the RandomState state the current block
+                 was drawn from, the block's length and the position in it
+        """
+        state = list(self._state)
+        state[1] = state[1].tolist()
+        return [state, len(self._block), self._index]
+
+    def set_state(self, state):
+        rng_state, size, index = state
+        self._rng.set_state((str(rng_state[0]), np.array(rng_state[1], dtype=np.uint32)) + tuple(rng_state[2:]))
+        self._refill(size)
+        self._index = index
+
+
+class CounterRandom(object):
+
+    PAIRING = 0xffffffff
+    FEEDING = 0xfffffffe
+
+    def __init__(self, seed=0):
+        """
+        Counter-based random numbers: draw d of the stream (generation, habitat, pair) is
+        Philox4x32-10 of the counter (d // 2, pair, habitat, generation) under a key made from
+        the seed, so any draw can be computed on its own, in any order and in any process.
+        Each block gives two 53-bit uniforms.  pair is the index of a breeding pair, or
+        PAIRING for the shuffle that forms the pairs and FEEDING for the feeding queue.
+        Written with numpy uint64 arithmetic, as numpy before 1.17 has no Philox.
+        :param seed: int, the key, reduced to 64 bits
+        :return: CounterRandom object
+        """
+        if np is None:
+            raise ImportError("counter random numbers require numpy")
+        self.seed = seed
+        seed %= 1 << 64
+        self.key = (np.uint64(seed & 0xffffffff), np.uint64(seed >> 32))
+
+    @staticmethod
+    def philox(c0, c1, c2, c3, k0, k1):
+        """
+        :param c0, c1, c2, c3: uint64 arrays or scalars holding the four 32-bit counter words
+        :param k0, k1: np.uint64, the two 32-bit key words
+        :return: tuple of the four 32-bit output words as uint64 arrays
+        """
+        mask = np.uint64(0xffffffff)
+        shift = np.uint64(32)
+        for i in range(10):
+            product0 = PHILOX_M0 * c0
+            product1 = PHILOX_M1 * c2
+            c0, c1, c2, c3 = (product1 >> shift) ^ c1 ^ k0, product1 & mask, (product0 >> shift) ^ c3 ^ k1, \
+                product0 & mask
+            k0 = (k0 + PHILOX_W0) & mask
+            k1 = (k1 + PHILOX_W1) & mask
+        return c0, c1, c2, c3
+
+    def uniforms(self, generation, habitat, pair, draw):
+        """
+        :param generation: int
+        :param habitat: int
+        :param pair: int or int array
+        :param draw: int or int array, broadcast against pair
+        :return: float64 array of uniforms in [0, 1)
+        """
+        pair, draw = np.broadcast_arrays(np.asarray(pair, dtype=np.int64), np.asarray(draw, dtype=np.int64))
+        draw = draw.astype(np.uint64)
+        words = self.philox(draw >> np.uint64(1), pair.astype(np.uint64), np.uint64(habitat), np.uint64(generation),
+                            *self.key)
+        odd = (draw & np.uint64(1)).astype(bool)
+        high = np.where(odd, words[2], words[0]) >> np.uint64(5)
+        low = np.where(odd, words[3], words[1]) >> np.uint64(6)
+        return (high.astype(np.float64) * 67108864.0 + low) / 9007199254740992.0
+
+    def stream(self, generation, habitat, pair, draw=0):
+        """
+        :return: CounterStream of the draws from draw onward of stream (generation, habitat, pair)
+        """
+        return CounterStream(self, generation, habitat, pair, draw)
+
+
+class CounterStream(object):
+
+    def __init__(self, counter, generation, habitat, pair, draw=0):
+        """
+        A view of CounterRandom draws with the parts of the numpy RandomState interface the
+        engines use.  With an int pair it is one stream, read forward by random_sample,
+        randint and permutation.  With arrays of pairs and first draws it is one stream per
+        row, read with at().
+        :param counter: CounterRandom object
+        :param generation: int
+        :param habitat: int
+        :param pair: int, or int array with the pair of each row
+        :param draw: int, or int array with the first draw of each row
+        :return: CounterStream object
+        """
+        self.counter = counter
+        self.generation = generation
+        self.habitat = habitat
+        self.pair = pair
+        self.draw = draw
+
+    def random_sample(self, size):
+        values = self.counter.uniforms(self.generation, self.habitat, self.pair, self.draw + np.arange(size))
+        self.draw += size
+        return values
+
+    def randint(self, low, high, size):
+        return low + (self.random_sample(size) * (high - low)).astype(np.int64)
+
+    def permutation(self, n):
+        return np.argsort(self.random_sample(n), kind='mergesort')
+
+    def at(self, rows=None, offset=0):
+        """
+        :param rows: int array of rows, None for all of them
+        :param offset: int, added to each row's first draw
+        :return: float64 array with one draw per row
+        """
+        if rows is None:
+            return self.counter.uniforms(self.generation, self.habitat, self.pair, self.draw + offset)
+        return self.counter.uniforms(self.generation, self.habitat, self.pair[rows], self.draw[rows] + offset)
+
+    def offset(self, offset):
+        """
+        :return: a per-row CounterStream starting offset draws further into every row
+        """
+        return CounterStream(self.counter, self.generation, self.habitat, self.pair, self.draw + offset)
+
+
+def _row_uniforms(rng, rows):
+    """
+    :param rng: numpy RandomState, or a per-row CounterStream
+    :param rows: int array of rows
+    :return: float64 array with a uniform for each of the rows
+    """
+    if isinstance(rng, CounterStream):
+        return rng.at(rows)
+    return rng.random_sample(len(rows))
 
 
 class Traits(object):
 
-    ALL_FOODS = ['grass', 'seeds', 'leaves', 'fruit']
+    __slots__ = ('temp_tol', 'water_needed', 'diet', 'food_needed', 'birth_rate', 'life_span', '_offspring')
 
     def __init__(self, temp_tol, water_needed, diet, food_needed=1, birth_rate=1, life_span=4):
+        """
+        Traits are copy-on-write: once an Organism holds a Traits object it is treated as
+        immutable and may be shared by many organisms.  The gene expression methods below
+        are only ever called on a fresh copy().
+        :param diet: int bitmask over ALL_FOODS, or a list of food names which is converted
+        """
+        if not isinstance(diet, (int, long)):
+            diet = diet_to_mask(diet)
         self.temp_tol = temp_tol
         self.water_needed = water_needed
         self.diet = diet
         self.food_needed = food_needed
         self.birth_rate = birth_rate
         self.life_span = life_span
+        self._offspring = None
 
-    def inc_temp(self):
+    def copy(self):
+        # Gene expression copies the Traits of every child a rule fires for, so this skips
+        # __init__ and its diet conversion, which a copy never needs.
+        traits = object.__new__(Traits)
+        traits.temp_tol = self.temp_tol
+        traits.water_needed = self.water_needed
+        traits.diet = self.diet
+        traits.food_needed = self.food_needed
+        traits.birth_rate = self.birth_rate
+        traits.life_span = self.life_span
+        traits._offspring = None
+        return traits
+
+    def offspring(self):
+        """
+        The Traits every child of this organism starts from before gene expression, built
+        once and shared by all of them.  Children inherit their mother's food_needed;
+        birth_rate and life_span start from the Traits defaults.
+        :return: Traits object
+        """
+        if self._offspring is None:
+            self._offspring = Traits(self.temp_tol, self.water_needed, self.diet, food_needed=self.food_needed)
+        return self._offspring
+
+    # The gene expression methods.  Each takes the Config whose bounds it keeps the trait
+    # within, None for DEFAULT_CONFIG, and the random number generator the diet rules pick
+    # foods with, an object with the random module's random(), None for the random module.
+    def inc_temp(self, config=None, rng=None):
+        config = config or DEFAULT_CONFIG
         self.temp_tol += 1
-        if self.temp_tol > MAX_TEMP:
-            self.temp_tol = MAX_TEMP
+        if self.temp_tol > config.max_temp:
+            self.temp_tol = config.max_temp
         return
 
-    def dec_temp(self):
+    def dec_temp(self, config=None, rng=None):
+        config = config or DEFAULT_CONFIG
         self.temp_tol -= 1
-        if self.temp_tol < MIN_TEMP:
-            self.temp_tol = MIN_TEMP
+        if self.temp_tol < config.min_temp:
+            self.temp_tol = config.min_temp
         return
 
-    def inc_water(self):
+    def inc_water(self, config=None, rng=None):
+        config = config or DEFAULT_CONFIG
         self.water_needed += 1
-        if self.water_needed > MAX_WATER:
-            self.water_needed = MAX_WATER
+        if self.water_needed > config.max_water:
+            self.water_needed = config.max_water
         return
 
-    def dec_water(self):
+    def dec_water(self, config=None, rng=None):
+        config = config or DEFAULT_CONFIG
         self.water_needed -= 1
-        if self.water_needed < MIN_WATER:
-            self.water_needed = MIN_WATER
+        if self.water_needed < config.min_water:
+            self.water_needed = config.min_water
         return
 
-    def inc_birth_rate(self):
+    def inc_birth_rate(self, config=None, rng=None):
+        config = config or DEFAULT_CONFIG
         self.birth_rate += 1
-        if self.birth_rate > MAX_BIRTH:
-            self.birth_rate = MAX_BIRTH
+        if self.birth_rate > config.max_birth:
+            self.birth_rate = config.max_birth
         return
 
-    def dec_birth_rate(self):
+    def dec_birth_rate(self, config=None, rng=None):
         self.birth_rate -= 1
         if self.birth_rate <= 0:
             self.life_span = 0
         return
 
-    def inc_life_span(self):
+    def inc_life_span(self, config=None, rng=None):
+        config = config or DEFAULT_CONFIG
         self.life_span += 1
-        if self.life_span > MAX_LIFE:
-            self.life_span = MAX_LIFE
+        if self.life_span > config.max_life:
+            self.life_span = config.max_life
         return
 
-    def dec_life_span(self):
+    def dec_life_span(self, config=None, rng=None):
         self.life_span -= 1
 
-    def add_to_diet(self):
-        if len(self.diet) == len(self.ALL_FOODS):
+    def add_to_diet(self, config=None, rng=None):
+        if self.diet == FULL_DIET:
             return
         else:
-            self.diet.append(random.choice(list(set(self.diet) ^ set(self.ALL_FOODS))))
+            if rng is None:
+                rng = random
+            foods = DIET_FOODS[FULL_DIET ^ self.diet]
+            self.diet |= foods[int(rng.random() * len(foods))]
             return
 
-    def remove_from_diet(self):
-        if len(self.diet) <= 1:
-            self.diet = []
+    def remove_from_diet(self, config=None, rng=None):
+        if len(DIET_FOODS[self.diet]) <= 1:
+            self.diet = 0
             self.life_span = 0
             return
         else:
-            self.diet.remove(random.choice(self.diet))
+            if rng is None:
+                rng = random
+            foods = DIET_FOODS[self.diet]
+            self.diet ^= foods[int(rng.random() * len(foods))]
             return
 
     def __repr__(self):
         return "\tTemp: " + str(self.temp_tol) + "  Life Span: " + str(self.life_span) \
                + "  Birth Rate: " + str(self.birth_rate) + "  Water Needed: " + \
-               str(self.water_needed) + "\n\tDiet: " + str(self.diet)
+               str(self.water_needed) + "\n\tDiet: " + str(mask_to_diet(self.diet))
 
 
-# CONSTANT DECLARATIONS
-MUTATION_RATE = 10
+class Food(object):
 
-FOREST_FOODS = ['leaves', 'seeds']
-PLAINS_FOODS = ['grass', 'seeds']
-JUNGLE_FOODS = ['leaves', 'seeds', 'fruit']
-DESERT_FOODS = ['grass', 'seeds']
+    def __init__(self, name, replenish_rate=10):
+        """
+        :param name: string, one of ALL_FOODS
+        :param replenish_rate: number, how much of the food a habitat regrows each generation
+        """
+        self.name = name
+        self.replenish_rate = replenish_rate
 
-ALL_FOODS = ('grass', 'seeds', 'leaves', 'fruit')
+    def __repr__(self):
+        return self.name + "  Replenish Rate: " + str(self.replenish_rate)
 
-MAX_TEMP = 5
-MIN_TEMP = 3
-MAX_WATER = 4
-MIN_WATER = 1
-MAX_BIRTH = 3
-MAX_LIFE = 8
 
-GENE_EXPRESSION_DICT = {'aa': Traits.inc_life_span,
-                        'ad': Traits.inc_water,
-                        'bb': Traits.dec_life_span,
-                        'bd': Traits.dec_water,
-                        'ca': Traits.inc_temp,
-                        'cc': Traits.add_to_diet,
-                        'cd': Traits.dec_birth_rate,
-                        'db': Traits.dec_temp,
-                        'dc': Traits.inc_birth_rate,
-                        'dd': Traits.remove_from_diet}
+class Config(object):
 
-# Seed organisms for each habitat
-FOREST_ADAM = Organism('ab', Traits(3, 3, ['leaves']))
-FOREST_EVE  = Organism('bc', Traits(3, 3, ['leaves']))
-PLAINS_ADAM = Organism('da', Traits(4, 2, ['grass']))
-PLAINS_EVE  = Organism('bc', Traits(4, 2, ['grass']))
-JUNGLE_ADAM = Organism('ab', Traits(5, 4, ['fruit']))
-JUNGLE_EVE  = Organism('cd', Traits(5, 4, ['fruit']))
-DESERT_ADAM = Organism('ba', Traits(5, 1, ['seeds']))
-DESERT_EVE  = Organism('ad', Traits(5, 1, ['seeds']))
+    FIELDS = ('mutation_rate', 'min_temp', 'max_temp', 'min_water', 'max_water', 'max_birth', 'max_life',
+              'gene_expression')
 
-FOREST_LIFE = [FOREST_ADAM, FOREST_EVE]
-PLAINS_LIFE = [PLAINS_ADAM, PLAINS_EVE]
-JUNGLE_LIFE = [JUNGLE_ADAM, JUNGLE_EVE]
-DESERT_LIFE = [DESERT_ADAM, DESERT_EVE]
+    def __init__(self, mutation_rate=None, min_temp=None, max_temp=None, min_water=None, max_water=None,
+                 max_birth=None, max_life=None, gene_expression=None):
+        """
+        The model parameters of one run, so runs with different parameters can share a
+        process.  Every argument left as None takes the module constant of the same name.
+        :param mutation_rate: int, percent chance that a child has a mutated extra base
+        :param min_temp: int, lowest temp_tol gene expression can give
+        :param max_temp: int, highest temp_tol gene expression can give
+        :param min_water: int, lowest water_needed gene expression can give
+        :param max_water: int, highest water_needed gene expression can give
+        :param max_birth: int, highest birth_rate gene expression can give
+        :param max_life: int, highest life_span gene expression can give
+        :param gene_expression: dict mapping digrams to Traits gene expression methods or
+                                their names, in rule order, like GENE_EXPRESSION_DICT
+        :return: Config object
+        """
+        self.mutation_rate = MUTATION_RATE if mutation_rate is None else int(mutation_rate)
+        self.min_temp = MIN_TEMP if min_temp is None else int(min_temp)
+        self.max_temp = MAX_TEMP if max_temp is None else int(max_temp)
+        self.min_water = MIN_WATER if min_water is None else int(min_water)
+        self.max_water = MAX_WATER if max_water is None else int(max_water)
+        self.max_birth = MAX_BIRTH if max_birth is None else int(max_birth)
+        self.max_life = MAX_LIFE if max_life is None else int(max_life)
+        if gene_expression is None:
+            gene_expression = GENE_EXPRESSION_DICT
+        if isinstance(gene_expression, dict):
+            gene_expression = gene_expression.items()
+        self.gene_expression = collections.OrderedDict(
+            [(str(key), str(getattr(rule, '__name__', rule))) for key, rule in gene_expression])
+        if not 0 <= self.mutation_rate <= 100:
+            raise ValueError("mutation_rate must be a percentage: {}".format(self.mutation_rate))
+        if self.min_temp > self.max_temp or self.min_water > self.max_water:
+            raise ValueError("min_temp and min_water may not be above max_temp and max_water")
+        for key, name in self.gene_expression.items():
+            if not callable(getattr(Traits, name, None)):
+                raise ValueError("gene rule {!r} for {!r} is not a Traits method".format(name, key))
+        self._table = None
 
-FOREST = Habitat('Forest', 3, 3, FOREST_FOODS, FOREST_LIFE, [])
-PLAINS = Habitat('Plains', 4, 2, PLAINS_FOODS, [], [])
-JUNGLE = Habitat('Jungle', 5, 4, JUNGLE_FOODS, [], [])
-DESERT = Habitat('Desert', 5, 1, DESERT_FOODS, [], [])
-HABITATS = [FOREST, PLAINS, DESERT, JUNGLE]
+    @classmethod
+    def from_dict(cls, values):
+        """
+        :param values: dict of FIELDS, as to_dict returns or read from JSON; missing fields
+                       take the defaults
+        :return: Config object
+        """
+        unknown = set(values) - set(cls.FIELDS)
+        if unknown:
+            raise ValueError("unknown config fields: {}".format(', '.join(sorted(unknown))))
+        return cls(**dict([(str(field), value) for field, value in values.items()]))
 
+    def to_dict(self):
+        """
+        :return: OrderedDict of FIELDS, gene_expression as a list of [digram, method name]
+                 pairs so the rule order survives JSON
+        """
+        values = collections.OrderedDict([(field, getattr(self, field)) for field in self.FIELDS])
+        values['gene_expression'] = [[key, name] for key, name in self.gene_expression.items()]
+        return values
 
-def main():
+    def replace(self, **changes):
+        """
+        :return: a new Config with the given fields changed
+        """
+        values = self.to_dict()
+        values.update(changes)
+        return Config.from_dict(values)
+
+    def gene_expression_table(self):
+        """
+        The GeneExpressionTable of gene_expression bound to this Config, built on first use.
+        :return: GeneExpressionTable object
+        """
+        if self._table is None:
+            self._table = GeneExpressionTable(collections.OrderedDict(
+                [(key, getattr(Traits, name)) for key, name in self.gene_expression.items()]), self)
+        return self._table
+
+    def __getstate__(self):
+        # The table holds unbound methods, which do not pickle; it is rebuilt on demand.
+        state = self.__dict__.copy()
+        state['_table'] = None
+        return state
+
+    def __eq__(self, other):
+        return isinstance(other, Config) and self.to_dict() == other.to_dict()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'Config({})'.format(', '.join(['{}={!r}'.format(field, getattr(self, field))
+                                              for field in self.FIELDS[:-1]]))
+
+
+class GeneExpressionTable(object):
+
+    # The rules that draw random numbers; express only shares results the other rules give
+    RANDOM_RULES = (Traits.add_to_diet, Traits.remove_from_diet)
+    # The most shared results kept before they are all dropped
+    MAX_SHARED = 65536
+
+    def __init__(self, rules, config=None):
+        """
+        A compiled form of a gene expression dict such as GENE_EXPRESSION_DICT.  Each digram
+        becomes one bit of a 16-bit mask, so the rules a genome triggers are found with a
+        single lookup of Genome.digrams instead of a substring scan per rule.
+        :param rules: dict mapping two-base strings to functions that take a Traits object
+                      and a Config.  Rules are applied in the dict's iteration order.
+        :param config: Config whose trait bounds the rules keep to and whose mutation rate
+                       the engines breed with, None for DEFAULT_CONFIG
+        :return: GeneExpressionTable object
+        """
+        self.config = config or DEFAULT_CONFIG
+        self.rules = []
+        for key in rules:
+            if len(key) != 2 or key[0] not in BASES or key[1] not in BASES:
+                raise ValueError("gene expression keys must be two bases from '{}': {!r}".format(BASES, key))
+            self.rules.append((digram_bit(key), rules[key]))
+        self._expressed = {}
+        self._drawing = set()
+        self._shared = {}
+
+    def lookup(self, digrams):
+        """
+        :param digrams: int, a Genome.digrams mask
+        :return: tuple of the rule functions triggered by the mask, in rule order
+        """
+        expressed = self._expressed.get(digrams)
+        if expressed is None:
+            expressed = tuple([rule for bit, rule in self.rules if digrams & bit])
+            self._expressed[digrams] = expressed
+            if [rule for rule in expressed if rule in self.RANDOM_RULES]:
+                self._drawing.add(digrams)
+        return expressed
+
+    def items(self):
+        """
+        :return: list of (digram, rule) pairs in rule order
+        """
+        return [(BASES[(bit.bit_length() - 1) >> 2] + BASES[(bit.bit_length() - 1) & 3], rule)
+                for bit, rule in self.rules]
+
+    def express(self, traits, digrams, rng=None):
+        """
+        Applies the rules triggered by a digram mask to a copy of a Traits object.  The copy
+        is made lazily: unless a rule draws random numbers, the result only depends on the
+        values of traits and the mask, so it is built once and shared by every organism
+        with the same starting values and mask.
+        :param traits: Traits object, left unchanged
+        :param digrams: int, a Genome.digrams mask
+        :param rng: random number generator the diet rules draw from, None for the random module
+        :return: traits itself if no rule fires, otherwise a Traits object that may be shared
+        """
+        rules = self._expressed.get(digrams)
+        if rules is None:
+            rules = self.lookup(digrams)
+        if not rules:
+            return traits
+        key = None
+        if digrams not in self._drawing:
+            key = (traits.temp_tol, traits.water_needed, traits.diet, traits.food_needed, traits.birth_rate,
+                   traits.life_span, digrams)
+            shared = self._shared.get(key)
+            if shared is not None:
+                return shared
+        traits = traits.copy()
+        config = self.config
+        for rule in rules:
+            rule(traits, config, rng)
+        if key is not None:
+            if len(self._shared) >= self.MAX_SHARED:
+                self._shared.clear()
+            self._shared[key] = traits
+        return traits
+
+    def outcomes(self, traits, digrams):
+        """
+        Every result express can give, with its probability.  Only the diet rules draw
+        random numbers, each picking one food uniformly, so every pick is followed as its
+        own branch.  Other rules must not draw random numbers.
+        :param traits: Traits object, left unchanged
+        :param digrams: int, a Genome.digrams mask
+        :return: list of (Traits object, probability) pairs, equal results merged
+        """
+        branches = [(traits.copy(), 1.0)]
+        for rule in self.lookup(digrams):
+            grown = []
+            for branch, probability in branches:
+                if rule == Traits.add_to_diet and branch.diet != FULL_DIET:
+                    foods = DIET_FOODS[FULL_DIET ^ branch.diet]
+                elif rule == Traits.remove_from_diet and len(DIET_FOODS[branch.diet]) > 1:
+                    foods = DIET_FOODS[branch.diet]
+                else:
+                    rule(branch, self.config)
+                    grown.append((branch, probability))
+                    continue
+                for food in foods:
+                    choice = branch.copy()
+                    choice.diet ^= food
+                    grown.append((choice, probability / len(foods)))
+            branches = grown
+
+        merged = collections.OrderedDict()
+        for branch, probability in branches:
+            key = (branch.temp_tol, branch.water_needed, branch.diet, branch.food_needed, branch.birth_rate,
+                   branch.life_span)
+            if key in merged:
+                merged[key] = (merged[key][0], merged[key][1] + probability)
+            else:
+                merged[key] = (branch, probability)
+        return merged.values()
+
+    def __len__(self):
+        return len(self.rules)
+
+
+class PhenotypeCache(object):
+
+    RANDOM_RULES = GeneExpressionTable.RANDOM_RULES
+
+    def __init__(self, gene_expression, maxsize=4096, random_rules=RANDOM_RULES):
+        """
+        A bounded LRU cache in front of a GeneExpressionTable.  A child's traits after gene
+        expression depend only on its starting traits and its digram mask, apart from the
+        diet rules, which pick foods at random.  The cache stores the resulting Traits for
+        each (starting traits, digram mask) pair.  On a hit with no random rules the cached
+        Traits is shared as is; otherwise only the random rules are re-run, for their effect
+        on the diet, and the other fields are taken from the cached Traits.  Diet rules only
+        look at the diet, so the results and the random numbers drawn are the same as
+        running the table directly.
+        :param gene_expression: GeneExpressionTable object
+        :param maxsize: int, the most entries kept before the least recently used is dropped
+        :param random_rules: tuple of the rule functions that draw random numbers.  They
+                             may only change the diet apart from fields the cache pins.
+        :return: PhenotypeCache object
+        """
+        self.gene_expression = gene_expression
+        self.config = gene_expression.config
+        self.maxsize = maxsize
+        self.random_rules = random_rules
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+
+    def express(self, traits, digrams, rng=None):
+        """
+        Same as GeneExpressionTable.express.
+        :param traits: Traits object, left unchanged
+        :param digrams: int, a Genome.digrams mask
+        :param rng: random number generator the diet rules draw from, None for the random module
+        :return: Traits object, possibly shared with other organisms
+        """
+        key = (traits.temp_tol, traits.water_needed, traits.food_needed, traits.birth_rate,
+               traits.life_span, traits.diet, digrams)
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.hits += 1
+            self._entries[key] = entry
+            result, random_rules = entry
+            if not random_rules:
+                return result
+            scratch = traits.copy()
+            for rule in random_rules:
+                rule(scratch, self.config, rng)
+            child = result.copy()
+            child.diet = scratch.diet
+            return child
+
+        self.misses += 1
+        child = self.gene_expression.express(traits, digrams, rng)
+        random_rules = tuple([rule for rule in self.gene_expression.lookup(digrams) if rule in self.random_rules])
+        self._entries[key] = (child, random_rules)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return child
+
+    def stats(self):
+        """
+        :return: dict of hits, misses, hit_rate, size and maxsize, for sizing the cache
+        """
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+                'size': len(self._entries), 'maxsize': self.maxsize}
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class HabitatGraph(object):
+
+    def __init__(self, adjacency):
+        """
+        Which habitats a migrant may move to from each habitat of a world, kept sparse: the
+        neighbors of habitat i are indices[indptr[i]:indptr[i + 1]], in the order migrants
+        try them.  Memory grows with the number of edges, not the square of the number of
+        habitats.
+        :param adjacency: list with, for each habitat, a list of the indexes of its neighbors
+        :return: HabitatGraph object
+        """
+        self.indptr = [0]
+        self.indices = []
+        for index, neighbors in enumerate(adjacency):
+            for neighbor in neighbors:
+                if not 0 <= neighbor < len(adjacency) or neighbor == index:
+                    raise ValueError("habitat {} has an invalid neighbor: {!r}".format(index, neighbor))
+            self.indices.extend([int(neighbor) for neighbor in neighbors])
+            self.indptr.append(len(self.indices))
+        self._arrays = None
+
+    @classmethod
+    def from_edges(cls, count, edges, directed=False):
+        """
+        :param count: int, the number of habitats
+        :param edges: iterable of (habitat index, habitat index) pairs
+        :param directed: bool, True if migrants may only move from the first of each pair
+                         to the second
+        :return: HabitatGraph object, each habitat's neighbors in index order
+        """
+        adjacency = [set() for i in range(count)]
+        for start, end in edges:
+            if not 0 <= start < count:
+                raise ValueError("edge from an invalid habitat: {!r}".format(start))
+            adjacency[start].add(end)
+            if not directed and 0 <= end < count:
+                adjacency[end].add(start)
+        return cls([sorted(neighbors) for neighbors in adjacency])
+
+    @classmethod
+    def grid(cls, rows, columns, diagonal=False, wrap=False):
+        """
+        A rectangular landscape, habitat r * columns + c lying in row r and column c.
+        :param rows: int
+        :param columns: int
+        :param diagonal: bool, True for eight neighbors per habitat, False for four
+        :param wrap: bool, True to join opposite edges into a torus
+        :return: HabitatGraph object, each habitat's neighbors in index order
+        """
+        steps = [(-1, 0), (0, -1), (0, 1), (1, 0)]
+        if diagonal:
+            steps += [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+        adjacency = []
+        for row in range(rows):
+            for column in range(columns):
+                neighbors = set()
+                for row_step, column_step in steps:
+                    neighbor_row, neighbor_column = row + row_step, column + column_step
+                    if wrap:
+                        neighbor_row, neighbor_column = neighbor_row % rows, neighbor_column % columns
+                    elif not (0 <= neighbor_row < rows and 0 <= neighbor_column < columns):
+                        continue
+                    neighbors.add(neighbor_row * columns + neighbor_column)
+                neighbors.discard(row * columns + column)
+                adjacency.append(sorted(neighbors))
+        return cls(adjacency)
+
+    def neighbors(self, index):
+        return self.indices[self.indptr[index]:self.indptr[index + 1]]
+
+    def to_lists(self):
+        """
+        :return: list with each habitat's list of neighbors, as taken by __init__
+        """
+        return [self.neighbors(index) for index in range(len(self))]
+
+    def as_arrays(self):
+        """
+        :return: tuple of int arrays (indptr, indices), built on first use
+        """
+        if self._arrays is None:
+            self._arrays = np.array(self.indptr, dtype=np.int64), np.array(self.indices, dtype=np.int64)
+        return self._arrays
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def __eq__(self, other):
+        return isinstance(other, HabitatGraph) and self.indptr == other.indptr and self.indices == other.indices
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "HabitatGraph({} habitats, {} edges)".format(len(self), len(self.indices))
+
+
+class SurvivalTable(object):
+
+    def __init__(self, habitat_list, config=None, graph=None):
+        """
+        Precomputes where every possible organism can live.  An organism's survival depends
+        only on its temp_tol, water_needed and diet, and gene expression keeps those within
+        the Config's min_temp..max_temp, min_water..max_water and the 16 subsets of
+        ALL_FOODS, so the whole space fits in one small table.  Habitats with the same temp,
+        water and food are one kind, and each entry holds a bitmask of the kinds the organism
+        can survive in and the index of the first habitat of those kinds, -1 for none, so
+        the table grows with the number of kinds rather than of habitats.
+        With a graph, newborns that cannot stay only move to a neighbor of their birthplace.
+        Those routes are found from the birthplace's neighbors on first use and kept, so a
+        migrant costs one lookup however many habitats there are.
+        :param habitat_list: a list of Habitat objects
+        :param config: Config object, None for DEFAULT_CONFIG
+        :param graph: HabitatGraph of habitat_list, None to let newborns move to any habitat
+        :return: SurvivalTable object
+        """
+        config = config or DEFAULT_CONFIG
+        self.signature = SurvivalTable.habitat_signature(habitat_list)
+        self.graph = graph
+        self.temps = (config.min_temp, config.max_temp)
+        self.waters = (config.min_water, config.max_water)
+        self.kinds = []
+        self.habitat_kinds = []
+        self.first_habitats = []
+        kind_indexes = {}
+        for index, kind in enumerate(self.signature):
+            if kind not in kind_indexes:
+                kind_indexes[kind] = len(self.kinds)
+                self.kinds.append(kind)
+                self.first_habitats.append(index)
+            self.habitat_kinds.append(kind_indexes[kind])
+        self.routes = {}
+        for temp in range(config.min_temp, config.max_temp + 1):
+            for water in range(config.min_water, config.max_water + 1):
+                for diet in range(FULL_DIET + 1):
+                    self.routes[(temp, water, diet)] = self._find_route(temp, water, diet)
+        self.neighbor_routes = {}
+        self._arrays = None
+
+    @staticmethod
+    def habitat_signature(habitat_list):
+        """
+        :param habitat_list: a list of Habitat objects
+        :return: tuple of everything about the habitats that survival depends on
+        """
+        return tuple([(habitat.temp, habitat.water_avail, habitat.food_mask) for habitat in habitat_list])
+
+    def _find_route(self, temp, water, diet):
+        fits = 0
+        first = -1
+        for kind, (habitat_temp, water_avail, food_mask) in enumerate(self.kinds):
+            if temp == habitat_temp and water <= water_avail and diet & food_mask:
+                fits |= 1 << kind
+                if first < 0:
+                    first = self.first_habitats[kind]
+        return fits, first
+
+    def destination(self, traits, birthplace):
+        """
+        :param traits: Traits object of a newborn
+        :param birthplace: int, the index of the habitat it was born in
+        :return: int, the index of the habitat it lives in: its birthplace if it can survive
+                 there, otherwise the first habitat, or with a graph the first neighbor, it
+                 can survive in, -1 if there is none
+        """
+        return self.destination_for(traits.temp_tol, traits.water_needed, traits.diet, birthplace)
+
+    def destination_for(self, temp, water, diet, birthplace):
+        """
+        Same as destination for a bare (temp_tol, water_needed, diet).
+        """
+        route = self.routes.get((temp, water, diet))
+        if route is None:
+            # Traits built by hand can lie outside the table's ranges.
+            route = self._find_route(temp, water, diet)
+        fits, first = route
+        if fits >> self.habitat_kinds[birthplace] & 1:
+            return birthplace
+        if self.graph is None or first < 0:
+            return first
+        destination = self.neighbor_routes.get((birthplace, fits))
+        if destination is None:
+            destination = -1
+            for neighbor in self.graph.neighbors(birthplace):
+                if fits >> self.habitat_kinds[neighbor] & 1:
+                    destination = neighbor
+                    break
+            self.neighbor_routes[(birthplace, fits)] = destination
+        return destination
+
+    def index(self, temp, water, diet):
+        """
+        Flat position of (temp, water, diet) in the arrays returned by as_arrays.  Works on
+        ints or numpy arrays.
+        """
+        (min_temp, max_temp), (min_water, max_water) = self.temps, self.waters
+        return ((temp - min_temp) * (max_water - min_water + 1) + (water - min_water)) * (FULL_DIET + 1) + diet
+
+    def as_arrays(self):
+        """
+        The table in numpy form for the numpy engine, built on first use.
+        :return: tuple of (bool array [entry, kind] of survivability, int array [entry]
+                 of the first survivable habitat or -1, int array [habitat] of its kind)
+        """
+        if self._arrays is None:
+            (min_temp, max_temp), (min_water, max_water) = self.temps, self.waters
+            entries = (max_temp - min_temp + 1) * (max_water - min_water + 1) * (FULL_DIET + 1)
+            survives = np.zeros((entries, len(self.kinds)), dtype=bool)
+            first = np.full(entries, -1, dtype=np.int64)
+            for (temp, water, diet), (fits, first_index) in self.routes.items():
+                entry = self.index(temp, water, diet)
+                survives[entry] = [bool(fits >> kind & 1) for kind in range(len(self.kinds))]
+                first[entry] = first_index
+            self._arrays = survives, first, np.array(self.habitat_kinds, dtype=np.int64)
+        return self._arrays
+
+    def destinations(self, newborns, birthplace):
+        """
+        Routes an ArrayPopulation of newborns the same way Ecosystem.migrate routes Organisms.
+        :param newborns: ArrayPopulation object
+        :param birthplace: int array, the habitat index each newborn was born in
+        :return: int array, the habitat index each newborn ends up in, -1 if it fits none
+        """
+        temp = newborns.temp_tol.astype(np.int64)
+        water = newborns.water_needed.astype(np.int64)
+        (min_temp, max_temp), (min_water, max_water) = self.temps, self.waters
+        if ((temp < min_temp) | (temp > max_temp) | (water < min_water) | (water > max_water)).any():
+            # Only seed organisms built by hand can be outside the table's ranges.
+            return np.array([self.destination_for(*row) for row in zip(temp.tolist(), water.tolist(),
+                                                                       newborns.diet.tolist(), birthplace.tolist())],
+                            dtype=np.int64)
+        survives, first, habitat_kinds = self.as_arrays()
+        entry = self.index(temp, water, newborns.diet)
+        stays = survives[entry, habitat_kinds[birthplace]]
+        if self.graph is None:
+            return np.where(stays, birthplace, first[entry])
+        destination = np.array(birthplace, dtype=np.int64)
+        movers = np.flatnonzero(~stays)
+        destination[movers] = self._neighbor_destinations(entry[movers], destination[movers])
+        return destination
+
+    def _neighbor_destinations(self, entries, birthplaces):
+        """
+        The first neighbor of each birthplace that each entry can survive in, found for
+        every distinct (birthplace, entry) at once from the graph's sparse rows.
+        :param entries: int array of table entries, as from index
+        :param birthplaces: int array of habitat indexes
+        :return: int array of habitat indexes, -1 where no neighbor fits
+        """
+        if not len(entries):
+            return np.zeros(0, dtype=np.int64)
+        survives, first, habitat_kinds = self.as_arrays()
+        indptr, indices = self.graph.as_arrays()
+        pairs, inverse = np.unique(birthplaces * len(survives) + entries, return_inverse=True)
+        entry, origin = pairs % len(survives), pairs // len(survives)
+        degree = indptr[origin + 1] - indptr[origin]
+        positions = _segment_positions(indptr[origin], degree)
+        fits = survives[np.repeat(entry, degree), habitat_kinds[indices[positions]]]
+        # The first fitting position in each row; len(indices) stands for none and maps to -1.
+        found = np.full(len(pairs), len(indices), dtype=np.int64)
+        has_neighbors = degree > 0
+        if has_neighbors.any():
+            row_start = np.cumsum(degree) - degree
+            found[has_neighbors] = np.minimum.reduceat(np.where(fits, positions, len(indices)),
+                                                       row_start[has_neighbors])
+        return np.append(indices, -1)[found][inverse]
+
+
+def _segment_positions(starts, lengths):
+    """
+    Expands (start, length) segments of a flat buffer into one array of buffer positions.
+    :param starts: int array, first buffer position of each segment
+    :param lengths: int array, number of positions in each segment
+    :return: int array of positions, segments laid out back to back
+    """
+    total = int(lengths.sum())
+    new_starts = np.cumsum(lengths) - lengths
+    return np.arange(total, dtype=np.int64) + np.repeat(starts - new_starts, lengths)
+
+
+class ArrayPopulation(object):
+
+    TRAIT_FIELDS = ('temp_tol', 'water_needed', 'food_needed', 'birth_rate', 'life_span', 'diet')
+
+    def __init__(self, temp_tol, water_needed, food_needed, birth_rate, life_span, diet,
+                 genome_start, genome_len, genome_buf):
+        """
+        Structure-of-arrays storage for the wildlife of one habitat.  Row i of every trait
+        array belongs to the same organism.  Genomes are kept in one flat buffer of base
+        codes (0-3 for 'abcd'), organism i owning genome_buf[genome_start[i]:][:genome_len[i]].
+        :param temp_tol: int8 array
+        :param water_needed: int8 array
+        :param food_needed: int8 array
+        :param birth_rate: int8 array
+        :param life_span: int8 array
+        :param diet: uint8 array, bit i set if ALL_FOODS[i] is eaten
+        :param genome_start: int64 array
+        :param genome_len: int64 array
+        :param genome_buf: uint8 array
+        :return: ArrayPopulation object
+        """
+        self.temp_tol = temp_tol
+        self.water_needed = water_needed
+        self.food_needed = food_needed
+        self.birth_rate = birth_rate
+        self.life_span = life_span
+        self.diet = diet
+        self.genome_start = genome_start
+        self.genome_len = genome_len
+        self.genome_buf = genome_buf
+
+    @classmethod
+    def empty(cls):
+        return cls.from_organisms([])
+
+    @classmethod
+    def from_organisms(cls, organisms):
+        """
+        Packs a list of Organism objects into arrays.
+        :param organisms: list of Organism objects
+        :return: ArrayPopulation object
+        """
+        genomes = [organism.genome for organism in organisms]
+        genome_len = np.array([len(genome) for genome in genomes], dtype=np.int64)
+        packed_len = np.array([len(genome.packed) for genome in genomes], dtype=np.int64)
+        genome_buf = unpack_genomes(''.join([genome.packed for genome in genomes]))
+        return cls(np.array([o.traits.temp_tol for o in organisms], dtype=np.int8),
+                   np.array([o.traits.water_needed for o in organisms], dtype=np.int8),
+                   np.array([o.traits.food_needed for o in organisms], dtype=np.int8),
+                   np.array([o.traits.birth_rate for o in organisms], dtype=np.int8),
+                   np.array([o.life_span for o in organisms], dtype=np.int8),
+                   np.array([o.traits.diet for o in organisms], dtype=np.uint8),
+                   4 * (np.cumsum(packed_len) - packed_len), genome_len, genome_buf)
+
+    @classmethod
+    def concat(cls, populations):
+        """
+        Joins several populations into one, rebasing their genome buffers.
+        :param populations: list of ArrayPopulation objects
+        :return: ArrayPopulation object
+        """
+        populations = [population for population in populations if len(population)]
+        if not populations:
+            return cls.empty()
+        if len(populations) == 1:
+            return populations[0]
+        buf_offsets = np.cumsum([0] + [len(p.genome_buf) for p in populations[:-1]])
+        fields = [np.concatenate([getattr(p, field) for p in populations]) for field in cls.TRAIT_FIELDS]
+        return cls(*(fields + [np.concatenate([p.genome_start + offset for p, offset in zip(populations, buf_offsets)]),
+                               np.concatenate([p.genome_len for p in populations]),
+                               np.concatenate([p.genome_buf for p in populations])]))
+
+    def take(self, rows):
+        """
+        Selects a subset of organisms and compacts their genomes into a new buffer.
+        :param rows: int array of row indices
+        :return: ArrayPopulation object
+        """
+        genome_len = self.genome_len[rows]
+        genome_buf = self.genome_buf[_segment_positions(self.genome_start[rows], genome_len)]
+        fields = [getattr(self, field)[rows] for field in self.TRAIT_FIELDS]
+        return ArrayPopulation(*(fields + [np.cumsum(genome_len) - genome_len, genome_len, genome_buf]))
+
+    def breed(self, rng, gene_expression):
+        """
+        The batched counterpart of Habitat.breed_wildlife.  Organisms are shuffled and paired
+        off two at a time, the first of each pair acting as mom, and each pair has
+        mom.birth_rate children.  Child genomes are sampled from the parents' pooled bases
+        exactly as Organism.breed does, then genes are expressed on the whole litter.
+        With a CounterStream every pair draws from its own stream: child j of a pair with
+        n children takes draw j * (2 + rules) for its mutation, the next for the mutated
+        base and one per gene rule, and the genome picks of the litter follow at n * (2 + rules).
+        :param rng: numpy RandomState, or the habitat's CounterRandom.PAIRING CounterStream
+        :param gene_expression: GeneExpressionTable applied to the children
+        :return: ArrayPopulation of the new generation
+        """
+        pairs = len(self) // 2
+        if pairs == 0:
+            return ArrayPopulation.empty()
+        order = rng.permutation(len(self))
+        litter = np.maximum(self.birth_rate[order[0:2 * pairs:2]], 0)
+        moms = np.repeat(order[0:2 * pairs:2], litter)
+        dads = np.repeat(order[1:2 * pairs:2], litter)
+        children = len(moms)
+        if children == 0:
+            return ArrayPopulation.empty()
+
+        mom_len = self.genome_len[moms]
+        dad_len = self.genome_len[dads]
+        if isinstance(rng, CounterStream):
+            pair = np.repeat(np.arange(pairs), litter)
+            first = np.repeat(np.cumsum(litter) - litter, litter)
+            stride = 2 + len(gene_expression.rules)
+            children_rng = CounterStream(rng.counter, rng.generation, rng.habitat, pair,
+                                         (np.arange(children) - first) * stride)
+            mutated = (children_rng.at() * 100).astype(np.int64) + 1 <= gene_expression.config.mutation_rate
+            mutated_gene = (children_rng.at(offset=1) * len(BASES)).astype(np.uint8)
+        else:
+            mutated = rng.randint(1, 101, size=children) <= gene_expression.config.mutation_rate
+            mutated_gene = rng.randint(0, len(BASES), size=children).astype(np.uint8)
+        pool_len = mom_len + dad_len + mutated
+        child_len = (mom_len + dad_len) // 2 + mutated
+
+        owner = np.repeat(np.arange(children), child_len)
+        if isinstance(rng, CounterStream):
+            gene_start = np.cumsum(child_len) - child_len
+            litter_start = litter[pair] * stride - gene_start[first]
+            draws = np.arange(len(owner)) + litter_start[owner]
+            pick = (rng.counter.uniforms(rng.generation, rng.habitat, pair[owner], draws)
+                    * pool_len[owner]).astype(np.int64)
+            rng = children_rng.offset(2)
+        else:
+            pick = (rng.random_sample(len(owner)) * pool_len[owner]).astype(np.int64)
+        owner_mom_len = mom_len[owner]
+        from_mom = pick < owner_mom_len
+        from_dad = ~from_mom & (pick < owner_mom_len + dad_len[owner])
+        genome_buf = mutated_gene[owner]
+        genome_buf[from_mom] = self.genome_buf[self.genome_start[moms][owner[from_mom]] + pick[from_mom]]
+        genome_buf[from_dad] = self.genome_buf[self.genome_start[dads][owner[from_dad]] + pick[from_dad]
+                                               - owner_mom_len[from_dad]]
+
+        # Children start from the same record as Traits.offspring: mom's food_needed and the
+        # Traits defaults for birth_rate and life_span.
+        new_gen = ArrayPopulation(self.temp_tol[moms], self.water_needed[moms], self.food_needed[moms],
+                                  np.ones(children, dtype=np.int8), np.full(children, 4, dtype=np.int8),
+                                  self.diet[moms], np.cumsum(child_len) - child_len, child_len, genome_buf)
+        new_gen.express_genes(rng, gene_expression)
+        return new_gen
+
+    def digram_masks(self):
+        """
+        Finds which of the 16 adjacent base pairs occur in each genome.
+        :return: uint16 array, bit 4 * first + second set if that digram is present
+        """
+        masks = np.zeros(len(self), dtype=np.uint16)
+        pair_len = np.maximum(self.genome_len - 1, 0)
+        positions = _segment_positions(self.genome_start, pair_len)
+        if len(positions) == 0:
+            return masks
+        codes = self.genome_buf[positions].astype(np.uint16) * 4 + self.genome_buf[positions + 1]
+        bits = np.left_shift(np.uint16(1), codes)
+        has_pairs = pair_len > 0
+        pair_start = np.cumsum(pair_len) - pair_len
+        masks[has_pairs] = np.bitwise_or.reduceat(bits, pair_start[has_pairs])
+        return masks
+
+    def express_genes(self, rng, gene_expression):
+        """
+        Applies a GeneExpressionTable to every organism at once, rule by rule in table
+        order, using the method of the same name on this class.
+        :param rng: numpy RandomState used by the diet rules, or a per-row CounterStream
+                    whose rule i takes the draw i of each row
+        :param gene_expression: GeneExpressionTable whose rules are all Traits methods
+        :return: no return value
+        """
+        masks = self.digram_masks()
+        for position, (bit, rule) in enumerate(gene_expression.rules):
+            rows = np.flatnonzero(masks & bit)
+            if len(rows):
+                rule_rng = rng.offset(position) if isinstance(rng, CounterStream) else rng
+                getattr(self, rule.__name__)(rows, rule_rng, gene_expression.config)
+
+    # Vectorized versions of the Traits gene expression methods.  Each one takes the rows
+    # that carry the gene, the random number generator and the Config.
+    def inc_temp(self, rows, rng, config):
+        self.temp_tol[rows] = np.minimum(self.temp_tol[rows] + 1, config.max_temp)
+
+    def dec_temp(self, rows, rng, config):
+        self.temp_tol[rows] = np.maximum(self.temp_tol[rows] - 1, config.min_temp)
+
+    def inc_water(self, rows, rng, config):
+        self.water_needed[rows] = np.minimum(self.water_needed[rows] + 1, config.max_water)
+
+    def dec_water(self, rows, rng, config):
+        self.water_needed[rows] = np.maximum(self.water_needed[rows] - 1, config.min_water)
+
+    def inc_birth_rate(self, rows, rng, config):
+        self.birth_rate[rows] = np.minimum(self.birth_rate[rows] + 1, config.max_birth)
+
+    def dec_birth_rate(self, rows, rng, config):
+        self.birth_rate[rows] -= 1
+        self.life_span[rows[self.birth_rate[rows] <= 0]] = 0
+
+    def inc_life_span(self, rows, rng, config):
+        self.life_span[rows] = np.minimum(self.life_span[rows] + 1, config.max_life)
+
+    def dec_life_span(self, rows, rng, config):
+        self.life_span[rows] -= 1
+
+    def add_to_diet(self, rows, rng, config):
+        diet = self.diet[rows]
+        rows = rows[diet != FULL_DIET]
+        missing = FULL_DIET ^ self.diet[rows]
+        choice = (_row_uniforms(rng, rows) * DIET_SIZE[missing]).astype(np.int64)
+        self.diet[rows] |= DIET_NTH_FOOD[missing, choice]
+
+    def remove_from_diet(self, rows, rng, config):
+        diet = self.diet[rows]
+        starving = rows[DIET_SIZE[diet] <= 1]
+        self.diet[starving] = 0
+        self.life_span[starving] = 0
+        rows = rows[DIET_SIZE[diet] > 1]
+        diet = self.diet[rows]
+        choice = (_row_uniforms(rng, rows) * DIET_SIZE[diet]).astype(np.int64)
+        self.diet[rows] ^= DIET_NTH_FOOD[diet, choice]
+
+    def nbytes(self):
+        """
+        :return: int, bytes held by the columns and the genome buffer
+        """
+        return sum([getattr(self, field).nbytes for field in self.TRAIT_FIELDS]) \
+            + self.genome_start.nbytes + self.genome_len.nbytes + self.genome_buf.nbytes
+
+    def feed(self, stock, rng):
+        """
+        Feeds the whole population from a habitat's food stock with allocate_food and
+        starves everyone left hungry by setting their life_span to 0.
+        :param stock: float array over ALL_FOODS, the food left, reduced in place
+        :param rng: numpy RandomState
+        :return: int, the number of organisms that starved
+        """
+        fed = allocate_food(self.food_needed, self.diet, stock, rng)
+        starving = np.flatnonzero(~fed)
+        self.life_span[starving] = 0
+        return len(starving)
+
+    def can_survive(self, habitat):
+        """
+        :param habitat: Habitat object
+        :return: bool array, True where the organism could live in habitat
+        """
+        return ((self.temp_tol == habitat.temp) & (self.water_needed <= habitat.water_avail)
+                & (self.diet & habitat.food_mask != 0))
+
+    def to_organisms(self):
+        """
+        Unpacks the arrays into Organism objects.
+        :return: list of Organism objects
+        """
+        chars = BASES_BUF[self.genome_buf].tostring()
+        organisms = []
+        for i in xrange(len(self)):
+            start = self.genome_start[i]
+            traits = Traits(int(self.temp_tol[i]), int(self.water_needed[i]), int(self.diet[i]),
+                            int(self.food_needed[i]), int(self.birth_rate[i]), int(self.life_span[i]))
+            organisms.append(Organism(chars[start:start + self.genome_len[i]], traits))
+        return organisms
+
+    def __len__(self):
+        return len(self.temp_tol)
+
+
+class ArrayEngine(object):
+
+    def __init__(self, habitat_list, seed=None, gene_expression=None, counter_random=None):
+        """
+        Runs the four generation phases for a list of habitats on ArrayPopulations instead
+        of lists of Organisms.  Selected with Ecosystem(habitat_list, engine='numpy').
+        :param habitat_list: a list of Habitat objects, their wildlife lists are the seed population
+        :param seed: int, seed for the engine's numpy RandomState, can be None
+        :param gene_expression: GeneExpressionTable, None for GENE_EXPRESSION_TABLE.  Every rule
+                                must be a Traits method that ArrayPopulation has a batched version of.
+        :param counter_random: CounterRandom to breed and feed with instead of the RandomState,
+                               None for the RandomState
+        :return: ArrayEngine object
+        """
+        if np is None:
+            raise ImportError("the numpy engine requires numpy")
+        if gene_expression is None:
+            gene_expression = GENE_EXPRESSION_TABLE
+        ArrayEngine.check_rules(gene_expression)
+        self.gene_expression = gene_expression
+        self.habitats = habitat_list
+        self.rng = np.random.RandomState(seed)
+        self.counter_random = counter_random
+        self.generation = 0
+        self.populations = [ArrayPopulation.from_organisms(habitat.wildlife or []) for habitat in habitat_list]
+        self.new_gen = [ArrayPopulation.empty() for habitat in habitat_list]
+
+    @staticmethod
+    def check_rules(gene_expression):
+        for bit, rule in gene_expression.rules:
+            if not hasattr(ArrayPopulation, getattr(rule, '__name__', '')):
+                raise ValueError("the numpy engine has no batched form of gene rule {!r}".format(rule))
+
+    def stream(self, index, pair):
+        """
+        :return: the RandomState, or with counter_random the CounterStream of this
+                 generation's pair stream in habitat index
+        """
+        if self.counter_random is None:
+            return self.rng
+        return self.counter_random.stream(self.generation, index, pair)
+
+    def breed_all(self):
+        self.new_gen = [population.breed(self.stream(index, CounterRandom.PAIRING), self.gene_expression)
+                        for index, population in enumerate(self.populations)]
+
+    def migrate(self, table, tallies=None):
+        """
+        Newborns stay where they were born if they can survive there, otherwise they move to
+        the first habitat in list order, or neighbor in the table's graph, that they can
+        survive in.  Organisms that fit no
+        habitat are dropped, as in Ecosystem.migrate.
+        :param table: SurvivalTable for self.habitats
+        :param tallies: list of HabitatTally objects to update, can be None
+        :return: no return value
+        """
+        newborns = ArrayPopulation.concat(self.new_gen)
+        birthplace = np.repeat(np.arange(len(self.habitats)), [len(population) for population in self.new_gen])
+        destination = table.destinations(newborns, birthplace)
+
+        order = np.argsort(destination, kind='mergesort')
+        bounds = np.cumsum(np.bincount(destination + 1, minlength=len(self.habitats) + 1))
+        for index in range(len(self.habitats)):
+            arrivals = newborns.take(order[bounds[index]:bounds[index + 1]])
+            self.populations[index] = ArrayPopulation.concat([self.populations[index], arrivals])
+            if tallies is not None:
+                tallies[index].add_population(arrivals)
+
+        if tallies is not None:
+            habitat_count = len(self.habitats)
+            moved = (destination != birthplace) & (destination >= 0)
+            births = np.bincount(birthplace, minlength=habitat_count)
+            migrants_out = np.bincount(birthplace[moved], minlength=habitat_count)
+            migrants_in = np.bincount(destination[moved], minlength=habitat_count)
+            lost = np.bincount(birthplace[destination < 0], minlength=habitat_count)
+            for index, tally in enumerate(tallies):
+                tally.births += int(births[index])
+                tally.migrants_out += int(migrants_out[index])
+                tally.migrants_in += int(migrants_in[index])
+                tally.lost += int(lost[index])
+        self.new_gen = [ArrayPopulation.empty() for habitat in self.habitats]
+
+    def feed(self, stocks):
+        """
+        :param stocks: list of float arrays over ALL_FOODS, one per habitat, reduced in place
+        :return: list of ints, the number starved in each habitat
+        """
+        return [population.feed(stock, self.stream(index, CounterRandom.FEEDING))
+                for index, (population, stock) in enumerate(zip(self.populations, stocks))]
+
+    def age_all(self):
+        for population in self.populations:
+            population.life_span -= 1
+        self.generation += 1
+
+    def remove_all_dead(self, tallies=None):
+        if tallies is not None:
+            for population, tally in zip(self.populations, tallies):
+                dead = population.take(np.flatnonzero(population.life_span <= 0))
+                tally.deaths += len(dead)
+                tally.remove_population(dead)
+        self.populations = [population.take(np.flatnonzero(population.life_span > 0))
+                            for population in self.populations]
+
+    def counts(self):
+        return [len(population) for population in self.populations]
+
+    def sample(self, index, count, rand):
+        """
+        :param index: int, the habitat
+        :param count: int, the most organisms wanted
+        :param rand: random.Random, kept apart from the simulation's generators
+        :return: list of up to count Organisms picked at random from the habitat
+        """
+        population = self.populations[index]
+        rows = rand.sample(xrange(len(population)), min(count, len(population)))
+        return population.take(np.array(rows, dtype=np.int64)).to_organisms()
+
+    def to_organisms(self, index):
+        return self.populations[index].to_organisms()
+
+
+def _split_counts(counts, draws, rng):
+    """
+    Draws without replacement from groups of the given sizes, one hypergeometric draw per
+    group, so the cost depends on the number of groups rather than on the number drawn.
+    :param counts: int array, the size of each group
+    :param draws: int, how many to draw, at most counts.sum()
+    :param rng: numpy RandomState
+    :return: int array, how many were drawn from each group
+    """
+    taken = np.zeros(len(counts), dtype=np.int64)
+    left = int(counts.sum())
+    for i, count in enumerate(counts.tolist()):
+        if not draws:
+            break
+        left -= count
+        if not count:
+            continue
+        got = draws if not left else rng.hypergeometric(count, left, draws)
+        taken[i] = got
+        draws -= got
+    return taken
+
+
+def _sample_genomes(pools, lengths, counts, rng):
+    """
+    Draws the child genomes of many litters at once, each base chosen at random from the
+    litter's pool as Genome.crossover does, and groups the equal ones.  A litter with no
+    more possible genomes than children takes one multinomial draw over all of them; the
+    rest are drawn child by child, batched by genome length.
+    :param pools: int array [litter, base], how many of each base code the parents (and any
+                  mutation) put in each litter's pool
+    :param lengths: int array, bases per child in each litter
+    :param counts: int array, children in each litter
+    :param rng: numpy RandomState
+    :return: list of (litter index, Genome object, count) tuples
+    """
+    weights = pools / np.maximum(pools.sum(axis=1), 1)[:, np.newaxis].astype(float)
+    kinds = (pools > 0).sum(axis=1)
+    enumerable = kinds.astype(float) ** lengths <= counts
+    groups = []
+    for litter in np.flatnonzero(enumerable).tolist():
+        length = int(lengths[litter])
+        codes = np.array(list(itertools.product(np.flatnonzero(pools[litter]).tolist(), repeat=length)),
+                         dtype=np.int64).reshape(-1, length)
+        probabilities = weights[litter][codes].prod(axis=1)
+        numbers = rng.multinomial(counts[litter], probabilities / probabilities.sum())
+        kept = np.flatnonzero(numbers)
+        groups.append((np.full(len(kept), litter, dtype=np.int64), codes[kept], numbers[kept]))
+
+    drawn = np.flatnonzero(~enumerable)
+    for length in np.unique(lengths[drawn]).tolist():
+        litters = drawn[lengths[drawn] == length]
+        owner = np.repeat(litters, counts[litters])
+        cumulative = np.cumsum(weights[owner], axis=1)
+        cumulative /= cumulative[:, -1:]
+        draws = rng.random_sample((len(owner), length))
+        codes = np.zeros(draws.shape, dtype=np.int64)
+        for base in range(len(BASES) - 1):
+            codes += draws >= cumulative[:, base:base + 1]
+        rows, numbers = np.unique(np.column_stack([owner, codes]), axis=0, return_counts=True)
+        groups.append((rows[:, 0], rows[:, 1:], numbers))
+
+    genomes = []
+    for owner, codes, numbers in groups:
+        length = codes.shape[1]
+        padded = np.zeros((len(codes), -(-length // 4) * 4), dtype=np.uint8)
+        padded[:, :length] = codes
+        packed = (padded[:, 0::4] | (padded[:, 1::4] << 2) | (padded[:, 2::4] << 4) | (padded[:, 3::4] << 6))
+        width = packed.shape[1]
+        data = packed.tostring()
+        genomes.extend([(litter, Genome(data[i * width:(i + 1) * width], length), number)
+                        for i, (litter, number) in enumerate(zip(owner.tolist(), numbers.tolist()))])
+    return genomes
+
+
+class CohortPopulation(object):
+
+    def __init__(self, cohorts=None):
+        """
+        The wildlife of one habitat stored as counted groups of identical organisms.  Each
+        key is (genome, temp_tol, water_needed, food_needed, birth_rate, diet, life_span),
+        life_span being the generations left to live, and maps to the number of organisms
+        that share it.  While genetic diversity is low a few hundred keys can stand for any
+        number of organisms, and every method here costs time in the number of keys.
+        :param cohorts: OrderedDict mapping keys to counts, can be None
+        :return: CohortPopulation object
+        """
+        if cohorts is None:
+            cohorts = collections.OrderedDict()
+        self.cohorts = cohorts
+
+    @classmethod
+    def from_organisms(cls, organisms):
+        """
+        :param organisms: list of Organism objects
+        :return: CohortPopulation object
+        """
+        population = cls()
+        for organism in organisms:
+            traits = organism.traits
+            population.add((organism.genome, traits.temp_tol, traits.water_needed, traits.food_needed,
+                            traits.birth_rate, traits.diet, organism.life_span))
+        return population
+
+    def add(self, key, count=1):
+        self.cohorts[key] = self.cohorts.get(key, 0) + count
+
+    def items(self):
+        return self.cohorts.items()
+
+    def pairs(self, rng):
+        """
+        Pairs the organisms off at random as Habitat.breed_wildlife does: a uniform random
+        matching that leaves one organism out when the count is odd.  The moms are a
+        hypergeometric split of the counts and each mom cohort's dads another, unless there
+        are so many cohorts that shuffling the organisms themselves is cheaper.
+        :param rng: numpy RandomState
+        :return: list of (mom key index, dad key index, number of pairs) tuples
+        """
+        counts = np.array(self.cohorts.values(), dtype=np.int64)
+        total = int(counts.sum())
+        kinds = len(counts)
+        if total < 2:
+            return []
+        # A hypergeometric draw costs about as much as shuffling a dozen organisms.
+        if 16 * kinds * kinds > total:
+            organisms = rng.permutation(np.repeat(np.arange(kinds), counts))
+            couples = 2 * (total // 2)
+            codes, numbers = np.unique(organisms[0:couples:2] * kinds + organisms[1:couples:2],
+                                       return_counts=True)
+            return zip((codes // kinds).tolist(), (codes % kinds).tolist(), numbers.tolist())
+
+        if total % 2:
+            counts = counts - _split_counts(counts, 1, rng)
+        moms = _split_counts(counts, total // 2, rng)
+        dads = counts - moms
+        pairs = []
+        for mom, count in enumerate(moms.tolist()):
+            if count:
+                taken = _split_counts(dads, count, rng)
+                dads -= taken
+                pairs.extend([(mom, dad, int(taken[dad])) for dad in np.flatnonzero(taken).tolist()])
+        return pairs
+
+    def breed(self, rng, gene_expression, phenotypes):
+        """
+        Breeds the population as Habitat.breed_wildlife does, a pairing of cohorts at a time.
+        Each pairing's children are split by mutated base with chained binomial draws, their
+        genomes drawn with _sample_genomes and their traits with a multinomial over the
+        outcomes of gene expression.
+        :param rng: numpy RandomState
+        :param gene_expression: GeneExpressionTable object
+        :param phenotypes: dict caching GeneExpressionTable.outcomes by starting traits and
+                           digram mask, shared across generations
+        :return: CohortPopulation of the children
+        """
+        newborns = CohortPopulation()
+        pairs = self.pairs(rng)
+        if not pairs:
+            return newborns
+        keys = self.cohorts.keys()
+        moms, dads, couples = [np.array(column, dtype=np.int64) for column in zip(*pairs)]
+        genome_len = np.array([key[0].length for key in keys], dtype=np.int64)
+        base_counts = np.array([np.bincount(unpack_genomes(key[0].packed)[:key[0].length], minlength=len(BASES))
+                                for key in keys], dtype=np.int64).reshape(-1, len(BASES))
+        birth_rate = np.array([key[4] for key in keys], dtype=np.int64)
+
+        # Column 0 is the children without a mutation, column 1 + code those with one.
+        mutants = rng.binomial(couples * np.maximum(birth_rate[moms], 0), gene_expression.config.mutation_rate / 100.0)
+        litters = [couples * np.maximum(birth_rate[moms], 0) - mutants]
+        for code in range(len(BASES)):
+            mutated = rng.binomial(mutants, 1.0 / (len(BASES) - code))
+            litters.append(mutated)
+            mutants = mutants - mutated
+        litters = np.column_stack(litters)
+
+        pair, mutation = np.nonzero(litters)
+        pools = base_counts[moms[pair]] + base_counts[dads[pair]]
+        mutated = np.flatnonzero(mutation)
+        pools[mutated, mutation[mutated] - 1] += 1
+        lengths = (genome_len[moms[pair]] + genome_len[dads[pair]]) // 2 + (mutation > 0)
+
+        for litter, child_genome, number in _sample_genomes(pools, lengths, litters[pair, mutation], rng):
+            genome, temp_tol, water_needed, food_needed, birth_rate, diet, life_span = keys[moms[pair[litter]]]
+            start = (temp_tol, water_needed, diet, food_needed, child_genome.digrams)
+            outcomes = phenotypes.get(start)
+            if outcomes is None:
+                outcomes = [((traits.temp_tol, traits.water_needed, traits.food_needed,
+                              traits.birth_rate, traits.diet, traits.life_span), probability)
+                            for traits, probability in
+                            gene_expression.outcomes(Traits(temp_tol, water_needed, diet, food_needed=food_needed),
+                                                     child_genome.digrams)]
+                phenotypes[start] = outcomes
+            if len(outcomes) == 1:
+                newborns.add((child_genome,) + outcomes[0][0], number)
+                continue
+            numbers = rng.multinomial(number, [probability for traits, probability in outcomes])
+            for (traits, probability), count in zip(outcomes, numbers.tolist()):
+                if count:
+                    newborns.add((child_genome,) + traits, count)
+        return newborns
+
+    def feed(self, stock, rng):
+        """
+        Same as ArrayPopulation.feed.  The queue for food is a random order of individual
+        organisms, so this costs time in the number of organisms, in numpy.
+        """
+        keys = self.cohorts.keys()
+        counts = np.array(self.cohorts.values(), dtype=np.int64)
+        kinds = np.repeat(np.arange(len(keys)), counts)
+        needs = np.array([key[3] for key in keys], dtype=np.int64)
+        diets = np.array([key[5] for key in keys], dtype=np.uint8)
+        fed = allocate_food(needs[kinds], diets[kinds], stock, rng)
+        hungry = counts - np.bincount(kinds[fed], minlength=len(keys))
+        for key, count in zip(keys, hungry.tolist()):
+            if count:
+                self.cohorts[key] -= count
+                self.add(key[:-1] + (0,), count)
+        return int(hungry.sum())
+
+    def age(self):
+        self.cohorts = collections.OrderedDict([(key[:-1] + (key[-1] - 1,), count)
+                                                for key, count in self.cohorts.items()])
+
+    def remove_dead(self):
+        """
+        :return: CohortPopulation of the dead, who are taken out of this one
+        """
+        living = collections.OrderedDict()
+        dead = collections.OrderedDict()
+        for key, count in self.cohorts.items():
+            if count:
+                (living if key[-1] > 0 else dead)[key] = count
+        self.cohorts = living
+        return CohortPopulation(dead)
+
+    def to_organisms(self):
+        """
+        :return: list of Organism objects, each cohort's sharing one Traits object
+        """
+        organisms = []
+        for (genome, temp_tol, water_needed, food_needed, birth_rate, diet, life_span), count in self.items():
+            traits = Traits(temp_tol, water_needed, diet, food_needed, birth_rate, life_span)
+            organisms.extend([Organism(genome, traits, life_span) for i in xrange(count)])
+        return organisms
+
+    def to_array(self):
+        """
+        :return: ArrayPopulation with one row per organism
+        """
+        kinds = ArrayPopulation.from_organisms(CohortPopulation(collections.OrderedDict(
+            [(key, 1) for key in self.cohorts])).to_organisms())
+        return kinds.take(np.repeat(np.arange(len(kinds)), np.array(self.cohorts.values(), dtype=np.int64)))
+
+    def __len__(self):
+        return sum(self.cohorts.values())
+
+
+class CohortEngine(object):
+
+    def __init__(self, habitat_list, seed=None, gene_expression=None):
+        """
+        Runs the generation phases on CohortPopulations, so memory and most of the time
+        scale with the number of distinct organisms rather than the head count.  Selected
+        with Ecosystem(habitat_list, engine='cohort').
+        :param habitat_list: a list of Habitat objects, their wildlife lists are the seed population
+        :param seed: int, seed for the engine's numpy RandomState, can be None
+        :param gene_expression: GeneExpressionTable, None for GENE_EXPRESSION_TABLE.  Apart from
+                                add_to_diet and remove_from_diet no rule may draw random numbers.
+        :return: CohortEngine object
+        """
+        if np is None:
+            raise ImportError("the cohort engine requires numpy")
+        if gene_expression is None:
+            gene_expression = GENE_EXPRESSION_TABLE
+        self.gene_expression = gene_expression
+        self.habitats = habitat_list
+        self.rng = np.random.RandomState(seed)
+        self.cohorts = [CohortPopulation.from_organisms(habitat.wildlife or []) for habitat in habitat_list]
+        self.new_gen = [CohortPopulation() for habitat in habitat_list]
+        self.phenotypes = {}
+
+    @property
+    def populations(self):
+        """
+        The wildlife of every habitat as ArrayPopulations, one row per organism.
+        """
+        return [population.to_array() for population in self.cohorts]
+
+    @populations.setter
+    def populations(self, populations):
+        self.cohorts = [CohortPopulation.from_organisms(population.to_organisms()) for population in populations]
+
+    def breed_all(self):
+        self.new_gen = [population.breed(self.rng, self.gene_expression, self.phenotypes)
+                        for population in self.cohorts]
+
+    def migrate(self, table, tallies=None):
+        """
+        Same as ArrayEngine.migrate, routing a whole cohort at a time.
+        """
+        for index, newborns in enumerate(self.new_gen):
+            for key, count in newborns.items():
+                destination = table.destination_for(key[1], key[2], key[5], index)
+                if destination >= 0:
+                    self.cohorts[destination].add(key, count)
+                if tallies is not None:
+                    tallies[index].births += count
+                    if destination < 0:
+                        tallies[index].lost += count
+                        continue
+                    if destination != index:
+                        tallies[index].migrants_out += count
+                        tallies[destination].migrants_in += count
+                    tallies[destination].add_cohorts(((key, count),))
+        self.new_gen = [CohortPopulation() for habitat in self.habitats]
+
+    def feed(self, stocks):
+        """
+        Same as ArrayEngine.feed.
+        """
+        return [population.feed(stock, self.rng) for population, stock in zip(self.cohorts, stocks)]
+
+    def age_all(self):
+        for population in self.cohorts:
+            population.age()
+
+    def remove_all_dead(self, tallies=None):
+        for index, population in enumerate(self.cohorts):
+            dead = population.remove_dead()
+            if tallies is not None:
+                tallies[index].deaths += len(dead)
+                tallies[index].remove_cohorts(dead.items())
+
+    def counts(self):
+        return [len(population) for population in self.cohorts]
+
+    def sample(self, index, count, rand):
+        """
+        Same as ArrayEngine.sample, picking with replacement, in proportion to the counts.
+        """
+        population = self.cohorts[index]
+        total = len(population)
+        picks = sorted([rand.random() * total for i in range(min(count, total))])
+        organisms = []
+        seen = 0
+        for key, number in population.items():
+            seen += number
+            while picks and picks[0] < seen:
+                picks.pop(0)
+                organisms.extend(CohortPopulation(collections.OrderedDict([(key, 1)])).to_organisms())
+        return organisms
+
+    def to_organisms(self, index):
+        return self.cohorts[index].to_organisms()
+
+
+class CalendarEngine(object):
+
+    def __init__(self, habitat_list, gene_expression=None, rng=None, pairing=None):
+        """
+        Runs the object engine's Organisms with each habitat's wildlife kept in buckets by
+        the tick of the engine's clock at which it dies, like a calendar queue.  Aging is
+        one tick of the clock and removing the dead is dropping the buckets that are due,
+        so neither touches the living.  The Organisms' life_span is only brought up to date
+        when they are handed out by to_organisms.  Selected with
+        Ecosystem(habitat_list, engine='calendar').
+        :param habitat_list: a list of Habitat objects, their wildlife lists are the seed population
+        :param gene_expression: GeneExpressionTable or PhenotypeCache, None for GENE_EXPRESSION_TABLE
+        :param rng: BlockRandom, None for the random module
+        :param pairing: function, the mate pairing policy, None for pair_uniform
+        :return: CalendarEngine object
+        """
+        self.habitats = habitat_list
+        self.gene_expression = gene_expression
+        self.rng = rng
+        self.pairing = pairing
+        self.clock = 0
+        self.pedigree = None
+        self.calendars = [collections.defaultdict(list) for habitat in habitat_list]
+        self.sizes = [0] * len(habitat_list)
+        for index, habitat in enumerate(habitat_list):
+            self.schedule(index, habitat.wildlife or [])
+
+    def schedule(self, index, organisms):
+        """
+        Files organisms in a habitat's calendar by their life_span.  One that has none left
+        dies at the next tick, as the object engine would remove it at the next age_all.
+        :param index: int, the habitat
+        :param organisms: iterable of Organism objects
+        :return: no return value
+        """
+        calendar = self.calendars[index]
+        clock = self.clock
+        count = 0
+        for organism in organisms:
+            calendar[clock + max(organism.life_span, 1)].append(organism)
+            count += 1
+        self.sizes[index] += count
+
+    def living(self, index):
+        """
+        :param index: int, the habitat
+        :return: list of the habitat's Organisms, soonest to die first, their life_span not
+                 brought up to date
+        """
+        calendar = self.calendars[index]
+        return list(itertools.chain.from_iterable([calendar[tick] for tick in sorted(calendar)]))
+
+    @property
+    def populations(self):
+        return [ArrayPopulation.from_organisms(self.to_organisms(index)) for index in range(len(self.habitats))]
+
+    @populations.setter
+    def populations(self, populations):
+        self.calendars = [collections.defaultdict(list) for habitat in self.habitats]
+        self.sizes = [0] * len(self.habitats)
+        for index, population in enumerate(populations):
+            self.schedule(index, population.to_organisms())
+
+    def breed_all(self):
+        for index, habitat in enumerate(self.habitats):
+            habitat.wildlife = self.living(index)
+            parents = [] if self.pedigree is not None else None
+            habitat.breed_wildlife(self.gene_expression, self.rng, self.pairing, parents)
+            if parents is not None:
+                self.pedigree.record(habitat.new_gen, parents, index)
+            habitat.wildlife = []
+
+    def migrate(self, table, tallies=None):
+        """
+        Same as Ecosystem.migrate, filing the newborns in the calendars.
+        """
+        arrivals = [[] for habitat in self.habitats]
+        for index, habitat in enumerate(self.habitats):
+            stayers = []
+            moved = lost = 0
+            for organism in habitat.new_gen:
+                destination = table.destination(organism.traits, index)
+                if destination == index:
+                    stayers.append(organism)
+                elif destination >= 0:
+                    arrivals[destination].append(organism)
+                    moved += 1
+                    if tallies is not None:
+                        tallies[destination].migrants_in += 1
+                        tallies[destination].add_organisms((organism,))
+                else:
+                    lost += 1
+            if tallies is not None:
+                tally = tallies[index]
+                tally.births += len(habitat.new_gen)
+                tally.migrants_out += moved
+                tally.lost += lost
+                tally.add_organisms(stayers)
+            arrivals[index].extend(stayers)
+            habitat.new_gen = []
+        for index, organisms in enumerate(arrivals):
+            self.schedule(index, organisms)
+
+    def feed(self, stocks):
+        """
+        Same as ArrayEngine.feed.  The hungry are moved to the bucket due at the next tick.
+        """
+        rng = np.random.RandomState(random.getrandbits(32))
+        starved = []
+        for index, stock in enumerate(stocks):
+            calendar = self.calendars[index]
+            due = sorted(calendar)
+            wildlife = self.living(index)
+            needs = np.array([organism.traits.food_needed for organism in wildlife], dtype=np.int64)
+            diets = np.array([organism.traits.diet for organism in wildlife], dtype=np.uint8)
+            fed = allocate_food(needs, diets, stock, rng)
+            starved.append(int(len(wildlife) - fed.sum()))
+            if not starved[-1]:
+                continue
+            start = 0
+            hungry = []
+            for tick in due:
+                bucket = calendar[tick]
+                eaten = fed[start:start + len(bucket)].tolist()
+                start += len(bucket)
+                if tick > self.clock + 1:
+                    hungry.extend([organism for organism, ate in zip(bucket, eaten) if not ate])
+                    calendar[tick] = [organism for organism, ate in zip(bucket, eaten) if ate]
+            calendar[self.clock + 1].extend(hungry)
+        return starved
+
+    def age_all(self):
+        self.clock += 1
+
+    def remove_all_dead(self, tallies=None):
+        for index, calendar in enumerate(self.calendars):
+            for tick in [tick for tick in calendar if tick <= self.clock]:
+                dead = calendar.pop(tick)
+                self.sizes[index] -= len(dead)
+                if tallies is not None:
+                    tallies[index].deaths += len(dead)
+                    tallies[index].remove_organisms(dead)
+
+    def counts(self):
+        return list(self.sizes)
+
+    def sample(self, index, count, rand):
+        """
+        Same as ArrayEngine.sample, finding each pick by walking the buckets.
+        """
+        calendar = self.calendars[index]
+        organisms = []
+        for position in sorted(rand.sample(xrange(self.sizes[index]), min(count, self.sizes[index]))):
+            for tick in sorted(calendar):
+                bucket = calendar[tick]
+                if position < len(bucket):
+                    organism = bucket[position]
+                    organism.life_span = tick - self.clock
+                    organisms.append(organism)
+                    break
+                position -= len(bucket)
+        return organisms
+
+    def to_organisms(self, index):
+        """
+        :param index: int, the habitat
+        :return: list of the habitat's Organisms with their life_span brought up to date
+        """
+        organisms = []
+        calendar = self.calendars[index]
+        for tick in sorted(calendar):
+            bucket = calendar[tick]
+            for organism in bucket:
+                organism.life_span = tick - self.clock
+            organisms.extend(bucket)
+        return organisms
+
+
+def _habitat_worker(connection, seed, rule_names, config, counter_random):
+    """
+    The loop run by each ParallelEngine worker process.  The worker owns the populations of
+    some of the habitats and answers (command, argument) messages on its end of a Pipe with
+    ('ok', reply) or ('error', traceback text).
+    :param connection: multiprocessing Connection
+    :param seed: seed for the worker's numpy RandomState, can be None
+    :param rule_names: list of (digram, Traits method name) pairs, the gene expression table
+    :param config: Config of the gene expression table
+    :param counter_random: CounterRandom to breed and feed with, None for the RandomState
+    :return: no return value
+    """
+    rng = np.random.RandomState(seed)
+
+    def stream(generation, index, pair):
+        if counter_random is None:
+            return rng
+        return counter_random.stream(generation, index, pair)
+
+    sampler = random.Random()
+    gene_expression = GeneExpressionTable(collections.OrderedDict([(key, getattr(Traits, name))
+                                                                   for key, name in rule_names]), config)
+    populations = {}
+    new_gen = {}
+    staying = {}
+    table = None
+    while True:
+        command, argument = connection.recv()
+        try:
+            reply = None
+            if command == 'stop':
+                connection.send(('ok', None))
+                return
+            elif command == 'set':
+                populations = argument
+                new_gen = {}
+            elif command == 'get':
+                reply = populations
+            elif command == 'counts':
+                reply = dict([(index, len(population)) for index, population in populations.items()])
+            elif command == 'sample':
+                reply = {}
+                for index, population in populations.items():
+                    rows = sampler.sample(xrange(len(population)), min(argument, len(population)))
+                    reply[index] = population.take(np.array(rows, dtype=np.int64))
+            elif command == 'breed':
+                new_gen = dict([(index, population.breed(stream(argument, index, CounterRandom.PAIRING),
+                                                         gene_expression))
+                                for index, population in populations.items()])
+            elif command == 'route':
+                # Newborns that can stay are kept here until 'arrive'; the rest are sent
+                # back to the parent as (birthplace, newborns) batches by destination habitat.
+                if argument is not None:
+                    table = argument
+                emigrants = collections.defaultdict(list)
+                for index, newborns in new_gen.items():
+                    destination = table.destinations(newborns, np.full(len(newborns), index, dtype=np.int64))
+                    staying[index] = newborns.take(np.flatnonzero(destination == index))
+                    leaving = np.flatnonzero((destination != index) & (destination >= 0))
+                    for target in np.unique(destination[leaving]).tolist():
+                        emigrants[target].append((index, newborns.take(leaving[destination[leaving] == target])))
+                new_gen = {}
+                reply = dict(emigrants)
+            elif command == 'arrive':
+                # Newcomers join in birthplace order, as in ArrayEngine.migrate, whatever
+                # the number of workers.
+                for index in populations:
+                    batches = sorted(argument.get(index, []) + [(index, staying.pop(index, ArrayPopulation.empty()))],
+                                     key=lambda batch: batch[0])
+                    populations[index] = ArrayPopulation.concat([populations[index]]
+                                                                + [batch for birthplace, batch in batches])
+            elif command == 'feed':
+                generation, stocks = argument
+                reply = {}
+                for index, stock in stocks.items():
+                    starved = populations[index].feed(stock, stream(generation, index, CounterRandom.FEEDING))
+                    reply[index] = stock, starved
+            elif command == 'age':
+                for population in populations.values():
+                    population.life_span -= 1
+            elif command == 'remove':
+                populations = dict([(index, population.take(np.flatnonzero(population.life_span > 0)))
+                                    for index, population in populations.items()])
+            else:
+                raise ValueError("unknown worker command: {}".format(command))
+            connection.send(('ok', reply))
+        except Exception:
+            connection.send(('error', traceback.format_exc()))
+
+
+class ParallelEngine(object):
+
+    def __init__(self, habitat_list, seed=None, gene_expression=None, workers=None, counter_random=None):
+        """
+        Runs the numpy engine with the habitats split across worker processes.  Each worker
+        keeps its habitats' ArrayPopulations for the whole run and breeds, ages and removes
+        the dead on its own.  Migration is the only step that moves organisms between
+        processes: at the generation barrier each worker sends back its emigrants as compact
+        arrays grouped by destination, and the parent forwards each group to its owner.
+        Habitat i belongs to worker i % workers, so any number of habitats can be spread
+        over the workers.  Worker w is seeded with (seed, w), so results depend on the
+        number of workers, unless counter_random is given: then every habitat draws from
+        its own CounterRandom streams and the results are those of the ArrayEngine for
+        any number of workers.
+        :param habitat_list: a list of Habitat objects, their wildlife lists are the seed population
+        :param seed: int, seeds the workers' numpy RandomStates, can be None
+        :param gene_expression: GeneExpressionTable, None for GENE_EXPRESSION_TABLE.  Every rule
+                                must be a Traits method that ArrayPopulation has a batched version of.
+        :param workers: int, the number of worker processes, None for one per CPU.  Never
+                        more than the number of habitats.
+        :param counter_random: CounterRandom, None for the workers' RandomStates
+        :return: ParallelEngine object
+        """
+        if np is None:
+            raise ImportError("the parallel engine requires numpy")
+        if gene_expression is None:
+            gene_expression = GENE_EXPRESSION_TABLE
+        ArrayEngine.check_rules(gene_expression)
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        workers = max(1, min(workers, len(habitat_list)))
+        self.habitats = habitat_list
+        self.owner = [index % workers for index in range(len(habitat_list))]
+        self.connections = []
+        self.processes = []
+        rule_names = [(key, rule.__name__) for key, rule in gene_expression.items()]
+        for worker in range(workers):
+            connection, worker_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_habitat_worker,
+                                              args=(worker_connection, None if seed is None else [seed, worker],
+                                                    rule_names, gene_expression.config, counter_random))
+            process.daemon = True
+            process.start()
+            worker_connection.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+        self._table = None
+        self.counter_random = counter_random
+        self.generation = 0
+        self.populations = [ArrayPopulation.from_organisms(habitat.wildlife or []) for habitat in habitat_list]
+
+    def _broadcast(self, command, arguments=None):
+        """
+        Sends a command to every worker, then waits for all of them, so the workers run it
+        in parallel.
+        :param command: string
+        :param arguments: list with one argument per worker, None to send None to all
+        :return: list of the workers' replies
+        """
+        if arguments is None:
+            arguments = [None] * len(self.connections)
+        for connection, argument in zip(self.connections, arguments):
+            connection.send((command, argument))
+        replies = []
+        for worker, connection in enumerate(self.connections):
+            status, reply = connection.recv()
+            if status != 'ok':
+                raise RuntimeError("parallel engine worker {} failed:\n{}".format(worker, reply))
+            replies.append(reply)
+        return replies
+
+    def _by_worker(self, per_habitat):
+        """
+        :param per_habitat: dict mapping habitat indexes to values
+        :return: list with one dict per worker holding the entries for its habitats
+        """
+        grouped = [{} for connection in self.connections]
+        for index, value in per_habitat.items():
+            grouped[self.owner[index]][index] = value
+        return grouped
+
+    @property
+    def populations(self):
+        """
+        The ArrayPopulation of every habitat, fetched from the workers.
+        """
+        populations = {}
+        for reply in self._broadcast('get'):
+            populations.update(reply)
+        return [populations[index] for index in range(len(self.habitats))]
+
+    @populations.setter
+    def populations(self, populations):
+        self._broadcast('set', self._by_worker(dict(enumerate(populations))))
+
+    def breed_all(self):
+        self._broadcast('breed', [self.generation] * len(self.connections))
+
+    def migrate(self, table, tallies=None):
+        """
+        The generation barrier: routes every worker's newborns and delivers the emigrants.
+        :param table: SurvivalTable for self.habitats, sent to the workers only when it changes
+        :param tallies: must be None, the parallel engine does not keep HabitatTally objects
+        :return: no return value
+        """
+        if tallies is not None:
+            raise ValueError("the parallel engine does not support statistics tracking")
+        send_table = None
+        if table is not self._table:
+            send_table = table
+            self._table = table
+        arrivals = collections.defaultdict(list)
+        for emigrants in self._broadcast('route', [send_table] * len(self.connections)):
+            for index, batches in emigrants.items():
+                arrivals[index].extend(batches)
+        self._broadcast('arrive', self._by_worker(arrivals))
+
+    def feed(self, stocks):
+        """
+        Same as ArrayEngine.feed, with each worker feeding its own habitats.
+        """
+        starved = [0] * len(self.habitats)
+        for reply in self._broadcast('feed', [(self.generation, grouped)
+                                              for grouped in self._by_worker(dict(enumerate(stocks)))]):
+            for index, (stock, count) in reply.items():
+                stocks[index][:] = stock
+                starved[index] = count
+        return starved
+
+    def age_all(self):
+        self._broadcast('age')
+        self.generation += 1
+
+    def remove_all_dead(self, tallies=None):
+        self._broadcast('remove')
+
+    def counts(self):
+        counts = {}
+        for reply in self._broadcast('counts'):
+            counts.update(reply)
+        return [counts[index] for index in range(len(self.habitats))]
+
+    def sample(self, index, count, rand):
+        """
+        Same as ArrayEngine.sample; each worker picks from its own habitats with its own
+        random.Random, so rand is not used.
+        """
+        return self.samples(count)[index]
+
+    def samples(self, count):
+        """
+        :param count: int, the most organisms wanted from each habitat
+        :return: list with a list of Organisms per habitat, from one round trip to the workers
+        """
+        samples = {}
+        for reply in self._broadcast('sample', [count] * len(self.connections)):
+            samples.update(reply)
+        return [samples[index].to_organisms() for index in range(len(self.habitats))]
+
+    def to_organisms(self, index):
+        return self.populations[index].to_organisms()
+
+    def close(self):
+        if not self.processes:
+            return
+        self._broadcast('stop')
+        for process in self.processes:
+            process.join()
+        self.connections = []
+        self.processes = []
+
+
+class HabitatTally(object):
+
+    FIELDS = ('temp_tol', 'water_needed', 'birth_rate', 'diet', 'genome_len')
+
+    def __init__(self):
+        """
+        Running statistics for one habitat.  count, the histograms of each field in FIELDS,
+        the genomes' digram masks and their total count of each base describe the living
+        wildlife and are updated as organisms arrive and die.  births, starved, deaths,
+        migrants_in, migrants_out and lost count this generation's events; starved
+        organisms are also counted in deaths.
+        Traits and genomes never change after birth, so the tallies stay exact without
+        rescanning, and frequency queries cost time in the number of distinct values,
+        not in the population.
+        :return: HabitatTally object
+        """
+        self.count = 0
+        self.histograms = dict([(field, collections.Counter()) for field in self.FIELDS])
+        self.digram_masks = collections.Counter()
+        # The count of each base code c in bits BASE_COUNT_BITS * c and up, see Genome.packed_base_counts
+        self.bases = 0
+        self.start_generation()
+
+    def start_generation(self):
+        self.births = 0
+        self.starved = 0
+        self.deaths = 0
+        self.migrants_in = 0
+        self.migrants_out = 0
+        self.lost = 0
+
+    def add_organisms(self, organisms, sign=1):
+        """
+        :param organisms: iterable of Organism objects entering the habitat
+        :param sign: int, 1 to add them, -1 to take them away
+        :return: no return value
+        """
+        histograms = self.histograms
+        temp_tol, water_needed = histograms['temp_tol'], histograms['water_needed']
+        birth_rate, diet, genome_len = histograms['birth_rate'], histograms['diet'], histograms['genome_len']
+        digram_masks = self.digram_masks
+        bases = 0
+        for organism in organisms:
+            traits = organism.traits
+            genome = organism.genome
+            temp_tol[traits.temp_tol] += sign
+            water_needed[traits.water_needed] += sign
+            birth_rate[traits.birth_rate] += sign
+            diet[traits.diet] += sign
+            genome_len[genome.length] += sign
+            digram_masks[genome.digrams] += sign
+            # The padding of the last byte was counted as code 0, the low bits
+            bases += genome.packed_base_counts() - (-genome.length & 3)
+            self.count += sign
+        self.bases += sign * bases
+
+    def remove_organisms(self, organisms):
+        self.add_organisms(organisms, -1)
+
+    def add_population(self, population, sign=1):
+        """
+        Same as add_organisms for an ArrayPopulation.
+        """
+        if not len(population):
+            return
+        columns = (population.temp_tol, population.water_needed, population.birth_rate,
+                   population.diet, population.genome_len)
+        for field, column in zip(self.FIELDS, columns):
+            values, counts = np.unique(column, return_counts=True)
+            histogram = self.histograms[field]
+            for value, count in zip(values.tolist(), counts.tolist()):
+                histogram[value] += sign * count
+        values, counts = np.unique(population.digram_masks(), return_counts=True)
+        for value, count in zip(values.tolist(), counts.tolist()):
+            self.digram_masks[value] += sign * count
+        codes = population.genome_buf[_segment_positions(population.genome_start, population.genome_len)]
+        for code, count in enumerate(np.bincount(codes, minlength=len(BASES)).tolist()):
+            self.bases += sign * count << (BASE_COUNT_BITS * code)
+        self.count += sign * len(population)
+
+    def remove_population(self, population):
+        self.add_population(population, -1)
+
+    def add_cohorts(self, cohorts, sign=1):
+        """
+        Same as add_organisms for (CohortPopulation key, count) pairs.
+        """
+        histograms = self.histograms
+        temp_tol, water_needed = histograms['temp_tol'], histograms['water_needed']
+        birth_rate, diet, genome_len = histograms['birth_rate'], histograms['diet'], histograms['genome_len']
+        for key, count in cohorts:
+            count *= sign
+            genome = key[0]
+            temp_tol[key[1]] += count
+            water_needed[key[2]] += count
+            birth_rate[key[4]] += count
+            diet[key[5]] += count
+            genome_len[genome.length] += count
+            self.digram_masks[genome.digrams] += count
+            self.bases += count * (genome.packed_base_counts() - (-genome.length & 3))
+            self.count += count
+
+    def remove_cohorts(self, cohorts):
+        self.add_cohorts(cohorts, -1)
+
+    def histogram(self, field):
+        """
+        :param field: one of FIELDS
+        :return: list of (value, count) pairs for the living wildlife, sorted by value
+        """
+        return sorted([(value, count) for value, count in self.histograms[field].items() if count])
+
+    def mean(self, field):
+        if not self.count:
+            return None
+        return float(sum([value * count for value, count in self.histogram(field)])) / self.count
+
+    def frequencies(self, field):
+        """
+        :param field: one of FIELDS
+        :return: list of (value, fraction of the living wildlife) pairs, sorted by value
+        """
+        return [(value, float(count) / self.count) for value, count in self.histogram(field)]
+
+    def base_counts(self):
+        """
+        :return: OrderedDict of each base in BASES to its number in the living wildlife's genomes
+        """
+        return collections.OrderedDict(zip(BASES, unpack_base_counts(self.bases)))
+
+    def base_frequencies(self):
+        """
+        :return: OrderedDict of each base in BASES to its share of all bases, None with no bases
+        """
+        counts = self.base_counts()
+        total = sum(counts.values())
+        return collections.OrderedDict([(base, float(count) / total if total else None)
+                                        for base, count in counts.items()])
+
+    def digram_carriers(self, digrams=None):
+        """
+        :param digrams: iterable of two-base strings, None for the GENE_EXPRESSION_DICT keys
+        :return: OrderedDict of each digram, in order, to the number of living organisms
+                 whose genome contains it
+        """
+        if digrams is None:
+            digrams = sorted(GENE_EXPRESSION_DICT)
+        masks = [(mask, count) for mask, count in self.digram_masks.items() if count]
+        carriers = collections.OrderedDict()
+        for digram in digrams:
+            bit = digram_bit(digram)
+            carriers[digram] = sum([count for mask, count in masks if mask & bit])
+        return carriers
+
+    def digram_frequency(self, digram):
+        """
+        :param digram: two-base string such as 'cc'
+        :return: float, the fraction of the living wildlife carrying the digram, None if there is none
+        """
+        if not self.count:
+            return None
+        return float(self.digram_carriers((digram,))[digram]) / self.count
+
+
+class Pedigree(object):
+
+    NONE = 0xffffffff
+    RECORD = [('mom', '<u4'), ('dad', '<u4'), ('digrams', '<u2')]
+
+    def __init__(self, path=None, memory_records=1 << 20):
+        """
+        An append-only record of every organism born while lineage is tracked.  Each
+        Organism's ident is the position of its record, which holds the idents of its mom
+        and dad (NONE for founders) and its Genome.digrams mask, 10 bytes a birth.  Births
+        are added a habitat and a generation at a time, so their birth generation and
+        habitat are kept once per block of records.  Parents are always recorded before
+        their children, so idents grow down every line of descent.  Dead ancestors are only
+        records, never Organisms kept alive.
+        :param path: string, file to spill records to once more than memory_records are held,
+                     read back through np.memmap.  None to keep everything in memory.
+        :param memory_records: int, records held in memory before spilling
+        :return: Pedigree object
+        """
+        if np is None:
+            raise ImportError("lineage tracking requires numpy")
+        self.path = path
+        self.memory_records = memory_records
+        self.generation = 0
+        self.block_starts = []
+        self.block_generations = []
+        self.block_habitats = []
+        self._dtype = np.dtype(self.RECORD)
+        self._reset()
+
+    def _reset(self):
+        self._buffer = np.zeros(max(min(self.memory_records, 1024), 1), dtype=self._dtype)
+        self._buffered = 0
+        self._spilled = 0
+        self._mapped = None
+        if self.path is not None:
+            open(self.path, 'wb').close()
+
+    def __len__(self):
+        return self._spilled + self._buffered
+
+    def nbytes(self):
+        """
+        :return: int, bytes of records in memory and on disk plus the block index
+        """
+        return (self._buffer.nbytes + self._spilled * self._dtype.itemsize
+                + 3 * 8 * len(self.block_starts))
+
+    def record(self, children, parents, habitat):
+        """
+        Gives organisms the next idents and records them as born this generation.
+        :param children: list of Organism objects
+        :param parents: list of (mom, dad) Organism pairs, one per child, None for founders
+        :param habitat: int, the habitat they were born in
+        :return: no return value
+        """
+        if not children:
+            return
+        first = len(self)
+        if first + len(children) >= self.NONE:
+            raise OverflowError("a pedigree holds at most {} organisms; prune it".format(self.NONE - 1))
+        if not (self.block_starts and self.block_generations[-1] == self.generation
+                and self.block_habitats[-1] == habitat):
+            self.block_starts.append(first)
+            self.block_generations.append(self.generation)
+            self.block_habitats.append(habitat)
+        rows = np.zeros(len(children), dtype=self._dtype)
+        rows['digrams'] = [child.genome.digrams for child in children]
+        if parents is None:
+            rows['mom'] = self.NONE
+            rows['dad'] = self.NONE
+        else:
+            none = self.NONE
+            rows['mom'] = [none if mom.ident is None else mom.ident for mom, dad in parents]
+            rows['dad'] = [none if dad.ident is None else dad.ident for mom, dad in parents]
+        self._append(rows)
+        for ident, child in enumerate(children, first):
+            child.ident = ident
+
+    def _append(self, rows):
+        while len(rows):
+            if self._buffered == len(self._buffer):
+                if self.path is not None and self._buffered >= self.memory_records:
+                    self._spill()
+                else:
+                    size = 2 * len(self._buffer)
+                    if self.path is not None:
+                        size = min(size, self.memory_records)
+                    grown = np.zeros(size, dtype=self._dtype)
+                    grown[:self._buffered] = self._buffer[:self._buffered]
+                    self._buffer = grown
+            count = min(len(rows), len(self._buffer) - self._buffered)
+            self._buffer[self._buffered:self._buffered + count] = rows[:count]
+            self._buffered += count
+            rows = rows[count:]
+
+    def _spill(self):
+        with open(self.path, 'ab') as spilled:
+            spilled.write(self._buffer[:self._buffered].tostring())
+        self._spilled += self._buffered
+        self._buffered = 0
+        self._mapped = None
+
+    def records(self, idents):
+        """
+        :param idents: int array
+        :return: record array with the mom, dad and digrams of each ident
+        """
+        idents = np.asarray(idents, dtype=np.int64)
+        on_disk = idents < self._spilled
+        if not on_disk.any():
+            return self._buffer[idents - self._spilled]
+        if self._mapped is None:
+            self._mapped = np.memmap(self.path, dtype=self._dtype, mode='r', shape=(self._spilled,))
+        records = np.zeros(len(idents), dtype=self._dtype)
+        records[on_disk] = self._mapped[idents[on_disk]]
+        records[~on_disk] = self._buffer[idents[~on_disk] - self._spilled]
+        return records
+
+    def born(self, idents):
+        """
+        :param idents: int array
+        :return: tuple of int arrays, the birth generation and birth habitat of each ident.
+                 Founders were "born" in the generation lineage tracking started.
+        """
+        block = np.searchsorted(self.block_starts, idents, side='right') - 1
+        return np.array(self.block_generations)[block], np.array(self.block_habitats)[block]
+
+    def ancestors(self, idents, generations=None):
+        """
+        :param idents: int array
+        :param generations: int, how many generations of parents to go back, None for all
+        :return: sorted int64 array of the idents of every ancestor of the given organisms
+        """
+        seen = np.zeros(0, dtype=np.int64)
+        frontier = np.unique(np.asarray(idents, dtype=np.int64))
+        depth = 0
+        while len(frontier) and (generations is None or depth < generations):
+            records = self.records(frontier)
+            parents = np.concatenate([records['mom'], records['dad']])
+            frontier = np.setdiff1d(parents[parents != self.NONE].astype(np.int64), seen)
+            seen = np.union1d(seen, frontier)
+            depth += 1
+        return seen
+
+    def descendants(self, idents):
+        """
+        Scans forward from the first of idents a generation of records at a time, since a
+        child's parents are always recorded in an earlier generation.
+        :param idents: int array
+        :return: sorted int64 array of the idents of every descendant of the given organisms
+        """
+        marked = np.unique(np.asarray(idents, dtype=np.int64))
+        if not len(marked):
+            return marked
+        starts = np.array(self.block_starts + [len(self)], dtype=np.int64)
+        generations = np.array(self.block_generations)
+        # The first record of each generation's run of blocks
+        bounds = starts[np.concatenate([[0], np.flatnonzero(np.diff(generations)) + 1, [len(generations)]])]
+        found = []
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            if stop <= marked[0]:
+                continue
+            records = self.records(np.arange(max(start, marked[0] + 1), stop))
+            hit = _members(records['mom'], marked) | _members(records['dad'], marked)
+            children = np.flatnonzero(hit) + max(start, marked[0] + 1)
+            if len(children):
+                found.append(children)
+                marked = np.union1d(marked, children)
+        return np.concatenate(found) if found else np.zeros(0, dtype=np.int64)
+
+    def origins(self, idents, digram):
+        """
+        Where a gene came from: the organisms among the given ones and their ancestors
+        whose genome has a digram although neither parent's does, or who are founders.
+        :param idents: int array
+        :param digram: string, two bases such as 'cc'
+        :return: sorted int64 array of idents
+        """
+        bit = digram_bit(digram)
+        lineage = np.union1d(self.ancestors(idents), np.asarray(idents, dtype=np.int64))
+        carriers = lineage[self.records(lineage)['digrams'] & bit != 0]
+        records = self.records(carriers)
+        inherited = np.zeros(len(carriers), dtype=bool)
+        for side in ('mom', 'dad'):
+            known = records[side] != self.NONE
+            inherited[known] |= self.records(records[side][known])['digrams'] & bit != 0
+        return carriers[~inherited]
+
+    def prune(self, living):
+        """
+        Drops the lines that have died out: every record that is neither a living organism
+        nor an ancestor of one.  Idents stay record positions, so they are renumbered and
+        the caller must relabel the living; Ecosystem.prune_lineage does.
+        :param living: int array, the idents of the living organisms
+        :return: sorted int64 array of the old idents kept; the new ident of a kept organism
+                 is the position of its old ident in it
+        """
+        living = np.asarray(living, dtype=np.int64)
+        kept = np.union1d(self.ancestors(living), living)
+        records = self.records(kept)
+        for side in ('mom', 'dad'):
+            known = records[side] != self.NONE
+            records[side][known] = np.searchsorted(kept, records[side][known])
+        starts = np.searchsorted(kept, self.block_starts)
+        keep = np.concatenate([starts[:-1] < starts[1:], [starts[-1] < len(kept)]]) if len(starts) else starts
+        self.block_starts = starts[keep].tolist()
+        self.block_generations = np.array(self.block_generations)[keep].tolist()
+        self.block_habitats = np.array(self.block_habitats)[keep].tolist()
+        self._reset()
+        self._append(records)
+        return kept
+
+
+def _members(values, sorted_array):
+    """
+    :return: bool array, True where values are in sorted_array
+    """
+    positions = np.minimum(np.searchsorted(sorted_array, values), len(sorted_array) - 1)
+    return sorted_array[positions] == values
+
+
+class Instrumentation(object):
+
+    PHASES = ('breed_all', 'migrate', 'feed_all', 'age_all', 'remove_all_dead')
+    COUNTERS = ('births', 'migrants_in', 'migrants_out', 'lost', 'starved', 'deaths')
+
+    def __init__(self, history=1000):
+        """
+        Per-generation phase timings and per-habitat counters, kept in a ring buffer and
+        passed to observers as each generation ends.  Made by Ecosystem.instrument; an
+        Ecosystem without one only pays for a single attribute check per generation.
+        Each record is a dict of generation, the wall seconds of each phase in PHASES,
+        and for each habitat its count and this generation's COUNTERS (lost being the
+        newborns that fit no habitat).
+        :param history: int, the number of most recent records kept
+        :return: Instrumentation object
+        """
+        self.records = collections.deque(maxlen=history)
+        self.observers = []
+
+    def add_observer(self, observer):
+        """
+        :param observer: function called with each new record
+        :return: no return value
+        """
+        self.observers.append(observer)
+
+    def record(self, world, seconds):
+        """
+        :param world: Ecosystem object that has just finished a generation
+        :param seconds: OrderedDict of wall seconds per phase
+        :return: dict, the new record
+        """
+        habitats = collections.OrderedDict()
+        if world.tallies is not None:
+            for habitat, tally in zip(world.habitats, world.tallies):
+                counters = collections.OrderedDict([('count', tally.count)])
+                for counter in self.COUNTERS:
+                    counters[counter] = getattr(tally, counter)
+                habitats[habitat.name] = counters
+        else:
+            for habitat, count in zip(world.habitats, world.wildlife_counts()):
+                habitats[habitat.name] = collections.OrderedDict([('count', count)])
+        record = collections.OrderedDict([('generation', world.generation), ('seconds', seconds),
+                                          ('habitats', habitats)])
+        self.records.append(record)
+        for observer in self.observers:
+            observer(record)
+        return record
+
+    def latest(self):
+        """
+        :return: the most recent record, None before the first generation
+        """
+        return self.records[-1] if self.records else None
+
+    def phase_totals(self):
+        """
+        :return: OrderedDict of the wall seconds spent in each phase over the buffered records
+        """
+        totals = collections.OrderedDict([(phase, 0.0) for phase in self.PHASES])
+        for record in self.records:
+            for phase, seconds in record['seconds'].items():
+                totals[phase] += seconds
+        return totals
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+
+class StatsWriter(object):
+
+    FORMATS = ('csv', 'jsonl')
+    COMPRESSIONS = ('gzip', 'lzma')
+    COLUMNS = ('generation', 'habitat', 'count', 'births', 'starved', 'deaths', 'migrants_in', 'migrants_out', 'lost',
+               'mean_temp_tol', 'mean_water_needed', 'mean_birth_rate', 'mean_diet_size',
+               'mean_genome_len', 'min_genome_len', 'max_genome_len',
+               'temp_tol_hist', 'water_needed_hist', 'birth_rate_hist', 'diet_hist', 'genome_len_hist',
+               'base_counts', 'digram_carriers')
+
+    def __init__(self, path, format=None, compression=None, buffer_size=1 << 20):
+        """
+        Streams one row per habitat per generation to a CSV or JSON Lines file, built from
+        the HabitatTally objects kept by Ecosystem.track_stats.  In CSV the histograms are
+        written as value:count pairs joined by spaces; diets are written as food names.
+        digram_carriers counts the organisms whose genome holds each GENE_EXPRESSION_DICT digram.
+        :param path: string, the output file
+        :param format: 'csv' or 'jsonl', None to pick from the file extension
+        :param compression: 'gzip', 'lzma' or None, None to pick from a .gz or .xz extension
+        :param buffer_size: int, bytes buffered before each write to disk
+        :return: StatsWriter object
+        """
+        name = path
+        if compression is None:
+            if name.endswith('.gz'):
+                compression = 'gzip'
+            elif name.endswith('.xz'):
+                compression = 'lzma'
+        if name.endswith('.gz') or name.endswith('.xz'):
+            name = name[:-3]
+        if format is None:
+            format = 'csv' if name.endswith('.csv') else 'jsonl'
+        if format not in self.FORMATS:
+            raise ValueError("unknown stats format: {}".format(format))
+        if compression is not None and compression not in self.COMPRESSIONS:
+            raise ValueError("unknown stats compression: {}".format(compression))
+        if compression == 'lzma' and lzma is None:
+            raise ImportError("lzma compression requires the lzma module (backports.lzma on Python 2)")
+
+        self.format = format
+        self._raw = open(path, 'wb', buffer_size)
+        if compression == 'gzip':
+            self._file = gzip.GzipFile(fileobj=self._raw, mode='wb')
+        elif compression == 'lzma':
+            self._file = lzma.LZMAFile(self._raw, mode='wb')
+        else:
+            self._file = self._raw
+        self._csv = None
+        if format == 'csv':
+            self._csv = csv.writer(self._file)
+            self._csv.writerow(self.COLUMNS)
+
+    def write_generation(self, world):
+        """
+        Writes a row for each habitat of an Ecosystem whose stats are being tracked.
+        :param world: Ecosystem object
+        :return: no return value
+        """
+        for habitat, tally in zip(world.habitats, world.track_stats()):
+            genome_lengths = [value for value, count in tally.histogram('genome_len')]
+            diet_sizes = [(len(DIET_FOODS[diet]), count) for diet, count in tally.histogram('diet')]
+            row = collections.OrderedDict([
+                ('generation', world.generation),
+                ('habitat', habitat.name),
+                ('count', tally.count),
+                ('births', tally.births),
+                ('starved', tally.starved),
+                ('deaths', tally.deaths),
+                ('migrants_in', tally.migrants_in),
+                ('migrants_out', tally.migrants_out),
+                ('lost', tally.lost),
+                ('mean_temp_tol', tally.mean('temp_tol')),
+                ('mean_water_needed', tally.mean('water_needed')),
+                ('mean_birth_rate', tally.mean('birth_rate')),
+                ('mean_diet_size', float(sum([size * count for size, count in diet_sizes])) / tally.count
+                    if tally.count else None),
+                ('mean_genome_len', tally.mean('genome_len')),
+                ('min_genome_len', min(genome_lengths) if genome_lengths else None),
+                ('max_genome_len', max(genome_lengths) if genome_lengths else None),
+                ('temp_tol_hist', tally.histogram('temp_tol')),
+                ('water_needed_hist', tally.histogram('water_needed')),
+                ('birth_rate_hist', tally.histogram('birth_rate')),
+                ('diet_hist', [('+'.join(mask_to_diet(diet)) or 'none', count)
+                               for diet, count in tally.histogram('diet')]),
+                ('genome_len_hist', tally.histogram('genome_len')),
+                ('base_counts', tally.base_counts().items()),
+                ('digram_carriers', tally.digram_carriers().items())])
+            if self._csv is not None:
+                self._csv.writerow([' '.join(['{}:{}'.format(*pair) for pair in value])
+                                    if isinstance(value, list) else ('' if value is None else value)
+                                    for value in row.values()])
+            else:
+                for key, value in row.items():
+                    if isinstance(value, list):
+                        row[key] = collections.OrderedDict(value)
+                self._file.write(json.dumps(row) + "\n")
+
+    def close(self):
+        if self._file is not self._raw:
+            self._file.close()
+        self._raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _SnapshotHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        published = self.server.published
+        path = self.path.split('?')[0].rstrip('/')
+        if path in ('', '/snapshot'):
+            body = published[1]
+        elif path == '/health':
+            body = json.dumps({'ok': True, 'generation': published[0], 'published': published[2]})
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SnapshotServer(object):
+
+    def __init__(self, host='127.0.0.1', port=8000, samples=5):
+        """
+        A read-only HTTP endpoint for watching a run.  GET / (or /snapshot) returns the latest
+        Ecosystem.snapshot as JSON and /health its generation.  The simulation publishes at
+        each generation boundary; a publish serializes the new snapshot and then swaps one
+        reference to an immutable (generation, JSON, time) tuple, so the request threads
+        never take a lock or touch the world and a reader always gets a whole snapshot.
+        :param host: string, the address to listen on, 127.0.0.1 for this machine only
+        :param port: int, the port to listen on, 0 for any free port
+        :param samples: int, organisms sampled from each habitat per snapshot
+        :return: SnapshotServer object
+        """
+        self.samples = samples
+        self.rand = random.Random()
+        self.httpd = _ThreadingHTTPServer((host, port), _SnapshotHandler)
+        self.httpd.published = (None, json.dumps(None), None)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='SnapshotServer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def address(self):
+        """
+        (host, port) the server is listening on.
+        """
+        return self.httpd.server_address
+
+    def publish(self, world):
+        """
+        :param world: Ecosystem object, between generations
+        :return: no return value
+        """
+        body = json.dumps(world.snapshot(self.samples, self.rand), indent=2)
+        self.httpd.published = (world.generation, body, time.time())
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+
+class CurveStats(object):
+
+    def __init__(self, habitat_names):
+        """
+        Merges population curves from independent replicates into a per-generation mean and
+        variance for each habitat and for the total, one replicate at a time (Welford's
+        method), so curves never have to be held together in memory.
+        :param habitat_names: list of strings, the habitats in curve order
+        :return: CurveStats object
+        """
+        self.names = list(habitat_names) + ['total']
+        self.replicates = []
+        self.means = []
+        self.sums_sq = []
+
+    def add(self, curve):
+        """
+        :param curve: list of per-generation lists of habitat counts, as run_replicate returns
+        :return: no return value
+        """
+        for generation, counts in enumerate(curve):
+            counts = list(counts) + [sum(counts)]
+            if generation == len(self.means):
+                self.replicates.append(0)
+                self.means.append([0.0] * len(counts))
+                self.sums_sq.append([0.0] * len(counts))
+            self.replicates[generation] += 1
+            n = self.replicates[generation]
+            means, sums_sq = self.means[generation], self.sums_sq[generation]
+            for i, count in enumerate(counts):
+                delta = count - means[i]
+                means[i] += delta / n
+                sums_sq[i] += delta * (count - means[i])
+
+    def curves(self):
+        """
+        :return: list with one OrderedDict per generation giving the number of replicates and,
+                 for each habitat and the total, the mean and sample variance of its count
+        """
+        rows = []
+        for generation, n in enumerate(self.replicates):
+            row = collections.OrderedDict([('generation', generation + 1), ('replicates', n)])
+            for i, name in enumerate(self.names):
+                row[name] = collections.OrderedDict([
+                    ('mean', self.means[generation][i]),
+                    ('variance', self.sums_sq[generation][i] / (n - 1) if n > 1 else 0.0)])
+            rows.append(row)
+        return rows
+
+
+def copy_habitats(habitat_list):
+    """
+    Fresh copies of a list of habitats and their wildlife, so one world definition such as
+    HABITATS can seed any number of independent Ecosystems.  Genomes and Traits are never
+    changed once an organism holds them, so the copies share them.
+    :param habitat_list: a list of Habitat objects
+    :return: a list of new Habitat objects
+    """
+    return [Habitat(habitat.name, habitat.temp, habitat.water_avail, list(habitat.food_avail),
+                    [Organism(organism.genome, organism.traits, organism.life_span)
+                     for organism in habitat.wildlife or []], [])
+            for habitat in habitat_list]
+
+
+def run_replicate(task):
+    """
+    Runs one replicate in an ensemble.  Module level so multiprocessing can hand it to a
+    worker; only the seed and the population counts cross the process boundary.
+    :param task: tuple of (habitat_list, engine, seed, generations, Config or None, HabitatGraph or None,
+                 food_supply, pairing, random_block_size, counter_random)
+    :return: tuple of (seed, list of per-generation lists of habitat counts)
+    """
+    (habitat_list, engine, seed, generations, config, graph, food_supply, pairing, random_block_size,
+     counter_random) = task
+    world = Ecosystem(copy_habitats(habitat_list), engine=engine, seed=seed, config=config, graph=graph,
+                      food_supply=food_supply, pairing=pairing, random_block_size=random_block_size,
+                      counter_random=counter_random)
+    try:
+        curve = []
+        for generation in xrange(generations):
+            world.next_generation()
+            curve.append(world.wildlife_counts())
+    finally:
+        world.close()
+    return seed, curve
+
+
+def run_ensemble(replicates, generations, engine='object', seed=0, processes=None, habitat_list=None,
+                 callback=None, config=None, graph=None, food_supply=None, pairing='uniform',
+                 random_block_size=None, counter_random=False):
+    """
+    Runs independent replicates of the same world across a pool of worker processes and
+    merges their population curves.  Replicate i is seeded with seed + i and the curves are
+    merged in seed order, so an ensemble is reproducible whatever the number of processes.
+    :param replicates: int, number of replicates
+    :param generations: int, generations per replicate
+    :param engine: string, one of ENGINES
+    :param seed: int, seed of the first replicate
+    :param processes: int, worker processes, None for one per CPU.  The parallel engine
+                      starts its own workers, which a pool's daemonic processes cannot,
+                      so its replicates always run one at a time in this process.
+    :param habitat_list: a list of Habitat objects defining the world, None for HABITATS
+    :param callback: function called with (seed, curve) for each replicate in seed order, can be None
+    :param config: Config, the model parameters, None for DEFAULT_CONFIG
+    :param graph: HabitatGraph of habitat_list, None to let migrants move to any habitat
+    :param food_supply: number, as Ecosystem's food_supply, None for unlimited food
+    :param pairing: string, a key of PAIRINGS
+    :param random_block_size: int, as Ecosystem's random_block_size, None for the random module
+    :param counter_random: bool, as Ecosystem's counter_random
+    :return: CurveStats object
+    """
+    if habitat_list is None:
+        habitat_list = HABITATS
+    stats = CurveStats([habitat.name for habitat in habitat_list])
+    tasks = [(habitat_list, engine, seed + i, generations, config, graph, food_supply, pairing, random_block_size,
+              counter_random) for i in range(replicates)]
+    if processes == 1 or engine == 'parallel':
+        results = (run_replicate(task) for task in tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes)
+        # In order, since the running mean and variance depend on the order of the curves.
+        results = pool.imap(run_replicate, tasks)
+    try:
+        for replicate_seed, curve in results:
+            stats.add(curve)
+            if callback is not None:
+                callback(replicate_seed, curve)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return stats
+
+
+def expand_grid(grid, base=None):
+    """
+    Every combination of the values in a parameter grid.
+    :param grid: dict mapping Config FIELDS to lists of values
+    :param base: Config giving the fields the grid leaves out, None for DEFAULT_CONFIG
+    :return: list of Config objects, the fields varied in sorted order with the last fastest
+    """
+    base = base or DEFAULT_CONFIG
+    fields = sorted(grid)
+    return [base.replace(**dict(zip(fields, values))) for values in itertools.product(*[grid[field] for field in fields])]
+
+
+def run_key(habitat_list, engine, seed, generations, config, food_supply=None, pairing='uniform', graph=None,
+            random_block_size=None, counter_random=False):
+    """
+    :return: hex string, a SHA-1 of everything a run's result depends on: the Config, the
+             seed, the run settings and the starting world and its graph, with SWEEP_CACHE_VERSION
+    """
+    world = [[habitat.name, habitat.temp, habitat.water_avail, list(habitat.food_avail),
+              [[str(organism.genome), organism.traits.temp_tol, organism.traits.water_needed, organism.traits.diet,
+                organism.traits.food_needed, organism.traits.birth_rate, organism.life_span]
+               for organism in habitat.wildlife or []]]
+             for habitat in habitat_list]
+    document = [SWEEP_CACHE_VERSION, config.to_dict(), seed, engine, generations, food_supply, pairing, world]
+    # Settings added since the first sweeps are appended only when they differ from their
+    # defaults, so the keys of existing runs stay the same.
+    extras = collections.OrderedDict()
+    if graph is not None:
+        extras['graph'] = graph.to_lists()
+    if random_block_size is not None:
+        extras['random_block_size'] = random_block_size
+    if counter_random:
+        extras['counter_random'] = True
+    if extras:
+        document.append(extras)
+    return hashlib.sha1(json.dumps(document, separators=(',', ':'))).hexdigest()
+
+
+class ResultCache(object):
+
+    def __init__(self, directory):
+        """
+        Run results kept on disk as one JSON file per run_key, so a sweep computes each
+        point once however often it is repeated or extended.  A result is written under a
+        temporary name and renamed into place, so a killed sweep never leaves a partial
+        file and sweeps may share a directory.
+        :param directory: string, created if missing
+        :return: ResultCache object
+        """
+        self.directory = directory
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def get(self, key):
+        """
+        :param key: string, a run_key
+        :return: the stored result dict, None if there is none or it cannot be read
+        """
+        try:
+            with open(self.path(key)) as stored:
+                return json.load(stored, object_pairs_hook=collections.OrderedDict)
+        except (IOError, ValueError):
+            return None
+
+    def put(self, key, result):
+        path = self.path(key)
+        if not os.path.isdir(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                if not os.path.isdir(os.path.dirname(path)):
+                    raise
+        temporary = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temporary, 'w') as stored:
+            json.dump(result, stored)
+        os.rename(temporary, path)
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+
+def run_point(task):
+    """
+    Runs one point of a sweep.  Module level so multiprocessing can hand it to a worker.
+    :param task: tuple of (run_key, habitat_list, engine, seed, generations, Config, food_supply, pairing,
+                 HabitatGraph or None, random_block_size, counter_random)
+    :return: tuple of (run_key, result dict suitable for json.dumps)
+    """
+    (key, habitat_list, engine, seed, generations, config, food_supply, pairing, graph, random_block_size,
+     counter_random) = task
+    start = time.time()
+    world = Ecosystem(copy_habitats(habitat_list), engine=engine, seed=seed, food_supply=food_supply,
+                      pairing=pairing, config=config, graph=graph, random_block_size=random_block_size,
+                      counter_random=counter_random)
+    try:
+        curve = []
+        for generation in xrange(generations):
+            world.next_generation()
+            curve.append(world.wildlife_counts())
+        final = world.summary()
+    finally:
+        world.close()
+    return key, collections.OrderedDict([
+        ('key', key),
+        ('config', config.to_dict()),
+        ('seed', seed),
+        ('engine', engine),
+        ('generations', generations),
+        ('food_supply', food_supply),
+        ('pairing', pairing),
+        ('random_block_size', random_block_size),
+        ('counter_random', counter_random),
+        ('final', final['habitats']),
+        ('total', final['total']),
+        ('curve', curve),
+        ('elapsed', round(time.time() - start, 3))])
+
+
+def run_sweep(configs, seeds, generations, engine='object', processes=None, habitat_list=None, cache=None,
+              food_supply=None, pairing='uniform', callback=None, graph=None, random_block_size=None,
+              counter_random=False):
+    """
+    Runs every Config with every seed across a pool of worker processes, as run_ensemble
+    runs replicates.  Points already in the cache are read from it instead of being run,
+    and every point that is run is added, so repeating a sweep only computes what changed.
+    :param configs: list of Config objects, as expand_grid returns
+    :param seeds: list of ints, the seeds each Config is run with
+    :param generations: int, generations per run
+    :param engine: string, one of ENGINES
+    :param processes: int, worker processes, None for one per CPU.  As in run_ensemble,
+                      parallel engine points always run one at a time in this process.
+    :param habitat_list: a list of Habitat objects defining the world, None for HABITATS
+    :param cache: ResultCache object, None to run every point
+    :param food_supply: number, as Ecosystem's food_supply, None for unlimited food
+    :param pairing: string, a key of PAIRINGS
+    :param callback: function called with (result, True if it came from the cache) as each
+                     point is ready, can be None
+    :param graph: HabitatGraph of habitat_list, None to let migrants move to any habitat
+    :param random_block_size: int, as Ecosystem's random_block_size, None for the random module
+    :param counter_random: bool, as Ecosystem's counter_random
+    :return: list of result dicts, one per (config, seed) with the seeds varying fastest
+    """
+    if habitat_list is None:
+        habitat_list = HABITATS
+    keys = []
+    missing = collections.OrderedDict()
+    results = {}
+    for config in configs:
+        for seed in seeds:
+            key = run_key(habitat_list, engine, seed, generations, config, food_supply, pairing, graph,
+                          random_block_size, counter_random)
+            keys.append(key)
+            if key in results or key in missing:
+                continue
+            result = cache.get(key) if cache is not None else None
+            if result is not None:
+                results[key] = result
+                if callback is not None:
+                    callback(result, True)
+            else:
+                missing[key] = (key, habitat_list, engine, seed, generations, config, food_supply, pairing, graph,
+                                random_block_size, counter_random)
+
+    if processes == 1 or len(missing) <= 1 or engine == 'parallel':
+        computed = (run_point(task) for task in missing.values())
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes)
+        computed = pool.imap_unordered(run_point, missing.values())
+    try:
+        for key, result in computed:
+            if cache is not None:
+                cache.put(key, result)
+            results[key] = result
+            if callback is not None:
+                callback(result, False)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return [results[key] for key in keys]
+
+
+def pair_uniform(parents, rng):
+    """
+    A uniform random matching in linear time: the parents are shuffled and taken two at a
+    time, one being left out when their number is odd.  Gives the same distribution of
+    pairs as pair_legacy.
+    :param parents: list of Organism objects, shuffled in place
+    :param rng: BlockRandom or the random module
+    :return: list of (mom, dad) pairs
+    """
+    random.shuffle(parents, rng.random)
+    return zip(parents[0::2], parents[1::2])
+
+
+def pair_legacy(parents, rng):
+    """
+    The original pairing: mom and dad are each popped from a random position in the list.
+    Quadratic in the number of parents, kept so runs seeded under earlier versions can be
+    reproduced.  A generator, so the draws interleave with breeding as they always did.
+    :param parents: list of Organism objects, emptied
+    :param rng: BlockRandom or the random module
+    :return: iterator of (mom, dad) pairs
+    """
+    while len(parents) > 1:
+        mom = parents.pop(rng.randint(0, len(parents) - 1))
+        dad = parents.pop(rng.randint(0, len(parents) - 1))
+        yield mom, dad
+
+
+def pair_assortative(parents, rng):
+    """
+    Assortative mating on the linear path of pair_uniform: after the shuffle the parents
+    are sorted by genome, length first, so each is paired with a neighbour of similar
+    genome and equal genomes are paired in random order.
+    :param parents: list of Organism objects, reordered in place
+    :param rng: BlockRandom or the random module
+    :return: list of (mom, dad) pairs
+    """
+    random.shuffle(parents, rng.random)
+    parents.sort(key=lambda organism: (organism.genome.length, organism.genome.packed))
+    return zip(parents[0::2], parents[1::2])
+
+
+def allocate_food(needs, diets, stock, rng):
+    """
+    Shares a habitat's food among its organisms in bulk.  Organisms queue in a random order
+    and each food in ALL_FOODS is handed out in turn, front of the queue first, to the
+    still-hungry organisms that eat it, each taking its whole need from one food while the
+    stock lasts.
+    :param needs: int array, food_needed of each organism
+    :param diets: uint8 array, diet mask of each organism
+    :param stock: float array over ALL_FOODS, the food available, reduced in place
+    :param rng: numpy RandomState
+    :return: bool array, True for each organism that ate
+    """
+    fed = needs <= 0
+    order = rng.permutation(len(needs))
+    for food in range(len(ALL_FOODS)):
+        if stock[food] <= 0:
+            continue
+        eaters = order[~fed[order] & (diets[order] & (1 << food) != 0)]
+        eaten = np.cumsum(needs[eaters])
+        full = np.searchsorted(eaten, stock[food], side='right')
+        fed[eaters[:full]] = True
+        if full:
+            stock[food] -= eaten[full - 1]
+    return fed
+
+
+def digram_bit(digram):
+    """
+    :param digram: two-base string such as 'cc'
+    :return: int, the bit for the digram in a Genome.digrams mask
+    """
+    return 1 << ((BASES.index(digram[0]) << 2) | BASES.index(digram[1]))
+
+
+def pack_genomes(codes):
+    """
+    Packs base codes four to a byte, the inverse of unpack_genomes.
+    :param codes: uint8 array of base codes 0-3
+    :return: uint8 array a quarter as long, rounded up
+    """
+    padded = np.zeros(-(-len(codes) // 4) * 4, dtype=np.uint8)
+    padded[:len(codes)] = codes
+    padded = padded.reshape(-1, 4)
+    return padded[:, 0] | (padded[:, 1] << 2) | (padded[:, 2] << 4) | (padded[:, 3] << 6)
+
+
+def unpack_genomes(packed):
+    """
+    Unpacks Genome.packed bytes into one base code per byte.
+    :param packed: str or uint8 array of packed bytes, possibly several genomes back to back
+    :return: uint8 array four times as long as packed
+    """
+    if not isinstance(packed, np.ndarray):
+        packed = np.frombuffer(packed, dtype=np.uint8)
+    shifts = np.arange(0, 8, 2, dtype=np.uint8)
+    return ((packed[:, np.newaxis] >> shifts) & 3).astype(np.uint8).ravel()
+
+
+def unpack_base_counts(packed):
+    """
+    :param packed: int from Genome.packed_base_counts, or a sum of them
+    :return: list of ints, the count held for each base code, in BASES order
+    """
+    mask = (1 << BASE_COUNT_BITS) - 1
+    return [int((packed >> (BASE_COUNT_BITS * code)) & mask) for code in range(len(BASES))]
+
+
+def diet_to_mask(diet):
+    mask = 0
+    for food in diet:
+        mask |= 1 << ALL_FOODS.index(food)
+    return mask
+
+
+def mask_to_diet(mask):
+    return [food for i, food in enumerate(ALL_FOODS) if mask & (1 << i)]
+
+
+# CONSTANT DECLARATIONS
+MUTATION_RATE = 10
+
+FOREST_FOODS = ['leaves', 'seeds']
+PLAINS_FOODS = ['grass', 'seeds']
+JUNGLE_FOODS = ['leaves', 'seeds', 'fruit']
+DESERT_FOODS = ['grass', 'seeds']
+
+ALL_FOODS = ('grass', 'seeds', 'leaves', 'fruit')
+FULL_DIET = (1 << len(ALL_FOODS)) - 1
+# The single-food bits making up each diet mask
+DIET_FOODS = [tuple([1 << i for i in range(len(ALL_FOODS)) if mask & (1 << i)]) for mask in range(FULL_DIET + 1)]
+
+BASES = 'abcd'
+GENOME_BYTE_BASES = [''.join([BASES[(byte >> shift) & 3] for shift in (0, 2, 4, 6)]) for byte in range(256)]
+# For each packed genome byte, the count of each base code c in bits BASE_COUNT_BITS * c
+# and up, so that summing a genome's bytes counts all four bases at once
+BASE_COUNT_BITS = 40
+BYTE_BASE_COUNTS = [sum([1 << (BASE_COUNT_BITS * ((byte >> shift) & 3)) for shift in (0, 2, 4, 6)])
+                    for byte in range(256)]
+
+# Trait bounds kept by gene expression, defaults for Config
+MAX_TEMP = 5
+MIN_TEMP = 3
+MAX_WATER = 4
+MIN_WATER = 1
+MAX_BIRTH = 3
+MAX_LIFE = 8
+
+# Food replenish rates per generation, and how many generations' worth a habitat can store
+FOOD_DICT = {'grass': 12, 'seeds': 8, 'leaves': 10, 'fruit': 9}
+MAX_FOOD_STORE = 3
+
+GENE_EXPRESSION_DICT = {'aa': Traits.inc_life_span,
+                        'ad': Traits.inc_water,
+                        'bb': Traits.dec_life_span,
+                        'bd': Traits.dec_water,
+                        'ca': Traits.inc_temp,
+                        'cc': Traits.add_to_diet,
+                        'cd': Traits.dec_birth_rate,
+                        'db': Traits.dec_temp,
+                        'dc': Traits.inc_birth_rate,
+                        'dd': Traits.remove_from_diet}
+DEFAULT_CONFIG = Config()
+# Part of every ResultCache key; raise it when a change to the model changes the results
+# of a run, so cached sweep points are recomputed.
+SWEEP_CACHE_VERSION = 2
+GENE_EXPRESSION_TABLE = DEFAULT_CONFIG.gene_expression_table()
+
+# Mate pairing policies for Habitat.breed_wildlife, by name
+PAIRINGS = collections.OrderedDict([('uniform', pair_uniform),
+                                    ('legacy', pair_legacy),
+                                    ('assortative', pair_assortative)])
+
+ENGINES = ('object', 'numpy', 'parallel', 'cohort', 'calendar')
+
+CHECKPOINT_MAGIC = 'EVOCKPT1'
+CHECKPOINT_ALIGN = 64
+
+# Lookup tables for the numpy engine: base codes 0-3 -> characters, and for each diet
+# mask its number of foods and the bit of its nth food.
+if np is not None:
+    BASES_BUF = np.frombuffer(BASES, dtype=np.uint8)
+    DIET_SIZE = np.array([len(foods) for foods in DIET_FOODS])
+    DIET_NTH_FOOD = np.zeros((FULL_DIET + 1, len(ALL_FOODS)), dtype=np.uint8)
+    for _mask, _foods in enumerate(DIET_FOODS):
+        DIET_NTH_FOOD[_mask, :len(_foods)] = _foods
+    # Philox4x32 round multipliers and key increments, for CounterRandom
+    PHILOX_M0 = np.uint64(0xD2511F53)
+    PHILOX_M1 = np.uint64(0xCD9E8D57)
+    PHILOX_W0 = np.uint64(0x9E3779B9)
+    PHILOX_W1 = np.uint64(0xBB67AE85)
+
+# Seed organisms for each habitat
+FOREST_ADAM = Organism('ab', Traits(3, 3, ['leaves']))
+FOREST_EVE  = Organism('bc', Traits(3, 3, ['leaves']))
+PLAINS_ADAM = Organism('da', Traits(4, 2, ['grass']))
+PLAINS_EVE  = Organism('bc', Traits(4, 2, ['grass']))
+JUNGLE_ADAM = Organism('ab', Traits(5, 4, ['fruit']))
+JUNGLE_EVE  = Organism('cd', Traits(5, 4, ['fruit']))
+DESERT_ADAM = Organism('ba', Traits(5, 1, ['seeds']))
+DESERT_EVE  = Organism('ad', Traits(5, 1, ['seeds']))
+
+FOREST_LIFE = [FOREST_ADAM, FOREST_EVE]
+PLAINS_LIFE = [PLAINS_ADAM, PLAINS_EVE]
+JUNGLE_LIFE = [JUNGLE_ADAM, JUNGLE_EVE]
+DESERT_LIFE = [DESERT_ADAM, DESERT_EVE]
+
+FOREST = Habitat('Forest', 3, 3, FOREST_FOODS, FOREST_LIFE, [])
+PLAINS = Habitat('Plains', 4, 2, PLAINS_FOODS, [], [])
+JUNGLE = Habitat('Jungle', 5, 4, JUNGLE_FOODS, [], [])
+DESERT = Habitat('Desert', 5, 1, DESERT_FOODS, [], [])
+HABITATS = [FOREST, PLAINS, DESERT, JUNGLE]
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Evolution Simulator.  Runs interactively unless --generations is given.")
+    parser.add_argument('-g', '--generations', type=int,
+                        help="run this many generations without prompting, then exit")
+    parser.add_argument('-s', '--seed', type=int, help="random seed, for reproducible runs")
+    parser.add_argument('-e', '--engine', choices=ENGINES, default='object',
+                        help="population engine (default: %(default)s)")
+    parser.add_argument('-w', '--workers', type=int,
+                        help="worker processes for the parallel engine (default: one per CPU)")
+    parser.add_argument('-f', '--food-supply', type=float,
+                        help="finite food, regrowing this many times FOOD_DICT each generation "
+                             "(default: unlimited)")
+    parser.add_argument('--random-block', type=int, metavar='N',
+                        help="object engine: draw breeding random numbers from numpy N at a time")
+    parser.add_argument('--counter-random', action='store_true',
+                        help="numpy and parallel engines: draw from counter-based Philox streams, so "
+                             "results do not depend on the number of workers")
+    parser.add_argument('--pairing', choices=PAIRINGS.keys(), default='uniform',
+                        help="mate pairing policy of the object and calendar engines (default: %(default)s)")
+    parser.add_argument('-o', '--output', help="write the JSON summary here instead of stdout")
+    parser.add_argument('-r', '--report-every', type=int, default=0, metavar='N',
+                        help="print a JSON progress line to stderr every N generations")
+    parser.add_argument('-n', '--replicates', type=int, default=1,
+                        help="run this many replicates seeded seed, seed+1, ... and report "
+                             "per-generation mean and variance curves (default: %(default)s)")
+    parser.add_argument('-p', '--processes', type=int,
+                        help="worker processes for replicates (default: one per CPU)")
+    parser.add_argument('--timings', action='store_true',
+                        help="time each generation phase and add the totals to the summary")
+    parser.add_argument('--memory-report', action='store_true',
+                        help="print a JSON line of bytes per habitat and per organism to stderr "
+                             "after every generation")
+    parser.add_argument('-c', '--config', metavar='PATH',
+                        help="JSON object of model parameters, any of: " + ', '.join(Config.FIELDS))
+    parser.add_argument('-l', '--landscape', metavar='PATH',
+                        help="JSON world of habitats and a grid or edges between them; migrants only "
+                             "move to neighbors (default: the four built-in habitats)")
+    parser.add_argument('--sweep', metavar='PATH',
+                        help="JSON object mapping model parameters to lists of values; runs every "
+                             "combination with every seed of --replicates and writes the results")
+    parser.add_argument('--cache', metavar='DIR', default='sweep-cache',
+                        help="where --sweep keeps results, so only new points are run, '' for no cache "
+                             "(default: %(default)s)")
+    parser.add_argument('--serve', metavar='[HOST:]PORT',
+                        help="serve the latest snapshot as JSON over HTTP while the run goes on "
+                             "(HOST defaults to 127.0.0.1)")
+    parser.add_argument('--serve-samples', type=int, default=5, metavar='N',
+                        help="organisms sampled from each habitat for --serve (default: %(default)s)")
+    parser.add_argument('--stats', metavar='PATH',
+                        help="stream per-habitat statistics for every generation to PATH "
+                             "(.csv or .jsonl, optionally .gz or .xz)")
+    return parser.parse_args(argv)
+
+
+def write_summary(summary, path):
+    """
+    Writes a batch summary as indented JSON.
+    :param summary: dict suitable for json.dumps
+    :param path: string, the file to write, or None to print to stdout
+    :return: None
+    """
+    if path:
+        with open(path, 'w') as output:
+            json.dump(summary, output, indent=2)
+            output.write("\n")
+    else:
+        print json.dumps(summary, indent=2)
+
+
+def run_ensemble_batch(args):
+    """
+    The batch mode for --replicates above 1.  Writes a JSON document with the merged curves.
+    :param args: argparse.Namespace from parse_args
+    :return: dict, the summary that was written
+    """
+    start = time.time()
+
+    def report(seed, curve):
+        if args.report_every:
+            sys.stderr.write(json.dumps({'seed': seed, 'final': curve[-1] if curve else [],
+                                         'elapsed': round(time.time() - start, 3)}) + "\n")
+            sys.stderr.flush()
+
+    seed = args.seed if args.seed is not None else 0
+    habitat_list, graph = load_landscape(args.landscape)
+    stats = run_ensemble(args.replicates, args.generations, engine=args.engine, seed=seed,
+                         processes=args.processes, habitat_list=habitat_list, callback=report,
+                         config=load_config(args.config), graph=graph, food_supply=args.food_supply,
+                         pairing=args.pairing, random_block_size=args.random_block,
+                         counter_random=args.counter_random)
+    summary = collections.OrderedDict([
+        ('replicates', args.replicates),
+        ('generations', args.generations),
+        ('engine', args.engine),
+        ('seed', seed),
+        ('food_supply', args.food_supply),
+        ('pairing', args.pairing),
+        ('random_block_size', args.random_block),
+        ('counter_random', args.counter_random),
+        ('elapsed', round(time.time() - start, 3)),
+        ('curves', stats.curves())])
+    write_summary(summary, args.output)
+    return summary
+
+
+def load_config(path):
+    """
+    :param path: string, a JSON file as given to --config, can be None
+    :return: Config object, None if path is None
+    """
+    if path is None:
+        return None
+    with open(path) as config_file:
+        return Config.from_dict(json.load(config_file))
+
+
+def load_landscape(path):
+    """
+    Reads a world of any number of habitats, as given to --landscape:
+    {"habitats": [{"name": "Forest", "temp": 3, "water_avail": 3, "food_avail": ["leaves", "seeds"],
+                   "wildlife": [["ab", 3, 3, ["leaves"]], ...]}, ...],
+     "grid": {"rows": 10, "columns": 10, "diagonal": false, "wrap": false}}
+    where each wildlife entry is [genome, temp_tol, water_needed, diet] and, in place of
+    "grid", "edges": [[0, 1], ...] lists neighbors by habitat index, with "directed": true
+    if migrants only move from the first of each pair to the second.
+    :param path: string, a JSON file, can be None
+    :return: tuple of (list of Habitat objects, HabitatGraph object), (HABITATS, None) if path is None
+    """
+    if path is None:
+        return HABITATS, None
+    with open(path) as landscape_file:
+        landscape = json.load(landscape_file)
+    habitats = [Habitat(str(habitat['name']), habitat['temp'], habitat['water_avail'],
+                        [str(food) for food in habitat['food_avail']],
+                        [Organism(str(genome), Traits(temp_tol, water_needed, [str(food) for food in diet]))
+                         for genome, temp_tol, water_needed, diet in habitat.get('wildlife', [])], [])
+                for habitat in landscape['habitats']]
+    if 'grid' in landscape:
+        grid = landscape['grid']
+        if grid['rows'] * grid['columns'] != len(habitats):
+            raise ValueError("a {}x{} grid needs {} habitats, not {}".format(
+                grid['rows'], grid['columns'], grid['rows'] * grid['columns'], len(habitats)))
+        graph = HabitatGraph.grid(grid['rows'], grid['columns'], grid.get('diagonal', False), grid.get('wrap', False))
+    else:
+        graph = HabitatGraph.from_edges(len(habitats), landscape.get('edges', []), landscape.get('directed', False))
+    return habitats, graph
+
+
+def run_sweep_batch(args):
+    """
+    The batch mode for --sweep.  Writes a JSON document with one result per point.
+    :param args: argparse.Namespace from parse_args
+    :return: dict, the summary that was written
+    """
+    start = time.time()
+    with open(args.sweep) as grid_file:
+        grid = json.load(grid_file)
+    configs = expand_grid(grid, load_config(args.config))
+    seed = args.seed if args.seed is not None else 0
+    seeds = range(seed, seed + args.replicates)
+    cache = ResultCache(args.cache) if args.cache else None
+    sources = collections.Counter()
+
+    def report(result, cached):
+        sources['cached' if cached else 'computed'] += 1
+        if args.report_every:
+            sys.stderr.write(json.dumps({'key': result['key'], 'cached': cached, 'total': result['total'],
+                                         'elapsed': round(time.time() - start, 3)}) + "\n")
+            sys.stderr.flush()
+
+    habitat_list, graph = load_landscape(args.landscape)
+    results = run_sweep(configs, seeds, args.generations, engine=args.engine, processes=args.processes,
+                        habitat_list=habitat_list, cache=cache, food_supply=args.food_supply, pairing=args.pairing,
+                        callback=report, graph=graph, random_block_size=args.random_block,
+                        counter_random=args.counter_random)
+    summary = collections.OrderedDict([
+        ('grid', grid),
+        ('points', len(configs)),
+        ('seeds', seeds),
+        ('generations', args.generations),
+        ('engine', args.engine),
+        ('computed', sources['computed']),
+        ('cached', sources['cached']),
+        ('elapsed', round(time.time() - start, 3)),
+        ('results', results)])
+    write_summary(summary, args.output)
+    return summary
+
+
+def start_server(address, samples):
+    """
+    :param address: string, [HOST:]PORT as given to --serve
+    :param samples: int, organisms sampled from each habitat
+    :return: SnapshotServer object, already serving
+    """
+    host, _, port = address.rpartition(':')
+    server = SnapshotServer(host or '127.0.0.1', int(port), samples)
+    sys.stderr.write("Serving snapshots on http://{}:{}/\n".format(*server.address))
+    return server
+
+
+def run_batch(args):
+    """
+    Runs a simulation without any prompts and writes a JSON summary of the final state.
+    :param args: argparse.Namespace from parse_args
+    :return: dict, the summary that was written
+    """
+    habitat_list, graph = load_landscape(args.landscape)
+    world = Ecosystem(habitat_list, engine=args.engine, seed=args.seed, workers=args.workers,
+                      food_supply=args.food_supply, random_block_size=args.random_block, pairing=args.pairing,
+                      config=load_config(args.config), counter_random=args.counter_random, graph=graph)
+    stats = None
+    server = None
+    try:
+        if args.stats:
+            world.track_stats()
+            stats = StatsWriter(args.stats)
+        if args.serve:
+            server = start_server(args.serve, args.serve_samples)
+            server.publish(world)
+        if args.timings:
+            world.instrument(args.generations)
+        if args.memory_report and tracemalloc is not None and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        start = time.time()
+        for generation in xrange(1, args.generations + 1):
+            world.next_generation()
+            if stats is not None:
+                stats.write_generation(world)
+            if server is not None:
+                server.publish(world)
+            if args.memory_report:
+                sys.stderr.write(json.dumps(world.memory_report()) + "\n")
+            if args.report_every and generation % args.report_every == 0:
+                progress = world.summary()
+                progress['elapsed'] = round(time.time() - start, 3)
+                sys.stderr.write(json.dumps(progress) + "\n")
+                sys.stderr.flush()
+        summary = world.summary()
+        summary['elapsed'] = round(time.time() - start, 3)
+        if world.instrumentation is not None:
+            summary['phase_seconds'] = collections.OrderedDict(
+                [(phase, round(seconds, 6)) for phase, seconds in world.instrumentation.phase_totals().items()])
+    finally:
+        if server is not None:
+            server.close()
+        if stats is not None:
+            stats.close()
+        world.close()
+    write_summary(summary, args.output)
+    return summary
+
+
+def main(argv=None):
+
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    if args.sweep is not None:
+        if args.generations is None:
+            sys.exit("--sweep needs --generations")
+        run_sweep_batch(args)
+        return
+    if args.generations is not None:
+        if args.replicates > 1:
+            run_ensemble_batch(args)
+        else:
+            run_batch(args)
+        return
 
-    world = Ecosystem(HABITATS)
+    habitat_list, graph = load_landscape(args.landscape)
+    world = Ecosystem(habitat_list, engine=args.engine, seed=args.seed, workers=args.workers,
+                      food_supply=args.food_supply, random_block_size=args.random_block, pairing=args.pairing,
+                      config=load_config(args.config), counter_random=args.counter_random, graph=graph)
+    server = start_server(args.serve, args.serve_samples) if args.serve else None
+    if server is not None:
+        server.publish(world)
 
     print "Evolution Simulator\n\n"
     while True:
@@ -309,10 +4510,9 @@ def main():
             sys.exit()
         i = 1
         while i <= generations:
-            world.breed_all()
-            world.migrate()
-            world.age_all()
-            world.remove_all_dead()
+            world.next_generation()
+            if server is not None:
+                server.publish(world)
             i += 1
         while True:
             print "\nChoose one of the following:"
@@ -327,7 +4527,8 @@ def main():
                 world.print_wildlife_totals()
             elif choice == 2:
                 print "\nOrganisms in Each Habitat: "
-                for habitat in HABITATS:
+                world.sync_wildlife()
+                for habitat in world.habitats:
                     habitat.print_wildlife()
 
 